@@ -0,0 +1,803 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Includes:
+    synthetic_rrs
+        Generate realistic synthetic Rrs bands for a sensor (oligotrophic tropical Pacific values, with land/cloud NaNs).
+    write_synthetic_l3m
+        Write synthetic global L3M band files (scaled int16 Rrs, one file per band) for a sensor and date.
+    measure
+        Time a function and record the peak memory it allocates (tracemalloc, numpy allocations are traced).
+    measure_reads
+        Bytes a function reads through read system calls (rchar of /proc/self/io, Linux only).
+    benchmark_fused_kernel
+        Compare the exact and fused (calculate_fused_chl) TPCA implementations.
+    benchmark_masked_blending
+        Compare the exact and masked (calculate_masked_chl) implementations as the fraction of pixels needing Chl OCx changes.
+    benchmark_lut
+        Compare the exact and lookup table (calculate_lut_chl) implementations, with their relative error.
+    benchmark_float32
+        Accuracy, time and memory of dtype=np.float32 against float64 TPCA on the matchup databases and synthetic global grids.
+    benchmark_tiled_processing
+        Peak memory and time of chl_tiling.process_tiled for several tile sizes against one whole grid block.
+    benchmark_profiling
+        Overhead of chl_profiling on process_tiled (disabled, enabled and with memory tracing), with the stage summary table.
+    benchmark_region_cutout
+        Array bytes, measured file bytes read and time of the roll based tropical Pacific cutout against chl_regions.open_region.
+    benchmark_product_cache
+        chl_cache.cached_region_chl on a cache miss against a cache hit.
+    benchmark_compositing
+        chl_composites.Compositor streaming days into 8 day composites, against stacking the days.
+    benchmark_uncertainty
+        Time and peak memory of chl_uncertainty.monte_carlo_chl for several chunk sizes.
+    benchmark_output_writer
+        Write time and file size of float64 to_netcdf against chl_output products (float32 and packed int16), and parallel write_day.
+    benchmark_bias_statistics
+        chl_statistics.bias_statistics with many matchups and candidate models.
+    benchmark_matchup_loading
+        pd.read_csv of the matchup databases against the chl_matchups memory mapped cache.
+    benchmark_bootstrap
+        chl_bootstrap.stratified_bootstrap CIs on the three matchup databases.
+    benchmark_grid_search
+        chl_fitting.evaluate_candidates against calling the sensor function once per candidate.
+    benchmark_matchup_extraction
+        Observations per second of chl_matchup_extraction.extract_matchups against reading each observation's window separately.
+
+    run_suite
+        Benchmark suite of the sensor functions (matchup, cutout, global 9km and 4km sizes), cut_tropical_pacific,
+        check_bias and plot_linear_trend, reporting time, throughput (pixels/s) and peak memory.
+    append_history / load_history
+        Keep every suite run (with the commit, versions and platform) in a json lines history file.
+    save_baseline / check_regressions
+        Save a suite run as the baseline, and flag benchmarks slower (time_tolerance) or larger (memory_tolerance) than it.
+
+Usage:
+    python chl_benchmarks.py
+    python chl_benchmarks.py suite --sizes matchup cutout global_9km --save-baseline
+    python chl_benchmarks.py suite --sizes matchup cutout global_9km #Exits with 1 when a benchmark regressed
+
+@author: npittman
+"""
+
+import os
+import time
+import tracemalloc
+import numpy as np                   #Version '1.16.1'
+import netCDF4                       #Version '1.5.1.2'
+
+from chl_tpca_algorithms import tpca_workspace, calculate_chl_ci, SENSOR_WAVELENGTHS, SENSOR_FUNCTIONS, SENSOR_BANDS
+
+def synthetic_rrs(shape,sensor='seawifs',nan_fraction=0.3,dtype=np.float64,seed=0):
+    """
+    Given a shape and sensor, returns a list of Rrs bands in the argument order of the sensor function.
+    Values are drawn around the matchup database ranges (chl ~0.02 - 1 mg m^-3). nan_fraction of pixels are NaN in every band (land/cloud).
+    """
+    rng=np.random.RandomState(seed)
+    r443=rng.uniform(0.002,0.015,shape)
+    r490=r443*rng.uniform(0.6,0.95,shape)
+    r510=r443*rng.uniform(0.35,0.7,shape)
+    green=rng.uniform(0.0009,0.0035,shape)
+    red=rng.uniform(0.00001,0.0004,shape)
+    if sensor=='modis':
+        bands=[r443,r490,green,red]
+    else:
+        bands=[r443,r490,r510,green,red]
+    missing=rng.uniform(size=shape)<nan_fraction
+    for band in bands:
+        band[missing]=np.nan
+    return [band.astype(dtype) for band in bands]
+
+def write_synthetic_l3m(path,sensor='seawifs',date='2000-01-01',shape=(2160,4320),resolution='9km',nan_fraction=0.3,seed=0):
+    """
+    Write one synthetic global L3M file per band into path, named as the NASA files (see chl_tiling.l3m_filename).
+    Rrs is stored as the L3M int16 with scale_factor / add_offset and a -32767 fill value, lat is 90 to -90 and lon -180 to 180.
+    Returns the list of files in the sensor function argument order.
+    """
+    from chl_tiling import l3m_filename
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    n_lat,n_lon=shape
+    lat=90-(np.arange(n_lat)+0.5)*(180/n_lat)
+    lon=-180+(np.arange(n_lon)+0.5)*(360/n_lon)
+    bands=synthetic_rrs(shape,sensor,nan_fraction=nan_fraction,seed=seed)
+    files=[]
+    for band,data in zip(SENSOR_BANDS[sensor],bands):
+        fileloc=os.path.join(path,l3m_filename(sensor,date,band,resolution=resolution))
+        with netCDF4.Dataset(fileloc,'w') as ds:
+            ds.createDimension('lat',n_lat)
+            ds.createDimension('lon',n_lon)
+            ds.createVariable('lat','f4',('lat',))[:]=lat
+            ds.createVariable('lon','f4',('lon',))[:]=lon
+            ds.variables['lat'].units='degrees_north'
+            ds.variables['lon'].units='degrees_east'
+            var=ds.createVariable(band,'i2',('lat','lon'),fill_value=-32767,zlib=True,chunksizes=(min(n_lat,64),min(n_lon,64)))
+            var.scale_factor=np.float32(2e-06)
+            var.add_offset=np.float32(0.05)
+            var.units='sr^-1'
+            var[:]=np.ma.array(np.where(np.isnan(data),0.05,data),mask=np.isnan(data))
+        files.append(fileloc)
+    return files
+
+def measure(func,*args,repeat=3,**kwargs):
+    """Returns (best wall time in s, peak traced memory in bytes, result) of func(*args,**kwargs)"""
+    times=[]
+    for i in range(repeat):
+        start=time.perf_counter()
+        result=func(*args,**kwargs)
+        times.append(time.perf_counter()-start)
+        del result
+    tracemalloc.start()
+    result=func(*args,**kwargs)
+    _,peak=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times),peak,result
+
+def _read_chars():
+    try:
+        with open('/proc/self/io') as f:
+            return int(dict(line.split(':') for line in f)['rchar'])
+    except (IOError,KeyError,ValueError):
+        return None
+
+def measure_reads(func,*args,**kwargs):
+    """
+    Returns (bytes read, result) of func(*args,**kwargs). Bytes read are the rchar difference of /proc/self/io:
+    every byte returned by read system calls (netCDF / HDF5 reads, including page cache hits), None where /proc/self/io does not exist.
+    """
+    start=_read_chars()
+    result=func(*args,**kwargs)
+    end=_read_chars()
+    return (None if start is None or end is None else end-start),result
+
+def benchmark_fused_kernel(shape=(480,2040),sensor='seawifs',repeat=3,printer=1):
+    """
+    Benchmark the exact sensor function against mode='fused', with and without a preallocated workspace.
+    Default shape is the 9km tropical Pacific cutout, (4320,8640) is the 9km global grid.
+    """
+    bands=synthetic_rrs(shape,sensor)
+    bands[-2].flat[:20:2]=0       #Zero and negative green Rrs, an infinite / NaN max band ratio
+    bands[-2].flat[1:20:2]=-1e-4
+    func=SENSOR_FUNCTIONS[sensor]
+    exact_t,exact_mem,exact=measure(func,*bands,repeat=repeat)
+    fused_t,fused_mem,fused=measure(func,*bands,mode='fused',repeat=repeat)
+    work=tpca_workspace(shape)
+    out=np.empty(shape)
+    prealloc_t,prealloc_mem,_=measure(func,*bands,mode='fused',out=out,workspace=work,repeat=repeat)
+    max_rel_err=np.nanmax(np.abs(fused-exact)/exact)
+    nan_mismatches=int(np.count_nonzero(np.isnan(fused)!=np.isnan(exact)))
+    results={'shape':shape,'sensor':sensor,
+             'exact_time':exact_t,'exact_peak_bytes':exact_mem,
+             'fused_time':fused_t,'fused_peak_bytes':fused_mem,
+             'prealloc_time':prealloc_t,'prealloc_peak_bytes':prealloc_mem,
+             'max_rel_err':max_rel_err,'nan_mismatches':nan_mismatches}
+    if printer==1:
+        print(sensor,shape)
+        print('  exact:             ',np.round(exact_t,3),'s',np.round(exact_mem/1e6,1),'MB peak')
+        print('  fused:             ',np.round(fused_t,3),'s',np.round(fused_mem/1e6,1),'MB peak')
+        print('  fused (workspace): ',np.round(prealloc_t,3),'s',np.round(prealloc_mem/1e6,1),'MB peak')
+        print('  max relative error:',max_rel_err)
+        print('  NaN mismatches:    ',nan_mismatches,'(including zero / negative green Rrs)')
+    return results
+
+def benchmark_masked_blending(shape=(480,2040),sensor='seawifs',ocx_fractions=(0.05,0.25,0.5,0.75,1.0),window_width=0.05,repeat=3,printer=1):
+    """
+    Benchmark mode='masked' against the exact sensor function.
+    For each fraction, l is set to the Chl CI quantile leaving that fraction of valid pixels with Chl CI >= l (needing Chl OCx),
+    and h=l+window_width. A fraction of 1.0 is the TPCA default (l=0), ~0.25 is typical of the NASA window (l=0.15) in the tropical Pacific.
+    """
+    bands=synthetic_rrs(shape,sensor)
+    func=SENSOR_FUNCTIONS[sensor]
+    blue,green,red=bands[0],bands[-2],bands[-1]
+    b,g,r=SENSOR_WAVELENGTHS[sensor]
+    chl_ci=calculate_chl_ci([-0.4909, 191.6590],green-(blue+(g-b)/(r-b)*(red-blue)))
+    results=[]
+    for fraction in ocx_fractions:
+        l=0 if fraction>=1 else np.nanquantile(chl_ci,1-fraction)
+        h=l+window_width
+        exact_t,exact_mem,exact=measure(func,*bands,l=l,h=h,repeat=repeat)
+        masked_t,masked_mem,masked=measure(func,*bands,l=l,h=h,mode='masked',repeat=repeat)
+        identical=bool(np.all((exact==masked)|(np.isnan(exact)&np.isnan(masked)))) #np.array_equal has no equal_nan in numpy 1.16
+        results.append({'shape':shape,'sensor':sensor,'ocx_fraction':fraction,'l':l,'h':h,
+                        'exact_time':exact_t,'exact_peak_bytes':exact_mem,
+                        'masked_time':masked_t,'masked_peak_bytes':masked_mem,
+                        'identical':identical})
+        if printer==1:
+            print(sensor,shape,'OCx fraction:',fraction,'l:',np.round(l,4),'h:',np.round(h,4))
+            print('  exact: ',np.round(exact_t,3),'s',np.round(exact_mem/1e6,1),'MB peak')
+            print('  masked:',np.round(masked_t,3),'s',np.round(masked_mem/1e6,1),'MB peak','identical:',identical)
+    return results
+
+def benchmark_lut(shape=(2160,4320),sensor='seawifs',repeat=3,printer=1):
+    """
+    Benchmark mode='lut' against the exact sensor function (the first call, which builds the tables, is timed separately),
+    with the relative error on the synthetic grid and the table error over the whole table range (lut_error).
+    """
+    from chl_tpca_algorithms import lut_table, lut_error, sensor_coefficients
+    bands=synthetic_rrs(shape,sensor)
+    func=SENSOR_FUNCTIONS[sensor]
+    lut_table.cache_clear()
+    start=time.perf_counter()
+    func(*bands,mode='lut')
+    build_t=time.perf_counter()-start
+    exact_t,exact_mem,exact=measure(func,*bands,repeat=repeat)
+    lut_t,lut_mem,lut=measure(func,*bands,mode='lut',repeat=repeat)
+    defaults=sensor_coefficients(sensor)
+    table_error=lut_error(defaults['ocx_poly'],defaults['ci_poly'])
+    max_rel_err=np.nanmax(np.abs(lut-exact)/exact)
+    results={'shape':shape,'sensor':sensor,'build_time':build_t,
+             'exact_time':exact_t,'exact_peak_bytes':exact_mem,
+             'lut_time':lut_t,'lut_peak_bytes':lut_mem,
+             'max_rel_err':max_rel_err,'table_ocx_err':table_error['ocx'],'table_ci_err':table_error['ci']}
+    if printer==1:
+        print(sensor,shape)
+        print('  exact:',np.round(exact_t,3),'s',np.round(exact_mem/1e6,1),'MB peak')
+        print('  lut:  ',np.round(lut_t,3),'s',np.round(lut_mem/1e6,1),'MB peak (first call',np.round(build_t,3),'s)')
+        print('  max relative error:',max_rel_err,'table error:',table_error)
+    return results
+
+def benchmark_float32(shape=(2160,4320),repeat=3,printer=1):
+    """
+    Accuracy report of dtype=np.float32 against float64 TPCA for every sensor, on the matchup databases
+    (relative error of TPCA chl and the change in the matchup MAE / median log bias) and on synthetic global grids
+    (relative error, time and peak memory).
+    """
+    from chl_matchups import load_matchups
+    from chl_statistics import bias_statistics
+    from chl_tpca_algorithms import MATCHUP_BANDS
+    results=[]
+    for sensor,func in SENSOR_FUNCTIONS.items():
+        matchups=load_matchups(sensor)
+        bands=[matchups[band].values for band in MATCHUP_BANDS[sensor]]
+        chl64=func(*bands,dtype=np.float64)
+        chl32=func(*bands,dtype=np.float32)
+        rel_err=np.abs(chl32-chl64)/chl64
+        summary=bias_statistics(matchups.in_situ_chl,[chl64,chl32.astype(np.float64)],names=['float64','float32'])[0]
+        results.append({'sensor':sensor,'data':'matchups','n':len(matchups),'dtype':str(chl32.dtype),
+                        'max_rel_err':np.nanmax(rel_err),'median_rel_err':np.nanmedian(rel_err),
+                        'mae_diff':summary.mae['float32']-summary.mae['float64'],
+                        'median_log_bias_diff':summary.median_log_bias['float32']-summary.median_log_bias['float64']})
+
+        grid64=synthetic_rrs(shape,sensor)
+        grid32=[band.astype(np.float32) for band in grid64]
+        t64,mem64,chl64=measure(func,*grid64,repeat=repeat)
+        t32,mem32,chl32=measure(func,*grid32,dtype=np.float32,repeat=repeat)
+        rel_err=np.abs(chl32-chl64)/chl64
+        results.append({'sensor':sensor,'data':'synthetic '+str(shape),'n':int(np.sum(~np.isnan(chl64))),'dtype':str(chl32.dtype),
+                        'max_rel_err':np.nanmax(rel_err),'median_rel_err':np.nanmedian(rel_err),
+                        'float64_time':t64,'float64_peak_bytes':mem64,'float32_time':t32,'float32_peak_bytes':mem32})
+    if printer==1:
+        for r in results:
+            print(r['sensor'],r['data'],r['n'],'pixels, output',r['dtype'])
+            print('  relative error: max',r['max_rel_err'],'median',r['median_rel_err'])
+            if 'mae_diff' in r:
+                print('  MAE change:',r['mae_diff'],'median log bias change:',r['median_log_bias_diff'])
+            else:
+                print('  float64:',np.round(r['float64_time'],3),'s',np.round(r['float64_peak_bytes']/1e6,1),'MB peak')
+                print('  float32:',np.round(r['float32_time'],3),'s',np.round(r['float32_peak_bytes']/1e6,1),'MB peak')
+    return results
+
+def benchmark_tiled_processing(shape=(2160,4320),sensor='seawifs',tile_rows=(64,256,1024),path=None,repeat=1,printer=1):
+    """Write synthetic L3M files, then process them with process_tiled using each tile_rows and a single whole grid block"""
+    import shutil
+    import tempfile
+    from chl_tiling import process_tiled
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    try:
+        files=write_synthetic_l3m(path,sensor,shape=shape)
+        output=os.path.join(path,'tpca_tiled.nc')
+        results=[]
+        for rows in list(tile_rows)+[shape[0]]:
+            t,mem,_=measure(process_tiled,files,output,sensor,tile_rows=rows,repeat=repeat)
+            results.append({'shape':shape,'sensor':sensor,'tile_rows':rows,'time':t,'peak_bytes':mem})
+            if printer==1:
+                print(sensor,shape,'tile rows:',rows,np.round(t,3),'s',np.round(mem/1e6,1),'MB peak')
+    finally:
+        if tmp:
+            shutil.rmtree(path)
+    return results
+
+def benchmark_profiling(shape=(2160,4320),sensor='seawifs',tile_rows=256,path=None,repeat=3,printer=1):
+    """Time process_tiled without a profiler, with a Profiler and with Profiler(memory=1), printing the stage summary of a profiled day"""
+    import shutil
+    import tempfile
+    from chl_tiling import process_tiled
+    from chl_profiling import Profiler, summary_table
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    try:
+        files=write_synthetic_l3m(path,sensor,shape=shape)
+        output=os.path.join(path,'tpca_profiled.nc')
+        results={'shape':shape,'sensor':sensor}
+        for name,memory in [('disabled',None),('enabled',0),('memory',1)]:
+            times=[]
+            for i in range(repeat):
+                profiler=None if memory is None else Profiler(day='2000-01-01',memory=memory)
+                start=time.perf_counter()
+                process_tiled(files,output,sensor,tile_rows=tile_rows,profiler=profiler)
+                times.append(time.perf_counter()-start)
+                if profiler is not None:
+                    profiler.close()
+            results[name+'_time']=min(times)
+            if memory==0:
+                results['summary']=summary_table(profiler.records)
+        if printer==1:
+            print('profiling',sensor,shape,'tile rows:',tile_rows)
+            for name in ['disabled','enabled','memory']:
+                print('  '+name.ljust(9),np.round(results[name+'_time'],3),'s',np.round(100*(results[name+'_time']/results['disabled_time']-1),1),'% overhead')
+            print(results['summary'].to_string())
+    finally:
+        if tmp:
+            shutil.rmtree(path)
+    return results
+
+def roll_cut_tropical_pacific(chl_dataset):
+    """The original roll based cutout from example_seawifs_download.py, kept as the reference for benchmark_region_cutout"""
+    chl_dataset=chl_dataset.assign_coords(lon=(chl_dataset.lon % 360)).roll(lon=(chl_dataset.sizes['lon'] // 2),roll_coords=True)
+    return chl_dataset.sel(lat=slice(20,-20),lon=slice(120,290))
+
+def benchmark_region_cutout(shape=(2160,4320),sensor='seawifs',path=None,repeat=3,printer=1):
+    """
+    Open the synthetic L3M band files lazily, cut the tropical Pacific with the roll (which reads the whole grid)
+    and with open_region (which reads only the two region hyperslabs), and load the result.
+    Array bytes are the decoded (float32) bytes of the band variables indexed from disk, file bytes read are measured (measure_reads).
+    """
+    import shutil
+    import tempfile
+    import xarray as xr
+    from chl_regions import open_region
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    try:
+        files=write_synthetic_l3m(path,sensor,shape=shape)
+
+        def roll_cut():
+            return roll_cut_tropical_pacific(xr.merge([xr.open_dataset(fileloc) for fileloc in files])).load()
+        def region_cut():
+            return open_region(files,'tropical_pacific',chunks=None).load()
+
+        roll_t,roll_mem,rolled=measure(roll_cut,repeat=repeat)
+        region_t,region_mem,cut=measure(region_cut,repeat=repeat)
+        identical=rolled.identical(cut)
+        full_bytes=sum(np.prod(shape)*4 for band in SENSOR_BANDS[sensor]) #Decoded float32
+        region_bytes=sum(cut[band].nbytes for band in SENSOR_BANDS[sensor])
+        roll_read,_=measure_reads(roll_cut)
+        region_read,_=measure_reads(region_cut)
+        results={'shape':shape,'sensor':sensor,
+                 'roll_time':roll_t,'roll_peak_bytes':roll_mem,'roll_array_bytes':full_bytes,'roll_bytes_read':roll_read,
+                 'region_time':region_t,'region_peak_bytes':region_mem,'region_array_bytes':region_bytes,'region_bytes_read':region_read,
+                 'identical':identical}
+        if printer==1:
+            megabytes=lambda b: 'n/a' if b is None else np.round(b/1e6,1)
+            print(sensor,shape,'tropical Pacific cutout, identical:',identical)
+            print('  roll:  ',np.round(roll_t,3),'s',megabytes(full_bytes),'MB array',megabytes(roll_read),'MB read from files',megabytes(roll_mem),'MB peak')
+            print('  region:',np.round(region_t,3),'s',megabytes(region_bytes),'MB array',megabytes(region_read),'MB read from files',megabytes(region_mem),'MB peak')
+    finally:
+        if tmp:
+            shutil.rmtree(path)
+    return results
+
+def benchmark_product_cache(shape=(2160,4320),sensor='seawifs',region='tropical_pacific',path=None,printer=1):
+    """Time chl_cache.cached_region_chl on a miss (open_region and the sensor function) and a hit (reading the cached product)"""
+    import shutil
+    import tempfile
+    from chl_cache import ProductCache, cached_region_chl
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    try:
+        files=write_synthetic_l3m(path,sensor,shape=shape)
+        cache=ProductCache(os.path.join(path,'cache'))
+        miss_t,miss_mem,_=measure(cached_region_chl,files,sensor,region,cache,repeat=1)
+        hit_t,hit_mem,_=measure(cached_region_chl,files,sensor,region,cache,repeat=3)
+        results={'shape':shape,'sensor':sensor,'region':region,'miss_time':miss_t,'miss_peak_bytes':miss_mem,'hit_time':hit_t,'hit_peak_bytes':hit_mem}
+        results.update(cache.stats())
+        if printer==1:
+            print('product cache',sensor,region,shape)
+            print('  miss:',np.round(miss_t,3),'s',np.round(miss_mem/1e6,1),'MB peak')
+            print('  hit: ',np.round(hit_t,3),'s',np.round(hit_mem/1e6,1),'MB peak')
+            print('  stats:',cache.stats())
+    finally:
+        if tmp:
+            shutil.rmtree(path)
+    return results
+
+def benchmark_compositing(shape=(1080,2160),n_days=16,period='8day',path=None,printer=1):
+    """
+    Peak memory and time of chl_composites.Compositor fed one synthetic TPCA day at a time,
+    against stacking the days and using np.nanmean / np.nanvar, with the largest relative difference of the means.
+    """
+    import shutil
+    import tempfile
+    import warnings
+    from chl_composites import Compositor, period_bounds, read_composite
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    try:
+        func=SENSOR_FUNCTIONS['seawifs']
+        dates=np.arange(np.datetime64('2000-01-01'),np.datetime64('2000-01-01')+n_days)
+        days=[func(*synthetic_rrs(shape,seed=i)) for i in range(n_days)]
+
+        def stream():
+            compositor=Compositor(shape,period,path)
+            for date,chl in zip(dates,days):
+                compositor.add(date,chl)
+            return compositor.close()
+        def stack():
+            keys=np.array([period_bounds(date,period)[0] for date in dates])
+            results={}
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore',RuntimeWarning)
+                for key in np.unique(keys):
+                    days_stack=np.array([chl for chl,k in zip(days,keys) if k==key])
+                    results[key]=(np.nanmean(days_stack,axis=0),np.nanvar(days_stack,axis=0,ddof=1))
+            return results
+        stream_t,stream_mem,files=measure(stream,repeat=1)
+        stack_t,stack_mem,stacked=measure(stack,repeat=1)
+        max_rel_diff=0
+        for fileloc in files:
+            composite=read_composite(fileloc)
+            mean=stacked[composite['attrs']['key']][0]
+            max_rel_diff=max(max_rel_diff,np.nanmax(np.abs(composite['mean']-mean)/mean))
+        results={'shape':shape,'n_days':n_days,'period':period,'stream_time':stream_t,'stream_peak_bytes':stream_mem,
+                 'stack_time':stack_t,'stack_peak_bytes':stack_mem,'max_rel_diff':max_rel_diff}
+        if printer==1:
+            print('compositing',n_days,'days',shape,period)
+            print('  streaming:',np.round(stream_t,3),'s',np.round(stream_mem/1e6,1),'MB peak')
+            print('  stacked:  ',np.round(stack_t,3),'s',np.round(stack_mem/1e6,1),'MB peak')
+            print('  max relative difference of the means:',max_rel_diff)
+    finally:
+        if tmp:
+            shutil.rmtree(path)
+    return results
+
+def benchmark_uncertainty(shape=(480,2040),sensor='seawifs',n_members=50,chunk_sizes=(2**18,2**20,2**22),printer=1):
+    """Time and peak memory of a Monte Carlo ensemble of the cutout for each chunk_size, the ensemble itself would be n_members x pixels x bands x 8 bytes"""
+    from chl_uncertainty import monte_carlo_chl
+    bands=synthetic_rrs(shape,sensor)
+    results=[]
+    for chunk_size in chunk_sizes:
+        t,mem,result=measure(monte_carlo_chl,bands,sensor,n_members=n_members,chunk_size=chunk_size,repeat=1)
+        results.append({'shape':shape,'sensor':sensor,'n_members':n_members,'chunk_size':chunk_size,'time':t,'peak_bytes':mem,
+                        'median_log10_std':np.nanmedian(result['log10_std'])})
+        if printer==1:
+            print('monte carlo',sensor,shape,n_members,'members, chunk size:',chunk_size,np.round(t,2),'s',np.round(mem/1e6,1),'MB peak',
+                  '(full ensemble',np.round(n_members*np.prod(shape)*len(bands)*8/1e6,1),'MB)')
+    return results
+
+def _write_output_day(args):
+    from chl_output import write_day
+    fileloc,date,shape,lat,lon,options=args
+    chl=synthetic_chl(shape,seed=int(np.datetime64(date,'D').astype(np.int64)))
+    return write_day(fileloc,date,chl,lat,lon,'seawifs',**options)
+
+def synthetic_chl(shape=(2160,4320),nan_fraction=0.3,seed=0):
+    """TPCA chl of synthetic_rrs (seawifs), a realistic field for the output benchmarks"""
+    return SENSOR_FUNCTIONS['seawifs'](*synthetic_rrs(shape,'seawifs',nan_fraction=nan_fraction,seed=seed))
+
+def benchmark_output_writer(shape=(2160,4320),n_days=8,processes=4,pack=(0,5),path=None,printer=1):
+    """
+    Time and on disk size of one day of chl written with xarray to_netcdf (float64, uncompressed, as example_seawifs_download.py),
+    as a chl_output float32 zlib product and as a packed int16 product,
+    and the days/s of write_day over n_days serially and across a process pool (disjoint day files).
+    """
+    import shutil
+    import tempfile
+    import xarray as xr
+    from concurrent.futures import ProcessPoolExecutor
+    from chl_output import write_day
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    lat=np.linspace(90,-90,shape[0])
+    lon=np.linspace(-180,180,shape[1])
+    chl=synthetic_chl(shape)
+    results=[]
+    def to_netcdf(fileloc):
+        xr.DataArray(chl,coords=[('lat',lat),('lon',lon)],name='chl_tpca').to_netcdf(fileloc)
+    writers=[('to_netcdf float64',to_netcdf),
+             ('chl_output float32',lambda fileloc: write_day(fileloc,'2000-01-01',chl,lat,lon)),
+             ('chl_output int16',lambda fileloc: write_day(fileloc,'2000-01-01',chl,lat,lon,pack=pack))]
+    for i,(name,writer) in enumerate(writers):
+        fileloc=os.path.join(path,'writer_'+str(i)+'.nc')
+        t,mem,_=measure(writer,fileloc,repeat=1)
+        results.append({'writer':name,'shape':shape,'time':t,'peak_bytes':mem,'file_bytes':os.path.getsize(fileloc)})
+        if printer==1:
+            print('output',name.ljust(20),shape,np.round(t,3),'s',np.round(os.path.getsize(fileloc)/1e6,2),'MB on disk',np.round(mem/1e6,1),'MB peak')
+
+    dates=[str(np.datetime64('2000-01-01')+i) for i in range(n_days)]
+    for workers in [1,processes]:
+        args=[(os.path.join(path,'day_'+str(workers)+'_'+date+'.nc'),date,shape,lat,lon,{'pack':pack}) for date in dates]
+        start=time.perf_counter()
+        if workers==1:
+            list(map(_write_output_day,args))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(_write_output_day,args))
+        t=time.perf_counter()-start
+        results.append({'writer':'write_day x'+str(workers),'shape':shape,'time':t,'days_per_second':n_days/t})
+        if printer==1:
+            print('output write_day',n_days,'days,',workers,'processes (including synthetic chl):',np.round(t,2),'s',np.round(n_days/t,2),'days/s')
+    if tmp:
+        shutil.rmtree(path)
+    return results
+
+def benchmark_bias_statistics(n_matchups=1000000,n_models=24,repeat=3,printer=1):
+    """Time bias_statistics on log-normal synthetic in situ chl and n_models noisy model estimates"""
+    from chl_statistics import bias_statistics
+    rng=np.random.RandomState(0)
+    in_situ=rng.lognormal(-2,0.5,n_matchups)
+    models=in_situ*rng.lognormal(0,0.3,(n_models,n_matchups))
+    t,mem,_=measure(bias_statistics,in_situ,models,repeat=repeat)
+    results={'n_matchups':n_matchups,'n_models':n_models,'time':t,'peak_bytes':mem,'matchups_per_s':n_matchups*n_models/t}
+    if printer==1:
+        print('bias_statistics',n_matchups,'matchups x',n_models,'models:',np.round(t,3),'s',np.round(mem/1e6,1),'MB peak')
+    return results
+
+def benchmark_matchup_loading(repeat=10,printer=1):
+    """Time pd.read_csv of each matchup database against chl_matchups.load_matchups / load_columns (cache already built)"""
+    import pandas as pd
+    from chl_matchups import matchup_file, load_matchups, load_columns
+    results=[]
+    for sensor in SENSOR_FUNCTIONS:
+        load_columns(sensor) #Build the cache
+        csv_t,csv_mem,_=measure(pd.read_csv,matchup_file(sensor),repeat=repeat)
+        df_t,df_mem,_=measure(load_matchups,sensor,repeat=repeat)
+        col_t,col_mem,_=measure(load_columns,sensor,repeat=repeat)
+        results.append({'sensor':sensor,'csv_time':csv_t,'csv_peak_bytes':csv_mem,'load_matchups_time':df_t,'load_matchups_peak_bytes':df_mem,
+                        'load_columns_time':col_t,'load_columns_peak_bytes':col_mem})
+        if printer==1:
+            print('matchup loading',sensor)
+            print('  read_csv:     ',np.round(csv_t*1e3,2),'ms',np.round(csv_mem/1e6,2),'MB peak')
+            print('  load_matchups:',np.round(df_t*1e3,2),'ms',np.round(df_mem/1e6,2),'MB peak')
+            print('  load_columns: ',np.round(col_t*1e3,2),'ms',np.round(col_mem/1e6,2),'MB peak')
+    return results
+
+def benchmark_bootstrap(n_resamples=10000,by=None,processes=1,printer=1):
+    """Time n_resamples bootstrap CIs of TPCA_chl and NASA_chlor_a on each matchup database"""
+    from chl_matchups import load_matchups
+    from chl_bootstrap import stratified_bootstrap
+    results=[]
+    for sensor in SENSOR_FUNCTIONS:
+        matchups=load_matchups(sensor)
+        t,mem,_=measure(stratified_bootstrap,matchups,by=by,n_resamples=n_resamples,processes=processes,repeat=1)
+        results.append({'sensor':sensor,'n_matchups':len(matchups),'n_resamples':n_resamples,'by':by,'time':t,'peak_bytes':mem})
+        if printer==1:
+            print('bootstrap',sensor,len(matchups),'matchups x',n_resamples,'resamples, by',by,':',np.round(t,3),'s',np.round(mem/1e6,1),'MB peak')
+    return results
+
+def benchmark_grid_search(sensor='seawifs',n_l=30,n_h=70,loop_candidates=200,printer=1):
+    """
+    Time the broadcast (candidates x matchups) evaluation of a blending window grid on the training matchups,
+    against the sensor function and bias_statistics called once per candidate (timed on loop_candidates and scaled up).
+    """
+    from chl_matchups import load_matchups
+    from chl_fitting import matchup_predictors, candidate_grid, evaluate_candidates
+    from chl_statistics import bias_statistics
+    from chl_tpca_algorithms import MATCHUP_BANDS
+    matchups=load_matchups(sensor)
+    train=matchups[matchups.validation_set==0]
+    ocx,ci,l,h=candidate_grid([[0.3255,-2.7677,2.4409,-1.1288,-0.4990]],[[-0.4909,191.6590]],np.linspace(0,0.3,n_l),np.linspace(0.05,0.75,n_h))
+    predictors=matchup_predictors(train,sensor)
+    grid_t,grid_mem,_=measure(evaluate_candidates,*predictors,ocx,ci,l,h,repeat=1)
+
+    bands=[train[band] for band in MATCHUP_BANDS[sensor]]
+    func=SENSOR_FUNCTIONS[sensor]
+    def loop():
+        for i in range(min(loop_candidates,len(l))):
+            bias_statistics(train.in_situ_chl,[func(*bands,ocx_poly=list(ocx[i]),ci_poly=list(ci[i]),l=l[i],h=h[i])])
+    loop_t,_,_=measure(loop,repeat=1)
+    loop_t=loop_t/min(loop_candidates,len(l))*len(l)
+    results={'sensor':sensor,'n_candidates':len(l),'n_matchups':len(predictors[0]),'grid_time':grid_t,'grid_peak_bytes':grid_mem,'loop_time':loop_t}
+    if printer==1:
+        print('grid search',sensor,len(l),'candidates x',len(predictors[0]),'matchups')
+        print('  broadcast:   ',np.round(grid_t,3),'s',np.round(grid_mem/1e6,1),'MB peak')
+        print('  per candidate:',np.round(loop_t,3),'s (scaled from',min(loop_candidates,len(l)),'candidates)')
+    return results
+
+def benchmark_matchup_extraction(n_obs=2000,n_days=10,shape=(2160,4320),sensor='seawifs',naive_obs=50,path=None,printer=1):
+    """
+    Time extract_matchups on n_obs random tropical Pacific observations spread over n_days synthetic days,
+    against opening the band files and computing the window once per observation (timed on naive_obs and scaled up).
+    """
+    import shutil
+    import tempfile
+    import pandas as pd
+    from chl_matchup_extraction import extract_matchups, grid_indices
+    from chl_tiling import open_bands, read_bands
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    try:
+        dates=pd.date_range('2000-01-01',periods=n_days)
+        band_files=[write_synthetic_l3m(path,sensor,date.strftime('%Y-%m-%d'),shape=shape,seed=i) for i,date in enumerate(dates)]
+        rng=np.random.RandomState(0)
+        obs=pd.DataFrame({'obs_date':dates[rng.randint(2,n_days-2,n_obs)].strftime('%Y-%m-%d'),
+                          'obs_lat':rng.uniform(-20,20,n_obs),'obs_lon':rng.uniform(120,290,n_obs),'in_situ_chl':rng.uniform(0.05,1,n_obs)})
+        t,mem,_=measure(extract_matchups,obs,path,sensor,chlor_a=0,repeat=1)
+
+        func=SENSOR_FUNCTIONS[sensor]
+        def naive():
+            for i in range(naive_obs):
+                day=np.nonzero(dates==obs.obs_date[i])[0][0]
+                chl=[]
+                for files in band_files[day-2:day+3]:
+                    datasets,variables=open_bands(files,sensor)
+                    lat,lon=datasets[0].variables['lat'][:],datasets[0].variables['lon'][:]
+                    row,col=grid_indices(lat,lon,obs.obs_lat[i:i+1].values,obs.obs_lon[i:i+1].values)
+                    chl.append(func(*read_bands(variables,slice(row[0]-1,row[0]+2),slice(col[0]-1,col[0]+2))))
+                    for ds in datasets:
+                        ds.close()
+                np.nanmean(chl)
+        naive_t,_,_=measure(naive,repeat=1)
+        naive_t=naive_t/naive_obs*n_obs
+        results={'sensor':sensor,'n_obs':n_obs,'n_days':n_days,'time':t,'peak_bytes':mem,'obs_per_second':n_obs/t,'naive_obs_per_second':n_obs/naive_t}
+        if printer==1:
+            print('matchup extraction',sensor,n_obs,'observations over',n_days,'days',shape)
+            print('  grouped by day:',np.round(t,3),'s',np.round(n_obs/t,1),'obs/s',np.round(mem/1e6,1),'MB peak')
+            print('  per observation:',np.round(naive_t,3),'s',np.round(n_obs/naive_t,1),'obs/s (scaled from',naive_obs,'observations)')
+    finally:
+        if tmp:
+            shutil.rmtree(path)
+    return results
+
+SUITE_SHAPES={'matchup':(2400,),             #Matchup database size
+              'cutout':(480,2040),            #9km tropical Pacific cutout
+              'global_9km':(2160,4320),
+              'global_4km':(4320,8640)}       #~2.7 GB peak (plus ~1.5 GB of bands) for the float64 sensor functions
+
+def _suite_record(name,size,t,mem,pixels):
+    return {'name':name,'size':size,'time':t,'peak_bytes':mem,'pixels':int(pixels),'pixels_per_second':pixels/t}
+
+def run_suite(sizes=tuple(SUITE_SHAPES),nan_fraction=0.3,repeat=3,path=None,printer=1):
+    """
+    Given:
+        sizes - SUITE_SHAPES of the synthetic Rrs for the sensor functions
+        path - Directory for the synthetic L3M files (a removed temporary directory when None)
+        nan_fraction - Fraction of land / cloud pixels in the synthetic Rrs
+        repeat - Best of repeat timings
+
+    Calculate:
+        The time, peak memory and throughput (pixels/s) of
+            calculate_seawifs_chl, calculate_modis_chl and calculate_meris_chl at each size,
+            cut_tropical_pacific (chl_regions.cut_region) of synthetic global 9km L3M files, loaded from disk,
+            check_bias(plot=0) and plot_linear_trend(plot=0) of TPCA_chl and NASA_chlor_a on each matchup database.
+
+    Returns:
+        A list of records {name, size, time, peak_bytes, pixels, pixels_per_second}, see append_history and check_regressions.
+    """
+    import shutil
+    import tempfile
+    import xarray as xr
+    from chl_regions import cut_region
+    from chl_matchups import load_matchups
+    from chl_statistics import check_bias, plot_linear_trend
+    records=[]
+    for size in sizes:
+        shape=SUITE_SHAPES[size]
+        for sensor,func in SENSOR_FUNCTIONS.items():
+            bands=synthetic_rrs(shape,sensor,nan_fraction=nan_fraction)
+            t,mem,_=measure(func,*bands,repeat=repeat)
+            records.append(_suite_record(func.__name__,size,t,mem,np.prod(shape)))
+            del bands
+
+    tmp=path is None
+    path=tempfile.mkdtemp() if tmp else path
+    files=write_synthetic_l3m(path,'seawifs',shape=SUITE_SHAPES['global_9km'],nan_fraction=nan_fraction)
+    def cut_tropical_pacific():
+        datasets=[xr.open_dataset(fileloc) for fileloc in files]
+        try:
+            return cut_region(xr.merge(datasets),'tropical_pacific').load()
+        finally:
+            for ds in datasets:
+                ds.close()
+    t,mem,cut=measure(cut_tropical_pacific,repeat=repeat)
+    records.append(_suite_record('cut_tropical_pacific','global_9km',t,mem,cut.Rrs_443.size))
+    if tmp:
+        shutil.rmtree(path)
+
+    for sensor in SENSOR_FUNCTIONS:
+        matchups=load_matchups(sensor)
+        t,mem,_=measure(check_bias,matchups.in_situ_chl,matchups.TPCA_chl,matchups.NASA_chlor_a,plot=0,repeat=repeat)
+        records.append(_suite_record('check_bias',sensor+'_matchups',t,mem,len(matchups)))
+        t,mem,_=measure(plot_linear_trend,matchups.in_situ_chl,matchups.TPCA_chl,'','','',printer=0,plot=0,repeat=repeat)
+        records.append(_suite_record('plot_linear_trend',sensor+'_matchups',t,mem,len(matchups)))
+
+    if printer==1:
+        for r in records:
+            print(r['name'].ljust(22),r['size'].ljust(16),str(np.round(r['time'],4)).rjust(8),'s',
+                  str(np.round(r['pixels_per_second']/1e6,2)).rjust(9),'Mpixels/s',str(np.round(r['peak_bytes']/1e6,1)).rjust(8),'MB peak')
+    return records
+
+def _git_commit():
+    """Short hash of the checked out commit, None outside a git repository"""
+    import subprocess
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,check=True).stdout.decode().strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def append_history(records,history_file='benchmark_history.jsonl'):
+    """Append a suite run (timestamp, commit, versions, platform and records) as one json line of history_file, returns the run"""
+    import json
+    import platform
+    run={'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),'commit':_git_commit(),
+         'python':platform.python_version(),'numpy':np.__version__,'platform':platform.platform(),'records':records}
+    with open(history_file,'a') as f:
+        f.write(json.dumps(run)+'\n')
+    return run
+
+def load_history(history_file='benchmark_history.jsonl'):
+    """Every run of a history file, oldest first"""
+    import json
+    with open(history_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_baseline(records,baseline_file='benchmark_baseline.json'):
+    """Save suite records as the baseline for check_regressions"""
+    import json
+    with open(baseline_file,'w') as f:
+        json.dump({'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),'commit':_git_commit(),'records':records},f,indent=1)
+
+def check_regressions(records,baseline_file='benchmark_baseline.json',time_tolerance=0.25,memory_tolerance=0.1,time_floor=0.005,printer=1):
+    """
+    Compare suite records with the baseline (matched by name and size).
+    A benchmark regresses when its time is more than time_tolerance (fraction) and time_floor (s, timer noise of the smallest benchmarks) slower,
+    or its peak memory more than memory_tolerance larger, than the baseline.
+    Returns a list of regressions {name, size, metric, baseline, current, ratio}.
+    """
+    import json
+    with open(baseline_file) as f:
+        baseline={(r['name'],r['size']):r for r in json.load(f)['records']}
+    regressions=[]
+    for r in records:
+        base=baseline.get((r['name'],r['size']))
+        if base is None:
+            continue
+        for metric,tolerance,floor in [('time',time_tolerance,time_floor),('peak_bytes',memory_tolerance,0)]:
+            if base[metric]>0 and r[metric]>base[metric]*(1+tolerance) and r[metric]-base[metric]>floor:
+                regressions.append({'name':r['name'],'size':r['size'],'metric':metric,'baseline':base[metric],'current':r[metric],'ratio':r[metric]/base[metric]})
+    if printer==1:
+        for reg in regressions:
+            print('REGRESSION:',reg['name'],reg['size'],reg['metric'],np.round(reg['ratio'],2),'x baseline (',reg['baseline'],'->',reg['current'],')')
+        if len(regressions)==0:
+            print('No regressions against',baseline_file)
+    return regressions
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    parser=argparse.ArgumentParser(description='TPCA benchmarks. "all" runs every benchmark, "suite" runs the regression suite')
+    parser.add_argument('command',nargs='?',default='all',choices=['all','suite'])
+    parser.add_argument('--sizes',nargs='+',default=list(SUITE_SHAPES),choices=list(SUITE_SHAPES))
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--history',default='benchmark_history.jsonl',help='Append the suite results to this json lines file')
+    parser.add_argument('--baseline',default='benchmark_baseline.json',help='Flag regressions against this baseline when it exists')
+    parser.add_argument('--save-baseline',action='store_true',help='Save the suite results as the baseline')
+    a=parser.parse_args()
+    if a.command=='suite':
+        records=run_suite(a.sizes,repeat=a.repeat)
+        append_history(records,a.history)
+        regressions=[]
+        if os.path.exists(a.baseline) and not a.save_baseline:
+            regressions=check_regressions(records,a.baseline)
+        if a.save_baseline:
+            save_baseline(records,a.baseline)
+        sys.exit(1 if len(regressions)>0 else 0)
+    else:
+        for sensor in SENSOR_FUNCTIONS:
+            benchmark_fused_kernel(sensor=sensor)
+        benchmark_masked_blending()
+        for sensor in SENSOR_FUNCTIONS:
+            benchmark_lut(sensor=sensor)
+        benchmark_float32()
+        benchmark_tiled_processing()
+        benchmark_profiling()
+        benchmark_region_cutout()
+        benchmark_product_cache()
+        benchmark_compositing()
+        benchmark_uncertainty()
+        benchmark_output_writer()
+        benchmark_bias_statistics()
+        benchmark_matchup_loading()
+        benchmark_bootstrap()
+        benchmark_grid_search()
+        benchmark_matchup_extraction()
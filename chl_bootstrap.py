@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bootstrap confidence intervals for the matchup statistics, overall or stratified by ENSO regime, source or region.
+
+Includes:
+    resample_statistics
+        Median log bias, MAE, slope and R2 for a batch of resamples, given as a 2D (resamples x matchups) index array.
+    bootstrap_statistics
+        Point estimates and percentile confidence intervals from thousands of resamples, processed in batches
+        (optionally across a process pool) with a fixed seed.
+    enso_labels / region_labels
+        Label matchups as La Nina (MEI <= -1), Neutral or El Nino (MEI >= 1), or by the chl_regions box they fall in.
+    stratified_bootstrap
+        bootstrap_statistics for every model column of a matchup DataFrame, in each group of a stratification.
+
+The statistics follow chl_statistics.check_bias: median log bias = 10**median(log10(model)-log10(in situ)),
+MAE = 10**mean(|log10(model)-log10(in situ)|), and the slope / R2 of the linear regression of model against in situ.
+Matchups where the model or in situ value is NaN are dropped before resampling, a group left without matchups has NaN statistics.
+
+Usage:
+    matchups=load_matchups('seawifs')
+    stratified_bootstrap(matchups,['TPCA_chl','NASA_chlor_a'],by='enso',n_resamples=10000)
+
+@author: npittman
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np                   #Version '1.16.1'
+import pandas as pd                  #Version '0.23.3'
+
+from chl_regions import REGIONS
+
+STATISTICS=['median_log_bias','mae','slope','r2']
+
+def resample_statistics(in_situ,model,index):
+    """
+    Given in situ and model arrays (N, no NaN) and an index array (resamples x N),
+    returns a dict of STATISTICS arrays with one value per resample.
+    """
+    log_diff=np.log10(model)-np.log10(in_situ)
+    d=log_diff[index]
+    n=index.shape[1]
+    median=np.median(d,axis=1)
+    np.abs(d,out=d)
+    mae=d.mean(axis=1)
+    del d
+
+    shift=in_situ.mean() #Shift both by the mean in situ for stable single pass sums
+    x=(in_situ-shift)[index]
+    y=(model-shift)[index]
+    sx=x.sum(axis=1)
+    sy=y.sum(axis=1)
+    sxx=np.einsum('ij,ij->i',x,x)-sx*sx/n
+    syy=np.einsum('ij,ij->i',y,y)-sy*sy/n
+    sxy=np.einsum('ij,ij->i',x,y)-sx*sy/n
+    return {'median_log_bias':10**median,
+            'mae':10**mae,
+            'slope':sxy/sxx,
+            'r2':sxy*sxy/(sxx*syy)}
+
+def _resample_batch(in_situ,model,n_resamples,seed):
+    """Statistics for a batch of resamples drawn with their own seed"""
+    rng=np.random.RandomState(seed)
+    index=rng.randint(0,in_situ.size,size=(n_resamples,in_situ.size))
+    return resample_statistics(in_situ,model,index)
+
+def bootstrap_statistics(in_situ,model,n_resamples=10000,batch_size=1000,ci=95,seed=0,processes=1):
+    """
+    Given:
+        in_situ, model - Matchup arrays (NaN pairs are dropped)
+        n_resamples - Number of bootstrap resamples
+        batch_size - Resamples per batch, memory is ~batch_size x N x 8 bytes x 3
+        ci - Confidence interval (%)
+        seed - Seed for the batch seeds, results are identical for any number of processes
+        processes - Spread the batches across a process pool when > 1
+
+    Returns:
+        DataFrame indexed by STATISTICS with the point estimate (full sample), n, bootstrap mean, std, lower and upper CI.
+        NaN statistics (n=0) when no pair is valid, ie: a stratified group where the model is always NaN.
+    """
+    in_situ=np.ravel(np.asarray(in_situ,dtype=np.float64))
+    model=np.ravel(np.asarray(model,dtype=np.float64))
+    valid=~np.isnan(in_situ)&~np.isnan(model)
+    in_situ=in_situ[valid]
+    model=model[valid]
+    if in_situ.size==0: #Nothing to resample from
+        return pd.DataFrame([{'statistic':stat,'estimate':np.nan,'n':0,'mean':np.nan,'std':np.nan,'lower':np.nan,'upper':np.nan}
+                             for stat in STATISTICS]).set_index('statistic')
+
+    n_batches=int(np.ceil(n_resamples/batch_size))
+    sizes=[min(batch_size,n_resamples-i*batch_size) for i in range(n_batches)]
+    seeds=np.random.RandomState(seed).randint(0,2**31-1,size=n_batches)
+    if processes is not None and processes>1 and n_batches>1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            batches=list(pool.map(_resample_batch,[in_situ]*n_batches,[model]*n_batches,sizes,seeds))
+    else:
+        batches=[_resample_batch(in_situ,model,size,batch_seed) for size,batch_seed in zip(sizes,seeds)]
+
+    point=resample_statistics(in_situ,model,np.arange(in_situ.size)[None,:])
+    alpha=(100-ci)/2
+    rows=[]
+    for stat in STATISTICS:
+        values=np.concatenate([batch[stat] for batch in batches])
+        lower,upper=np.percentile(values,[alpha,100-alpha])
+        rows.append({'statistic':stat,'estimate':point[stat][0],'n':in_situ.size,
+                     'mean':values.mean(),'std':values.std(),'lower':lower,'upper':upper})
+    return pd.DataFrame(rows).set_index('statistic')
+
+def enso_labels(mei):
+    """La Nina (MEI <= -1), Neutral, El Nino (MEI >= 1) as in the matchup database notes"""
+    mei=np.asarray(mei)
+    return np.where(mei>=1,'El Nino',np.where(mei<=-1,'La Nina','Neutral'))
+
+def region_labels(lat,lon,regions=('nino4','nino3')):
+    """Name of the first region (chl_regions.REGIONS name or box, lon 0-360) containing each matchup, otherwise 'other'"""
+    lat=np.asarray(lat)
+    lon=np.asarray(lon)%360
+    labels=np.full(lat.shape,'other',dtype=object)
+    for region in reversed(list(regions)):
+        lat_min,lat_max,lon_min,lon_max=REGIONS[region] if isinstance(region,str) else region
+        inside=(lat>=lat_min)&(lat<=lat_max)
+        if lon_min<=lon_max:
+            inside&=(lon>=lon_min)&(lon<=lon_max)
+        else:
+            inside&=(lon>=lon_min)|(lon<=lon_max)
+        labels[inside]=region if isinstance(region,str) else str(region)
+    return labels
+
+def stratified_bootstrap(matchups,models=['TPCA_chl','NASA_chlor_a'],by=None,in_situ='in_situ_chl',regions=('nino4','nino3'),**kwargs):
+    """
+    Given:
+        matchups - Matchup DataFrame (ie: chl_matchups.load_matchups('seawifs'))
+        models - Model columns to assess against in_situ
+        by - None (all matchups), 'enso' (MEI), 'region' (obs_lat / obs_lon in regions) or any column (ie: 'obs_source', 'chl_type')
+        **kwargs - Passed to bootstrap_statistics (n_resamples, batch_size, ci, seed, processes)
+
+    Returns:
+        DataFrame indexed by (group, model, statistic)
+    """
+    if by is None:
+        groups=np.full(len(matchups),'all',dtype=object)
+    elif by=='enso':
+        groups=enso_labels(matchups.MEI)
+    elif by=='region':
+        groups=region_labels(matchups.obs_lat,matchups.obs_lon,regions)
+    else:
+        groups=matchups[by].values
+    results={}
+    for group in pd.unique(groups):
+        subset=matchups[groups==group]
+        for model in models:
+            results[(group,model)]=bootstrap_statistics(subset[in_situ],subset[model],**kwargs)
+    return pd.concat(results,names=['group','model'])
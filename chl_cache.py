@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On disk, content addressed cache of computed TPCA products.
+
+Includes:
+    file_identity
+        Cheap identity of an input file: name, size and modification time, or its sha256 (from the chl_download manifest when present).
+    product_key
+        sha256 key of a product from its input file identities, sensor, region and sensor function arguments (ocx_poly, ci_poly, l, h, mode, dtype).
+    ProductCache
+        A directory of compressed, chunked NetCDF products named by their key, with hit / miss statistics
+        and least recently used eviction once the cache is larger than max_bytes.
+    cached_region_chl
+        TPCA chl of a region from L3M band files, read from the cache when the inputs and arguments are unchanged.
+
+Products are written to a temporary file in the cache and renamed into place, so concurrent writers (threads or processes)
+of the same key never expose a partial file, and readers see either no product or a complete one.
+A hit updates the modification time of the product, which eviction uses as the last access time.
+
+Usage:
+    cache=ProductCache('tpca_cache',max_bytes=2e9)
+    chl_tpca=cached_region_chl(file_locations[0:5],'seawifs','tropical_pacific',cache)
+    cache.stats()
+
+@author: npittman
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import functools
+import numpy as np                   #Version '1.16.1'
+import xarray as xr                  #Version '0.11.3'
+
+from chl_files import file_sha256, load_manifest
+from chl_tpca_algorithms import SENSOR_FUNCTIONS, SENSOR_BANDS
+from chl_regions import open_region
+from chl_profiling import NULL_PROFILER, profiled_sensor_chl
+
+def file_identity(fileloc,checksum=0):
+    """
+    (name, size, modification time in ns) of a file, or with checksum=1 (name, sha256).
+    The sha256 is taken from the chl_download manifest of the file's directory when it is recorded there.
+    """
+    name=os.path.basename(fileloc)
+    if checksum==1:
+        entry=load_manifest(os.path.dirname(fileloc) or '.').get(name)
+        if entry is not None and entry['size']==os.path.getsize(fileloc):
+            return [name,entry['sha256']]
+        return [name,file_sha256(fileloc)]
+    stat=os.stat(fileloc)
+    return [name,stat.st_size,stat.st_mtime_ns]
+
+def _jsonable(value):
+    """Coefficients (lists, numpy arrays or scalars) and dtypes as json values"""
+    if isinstance(value,(list,tuple,np.ndarray)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value,(np.floating,float)):
+        return float(value)
+    if isinstance(value,(np.integer,int)):
+        return int(value)
+    if value is None or isinstance(value,str):
+        return value
+    return str(np.dtype(value)) if isinstance(value,type) else str(value)
+
+def product_key(files,sensor,region=None,checksum=0,**kwargs):
+    """
+    sha256 hex key of a product, given its input files (in order), sensor, region (name or box)
+    and the keyword arguments of the sensor function (ocx_poly, ci_poly, l, h, mode, dtype).
+    """
+    description={'files':[file_identity(fileloc,checksum) for fileloc in files],
+                 'sensor':sensor,
+                 'region':_jsonable(region),
+                 'kwargs':{k:_jsonable(v) for k,v in sorted(kwargs.items())}}
+    return hashlib.sha256(json.dumps(description,sort_keys=True).encode()).hexdigest()
+
+class ProductCache:
+    """
+    Given:
+        path - Cache directory (created if needed)
+        max_bytes - Evict the least recently used products once the cache is larger than this (None never evicts)
+        complevel - zlib compression level of the products
+        chunks - Chunk size of the 2D product variables (rows, cols)
+
+    Usage:
+        cache=ProductCache('tpca_cache',max_bytes=2e9)
+        chl=cache.get(key)
+        if chl is None:
+            chl=cache.put(key,calculate(...))
+    """
+    def __init__(self,path,max_bytes=None,complevel=4,chunks=(256,256)):
+        self.path=path
+        self.max_bytes=max_bytes
+        self.complevel=complevel
+        self.chunks=chunks
+        self.hits=0
+        self.misses=0
+        self.puts=0
+        self.evictions=0
+        self._lock=threading.Lock()
+        os.makedirs(path,exist_ok=True)
+
+    def product_file(self,key):
+        return os.path.join(self.path,key[:2],key+'.nc')
+
+    def _count(self,name):
+        with self._lock:
+            setattr(self,name,getattr(self,name)+1)
+
+    def get_file(self,key):
+        """The product file of key (marking it as recently used), or None on a miss"""
+        fileloc=self.product_file(key)
+        try:
+            os.utime(fileloc)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return fileloc
+
+    def get(self,key):
+        """The product of key loaded as an xarray DataArray, or None on a miss"""
+        fileloc=self.get_file(key)
+        if fileloc is None:
+            return None
+        try:
+            with xr.open_dataarray(fileloc) as product:
+                return product.load()
+        except FileNotFoundError: #Evicted by another process since get_file
+            return None
+
+    def put_file(self,key,fileloc):
+        """Copy a product file into the cache as key, returns the cached file"""
+        target=self.product_file(key)
+        os.makedirs(os.path.dirname(target),exist_ok=True)
+        fd,tmp=tempfile.mkstemp(dir=os.path.dirname(target),prefix='.'+key[:8],suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(fileloc,tmp)
+            os.replace(tmp,target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._count('puts')
+        self.evict(keep=target)
+        return target
+
+    def put(self,key,product,name='chl_tpca'):
+        """
+        Write a product (xarray DataArray, or numpy array) as key with zlib compression and chunking,
+        returns the product as a loaded DataArray.
+        """
+        if not isinstance(product,xr.DataArray):
+            product=xr.DataArray(np.asarray(product))
+        product=product.load().rename(product.name or name)
+        encoding={'zlib':True,'complevel':self.complevel}
+        if product.ndim==2:
+            encoding['chunksizes']=tuple(min(c,n) for c,n in zip(self.chunks,product.shape))
+        target=self.product_file(key)
+        os.makedirs(os.path.dirname(target),exist_ok=True)
+        fd,tmp=tempfile.mkstemp(dir=os.path.dirname(target),prefix='.'+key[:8],suffix='.tmp')
+        os.close(fd)
+        try:
+            product.to_netcdf(tmp,encoding={product.name:encoding})
+            os.replace(tmp,target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._count('puts')
+        self.evict(keep=target)
+        return product
+
+    def entries(self):
+        """List of (file, size, last access time) of every product"""
+        entries=[]
+        for directory,_,names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.nc'):
+                    try:
+                        stat=os.stat(os.path.join(directory,name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((os.path.join(directory,name),stat.st_size,stat.st_mtime))
+        return entries
+
+    def evict(self,keep=None):
+        """Remove the least recently used products (except keep) until the cache is no larger than max_bytes, returns the number removed"""
+        if self.max_bytes is None:
+            return 0
+        entries=sorted(self.entries(),key=lambda entry: entry[2])
+        total=sum(size for _,size,_ in entries)
+        removed=0
+        for fileloc,size,_ in entries:
+            if total<=self.max_bytes:
+                break
+            if fileloc==keep:
+                continue
+            try:
+                os.remove(fileloc)
+                removed+=1
+            except FileNotFoundError: #Removed by another process
+                pass
+            total-=size
+        with self._lock:
+            self.evictions+=removed
+        return removed
+
+    def clear(self):
+        """Remove every product"""
+        for fileloc,_,_ in self.entries():
+            try:
+                os.remove(fileloc)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Hits, misses, hit rate, puts and evictions of this cache object, with the number and size of the cached products"""
+        entries=self.entries()
+        lookups=self.hits+self.misses
+        return {'hits':self.hits,'misses':self.misses,'hit_rate':self.hits/lookups if lookups>0 else np.nan,
+                'puts':self.puts,'evictions':self.evictions,'entries':len(entries),'bytes':sum(size for _,size,_ in entries)}
+
+def cached_region_chl(band_files,sensor='seawifs',region='tropical_pacific',cache=None,checksum=0,profiler=None,**sensor_kwargs):
+    """
+    Given:
+        band_files - L3M band files in the sensor function argument order
+        sensor - seawifs, modis or meris
+        region - chl_regions region name or box
+        cache - ProductCache, or a cache directory
+        checksum - Key the input files by sha256 rather than name, size and modification time
+        profiler - Optional chl_profiling.Profiler, recording the cache_get, cut, read, sensor function and cache_put stages
+        **sensor_kwargs - Passed to the sensor function (ocx_poly, ci_poly, l, h, mode, dtype)
+
+    Returns:
+        TPCA chl of the region as a DataArray, calculated (and cached) only when the inputs or arguments have changed.
+    """
+    cache=ProductCache(cache) if isinstance(cache,str) else cache
+    profiler=NULL_PROFILER if profiler is None else profiler
+    key=product_key(band_files,sensor,region,checksum=checksum,**sensor_kwargs)
+    with profiler.stage('cache_get') as record:
+        chl=cache.get(key)
+        record['bytes_read']+=0 if chl is None else chl.nbytes
+    if chl is None:
+        if profiler.enabled!=1:
+            rrs=open_region(band_files,region)
+            chl=xr.apply_ufunc(SENSOR_FUNCTIONS[sensor],*[rrs[band] for band in SENSOR_BANDS[sensor]],kwargs=sensor_kwargs,dask='allowed')
+        else: #Cut the lazy dataset and read the region as separate stages
+            with profiler.stage('cut'):
+                rrs=open_region(band_files,region)[SENSOR_BANDS[sensor]]
+            with profiler.stage('read') as record:
+                rrs=rrs.load()
+                record['bytes_read']+=sum(rrs[band].encoding.get('dtype',rrs[band].dtype).itemsize*rrs[band].size for band in SENSOR_BANDS[sensor])
+            chl=xr.apply_ufunc(functools.partial(profiled_sensor_chl,profiler,sensor),*[rrs[band] for band in SENSOR_BANDS[sensor]],kwargs=sensor_kwargs)
+        with profiler.stage('cache_put') as record:
+            chl=cache.put(key,chl.rename('chl_tpca'))
+            record['bytes_written']+=os.path.getsize(cache.product_file(key)) if profiler.enabled==1 else 0
+    return chl
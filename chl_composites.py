@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming temporal composites (8 day, monthly, climatologies) and anomalies of daily TPCA fields.
+
+Includes:
+    PERIODS
+        Composite periods: 8day (NASA 8 day bins from January 1st), month, year, monthly_climatology and 8day_climatology.
+    period_bounds
+        The composite key, first and last day of the period containing a date (climatologies never end).
+    WelfordAccumulator
+        NaN aware online per pixel count, mean and variance (Welford, 1962) of a grid, updated a day (or a tile of a day) at a time.
+        geometric=1 accumulates log10(chl), for the geometric mean of log-normal chl.
+    Compositor
+        Feed daily grids (or tiles) in date order, keeping one accumulator per open period and writing each period
+        to a NetCDF file as soon as it has finished.
+    write_composite
+        Write an accumulator result (count, mean, variance) to a NetCDF file.
+    composite_files
+        Composite daily TPCA files (ie: from chl_pipeline) into several periods, reading the files in row blocks,
+        once for the 8day / month / year periods and once for each climatology.
+    read_composite / calculate_anomaly
+        Read a composite file, and the anomaly of a day against a composite (chl - mean, or log10(chl / geometric mean)).
+
+Memory is one accumulator (count int32, mean and M2 float64 = 20 bytes per pixel) per open period,
+so years of 9 km (or 4 km) days are never stacked in memory. A climatology fed in date order keeps every key open
+until the last year (46 accumulators for 8day_climatology), so composite_files feeds each climatology key by key. The mean and variance (ddof=1) equal
+np.nanmean / np.nanvar of the stacked days to floating point rounding.
+
+Usage:
+    composite_files(dates,daily_files,'seawifs_composites',periods=['8day','month','monthly_climatology'],geometric=1)
+    anomaly=calculate_anomaly(chl,read_composite('seawifs_composites/chl_tpca_monthly_climatology_01.nc')['mean'],geometric=1)
+
+@author: npittman
+"""
+
+import os
+import numpy as np                   #Version '1.16.1'
+import netCDF4                       #Version '1.5.1.2'
+
+from chl_tiling import iter_tiles
+
+PERIODS=['8day','month','year','monthly_climatology','8day_climatology']
+
+def period_bounds(date,period='8day'):
+    """
+    Given a date and period, returns (key, first day, last day) of the period containing the date.
+    8 day periods start on January 1st (the last period of a year is shortened, as the NASA 8 day composites).
+    Climatologies (key 01-12 for months, 001-361 for the first day of year of an 8 day bin) have no last day (None).
+    """
+    date=np.datetime64(date,'D')
+    year=date.astype('datetime64[Y]')
+    first_of_year=year.astype('datetime64[D]')
+    doy=int((date-first_of_year).astype(int))
+    if period=='8day':
+        start=first_of_year+8*(doy//8)
+        end=min(start+7,(year+1).astype('datetime64[D]')-1)
+        return str(start),start,end
+    elif period=='month':
+        month=date.astype('datetime64[M]')
+        return str(month),month.astype('datetime64[D]'),(month+1).astype('datetime64[D]')-1
+    elif period=='year':
+        return str(year),first_of_year,(year+1).astype('datetime64[D]')-1
+    elif period=='monthly_climatology':
+        return str(date.astype(object).month).zfill(2),None,None
+    elif period=='8day_climatology':
+        return str(8*(doy//8)+1).zfill(3),None,None
+    raise ValueError('Unknown period: '+str(period))
+
+class WelfordAccumulator:
+    """
+    NaN aware online count, mean and M2 (sum of squared differences from the mean) of a 2D grid.
+    With geometric=1, log10 of the data is accumulated (values <= 0 are skipped like NaN).
+    """
+    def __init__(self,shape,geometric=0):
+        self.shape=tuple(shape)
+        self.geometric=geometric
+        self.count=np.zeros(shape,dtype=np.int32)
+        self.mean=np.zeros(shape,dtype=np.float64)
+        self.m2=np.zeros(shape,dtype=np.float64)
+
+    def update(self,data,rows=slice(None),cols=slice(None)):
+        """Add one day (or the tile of a day at [rows, cols]) to the accumulators"""
+        x=np.asarray(data,dtype=np.float64)
+        if self.geometric==1:
+            with np.errstate(divide='ignore',invalid='ignore'):
+                x=np.log10(x)
+        count=self.count[rows,cols] #Views, updated in place
+        mean=self.mean[rows,cols]
+        m2=self.m2[rows,cols]
+        valid=np.isfinite(x)
+        count+=valid
+        delta=np.subtract(x,mean,where=valid,out=np.zeros(x.shape))
+        mean+=delta/np.maximum(count,1)
+        delta*=np.subtract(x,mean,where=valid,out=np.zeros(x.shape))
+        m2+=delta
+
+    def result(self):
+        """
+        Returns a dict of count, mean and variance (ddof=1), NaN where there are no (or for the variance, fewer than 2) valid days.
+        With geometric=1, mean is the geometric mean (10**mean of log10) and variance is the variance of log10(chl).
+        """
+        with np.errstate(divide='ignore',invalid='ignore'):
+            mean=np.where(self.count>0,self.mean,np.nan)
+            variance=np.where(self.count>1,self.m2/(self.count-1),np.nan)
+        if self.geometric==1:
+            mean=10**mean
+        return {'count':self.count.copy(),'mean':mean,'variance':variance}
+
+class Compositor:
+    """
+    Given:
+        shape - Grid shape (lat, lon)
+        period - One of PERIODS
+        output_dir - Directory for the composite files (named <variable>_<period>_<key>.nc)
+        lat, lon - Optional coordinates written to the composite files
+        geometric - Composite log10(chl) (geometric mean, variance of log10)
+        variable - Name of the composited variable, used in the file names
+        zlib - Compress the composite files
+
+    Usage:
+        compositor=Compositor((2160,4320),'8day','composites',lat=lat,lon=lon)
+        for date,chl in days:
+            compositor.add(date,chl)
+        files=compositor.close()
+
+    Days are added in date order. Adding a day writes (and frees) every open period which ended before it,
+    climatologies are written by flush(key) once their last day has been added, or by close().
+    """
+    def __init__(self,shape,period='8day',output_dir='.',lat=None,lon=None,geometric=0,variable='chl_tpca',zlib=False,printer=0):
+        period_bounds('2000-01-01',period) #Check the period
+        self.shape=tuple(shape)
+        self.period=period
+        self.output_dir=output_dir
+        self.lat,self.lon=lat,lon
+        self.geometric=geometric
+        self.variable=variable
+        self.zlib=zlib
+        self.printer=printer
+        self.open={} #key: (first day, last day, accumulator, days)
+        self.files=[]
+
+    def add(self,date,data,rows=slice(None),cols=slice(None)):
+        """Add the grid (or a tile at [rows, cols]) of one day"""
+        key,start,end=period_bounds(date,self.period)
+        date=np.datetime64(date,'D')
+        for finished in [k for k,(_,e,_,_) in self.open.items() if e is not None and e<date]:
+            self.flush(finished)
+        if key not in self.open:
+            self.open[key]=(start,end,WelfordAccumulator(self.shape,self.geometric),set())
+        self.open[key][2].update(data,rows,cols)
+        self.open[key][3].add(date)
+
+    def flush(self,key):
+        """Write an open period to its composite file and free its accumulator"""
+        start,end,accumulator,days=self.open.pop(key)
+        fileloc=os.path.join(self.output_dir,self.variable+'_'+self.period+'_'+key+'.nc')
+        write_composite(fileloc,accumulator.result(),lat=self.lat,lon=self.lon,
+                        attrs={'period':self.period,'key':key,'geometric':self.geometric,'n_days':len(days),
+                               'first_day':str(min(days)),'last_day':str(max(days))},zlib=self.zlib)
+        self.files.append(fileloc)
+        if self.printer==1:
+            print('Composite:',fileloc,len(days),'days')
+        return fileloc
+
+    def close(self):
+        """Write every open period (including climatologies), returns every composite file written"""
+        for key in sorted(self.open):
+            self.flush(key)
+        return self.files
+
+def write_composite(fileloc,result,lat=None,lon=None,attrs={},zlib=False):
+    """Write an accumulator result (count, mean, variance) to a NetCDF file, via a .tmp file renamed once complete"""
+    directory=os.path.dirname(fileloc)
+    if directory!='' and not os.path.isdir(directory):
+        os.makedirs(directory,exist_ok=True)
+    shape=result['mean'].shape
+    with netCDF4.Dataset(fileloc+'.tmp','w') as ds:
+        ds.createDimension('lat',shape[0])
+        ds.createDimension('lon',shape[1])
+        if lat is not None:
+            ds.createVariable('lat','f4',('lat',))[:]=lat
+            ds.variables['lat'].units='degrees_north'
+        if lon is not None:
+            ds.createVariable('lon','f4',('lon',))[:]=lon
+            ds.variables['lon'].units='degrees_east'
+        for name in ['mean','variance']:
+            ds.createVariable(name,'f8',('lat','lon'),zlib=zlib,fill_value=np.nan)[:]=result[name]
+        ds.createVariable('count','i4',('lat','lon'),zlib=zlib)[:]=result['count']
+        ds.setncatts(attrs)
+    os.replace(fileloc+'.tmp',fileloc)
+
+def read_composite(fileloc):
+    """Returns a dict of the composite arrays (count, mean, variance, lat / lon when present) and its attributes (attrs)"""
+    with netCDF4.Dataset(fileloc) as ds:
+        composite={name:np.ma.filled(ds.variables[name][:],np.nan) if name!='count' else ds.variables[name][:].data for name in ds.variables}
+        composite['attrs']={k:ds.getncattr(k) for k in ds.ncattrs()}
+    return composite
+
+def calculate_anomaly(chl,mean,geometric=0):
+    """Anomaly of chl against a composite mean: chl - mean, or with geometric=1 log10(chl) - log10(geometric mean)"""
+    if geometric==1:
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return np.log10(chl)-np.log10(mean)
+    return chl-mean
+
+def _add_day(compositors,date,fileloc,shape,variable='chl_tpca',tile_rows=512):
+    """Add a daily file to compositors, reading it once in blocks of rows"""
+    with netCDF4.Dataset(fileloc) as ds:
+        var=ds.variables[variable]
+        for rows,cols in iter_tiles(shape,tile_rows):
+            tile=np.ma.filled(var[rows,cols].astype(np.float64),np.nan)
+            for compositor in compositors:
+                compositor.add(date,tile,rows,cols)
+
+def composite_files(dates,daily_files,output_dir,periods=['8day','month'],variable='chl_tpca',tile_rows=512,geometric=0,zlib=False,printer=0):
+    """
+    Given:
+        dates, daily_files - Days and their daily files (ie: chl_pipeline output), in any order
+        output_dir - Directory for the composite files
+        periods - Composite periods (see PERIODS)
+        variable - Variable of the daily files
+        tile_rows - Rows read at a time from each daily file
+        geometric - Geometric means (see WelfordAccumulator)
+        zlib - Compress the composite files
+
+    Calculate:
+        The 8day, month and year periods are built in one pass over the files in date order.
+        Each climatology is built in its own pass with the days ordered by climatology key (ie: every January, then every February),
+        writing each key as soon as its last day has been added, so one accumulator per period is open at a time.
+
+    Returns:
+        A dict of {period: list of composite files}
+    """
+    dates=[np.datetime64(date,'D') for date in dates]
+    order=np.argsort(np.array(dates),kind='mergesort')
+    with netCDF4.Dataset(daily_files[order[0]]) as ds:
+        shape=ds.variables[variable].shape
+        lat=ds.variables['lat'][:] if 'lat' in ds.variables else None
+        lon=ds.variables['lon'][:] if 'lon' in ds.variables else None
+    compositors={period:Compositor(shape,period,output_dir,lat=lat,lon=lon,geometric=geometric,variable=variable,zlib=zlib,printer=printer) for period in periods}
+    climatologies=[period for period in periods if period_bounds(dates[0],period)[2] is None]
+    dated=[compositors[period] for period in periods if period not in climatologies]
+    if len(dated)>0:
+        for i in order:
+            _add_day(dated,dates[i],daily_files[i],shape,variable,tile_rows)
+    for period in climatologies:
+        keys=[period_bounds(date,period)[0] for date in dates]
+        remaining={key:keys.count(key) for key in set(keys)}
+        for i in sorted(order,key=lambda i: keys[i]): #Stable, so days stay in date order within a key
+            _add_day([compositors[period]],dates[i],daily_files[i],shape,variable,tile_rows)
+            remaining[keys[i]]-=1
+            if remaining[keys[i]]==0:
+                compositors[period].flush(keys[i])
+    return {period:compositor.close() for period,compositor in compositors.items()}
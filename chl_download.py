@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrent, resumable downloads of satellite data from https://oceandata.sci.gsfc.nasa.gov/
+
+Includes:
+    make_session
+        A requests.Session with a connection pool sized for the number of workers.
+    is_netcdf
+        Cheap header only check that a file is NetCDF3 / NetCDF4 (HDF5), without opening it with xarray.
+    load_manifest / save_manifest
+        A json manifest of {file name: {size, sha256}} for downloaded files (from chl_files).
+    verify_file
+        Check a file against its manifest entry (size, optionally the checksum) and the NetCDF header.
+    download_file
+        Stream one url into a .part file in chunks, resuming with HTTP Range requests,
+        retrying connection errors, timeouts and 5xx / 408 / 429 responses with capped exponential backoff and renaming into place once complete.
+    download_files
+        Download a list of urls with a bounded number of concurrent workers sharing one pooled session.
+
+Usage:
+    file_locations=download_files(urls,path='seawifs_data',workers=4)
+
+@author: npittman
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests                      #Version '2.19.1'
+from requests.adapters import HTTPAdapter
+
+from chl_files import file_sha256, load_manifest, save_manifest
+
+NETCDF_SIGNATURES=(b'CDF\x01',b'CDF\x02',b'\x89HDF\r\n\x1a\n') #NetCDF3 classic, 64 bit offset, NetCDF4 (HDF5)
+RETRY_STATUS=(408,429) #Client errors worth retrying (request timeout, too many requests), other 4xx are raised immediately
+
+_manifest_lock=threading.Lock()
+
+def make_session(workers=4):
+    """A requests.Session whose connection pool holds a connection for each worker"""
+    session=requests.Session()
+    adapter=HTTPAdapter(pool_connections=workers,pool_maxsize=workers)
+    session.mount('http://',adapter)
+    session.mount('https://',adapter)
+    return session
+
+def is_netcdf(fileloc):
+    """True if the first bytes of fileloc are a NetCDF3 or NetCDF4 (HDF5) signature"""
+    try:
+        with open(fileloc,'rb') as f:
+            header=f.read(8)
+    except IOError:
+        return False
+    return any(header.startswith(signature) for signature in NETCDF_SIGNATURES)
+
+def verify_file(fileloc,entry=None,checksum=0,netcdf=1):
+    """
+    Cheap integrity check of a downloaded file.
+    With a manifest entry the size must match (and the sha256 if checksum=1), netcdf=1 also checks the NetCDF header.
+    """
+    if not os.path.exists(fileloc):
+        return False
+    if entry is not None:
+        if os.path.getsize(fileloc)!=entry['size']:
+            return False
+        if checksum==1 and file_sha256(fileloc)!=entry['sha256']:
+            return False
+    if netcdf==1 and not is_netcdf(fileloc):
+        return False
+    return True
+
+def download_file(url,path,session=None,max_retries=5,backoff=1,max_backoff=60,timeout=30,chunk_size=1<<20,netcdf=1,printer=1):
+    """
+    Given:
+        url - File to download into path (named as the last part of the url)
+        session - Shared requests.Session (see make_session)
+        max_retries - Attempts after the first failure
+        backoff, max_backoff - Retry n waits min(backoff*2**n, max_backoff) seconds
+        timeout - Connect / read timeout in seconds
+        netcdf - Check the NetCDF header of the completed file
+
+    Calculate:
+        Stream the response to fileloc.part in chunks. If a .part file exists from an earlier attempt (or run),
+        request the remainder with an HTTP Range header, starting again if the server does not support ranges.
+        The completed file is renamed into place, so fileloc only ever exists once complete.
+        A 4xx response other than RETRY_STATUS (ie: 404 for a missing day, 401 without credentials) will not succeed on a retry,
+        so its requests.HTTPError is raised immediately.
+
+    Returns:
+        (fileloc, size, sha256), raises an IOError once the retries are exhausted.
+    """
+    session=requests if session is None else session
+    fileloc=os.path.join(path,url.split('/')[-1])
+    part=fileloc+'.part'
+    error=None
+    for attempt in range(max_retries+1):
+        if attempt>0:
+            time.sleep(min(backoff*2**(attempt-1),max_backoff))
+        try:
+            offset=os.path.getsize(part) if os.path.exists(part) else 0
+            headers={'Accept-Encoding':'identity'} #Content-Length is then the number of bytes written
+            if offset>0:
+                headers['Range']='bytes='+str(offset)+'-'
+            with session.get(url,headers=headers,stream=True,timeout=timeout) as r:
+                if r.status_code==416: #Range not satisfiable, the .part file is already complete or invalid
+                    os.remove(part)
+                    raise IOError('Range not satisfiable, restarting: '+url)
+                r.raise_for_status()
+                if offset>0 and r.status_code!=206: #The server ignored the Range request
+                    offset=0
+                expected=r.headers.get('Content-Length')
+                expected=offset+int(expected) if expected is not None else None
+                with open(part,'ab' if offset>0 else 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+            size=os.path.getsize(part)
+            if expected is not None and size!=expected:
+                raise IOError('Incomplete download ('+str(size)+' of '+str(expected)+' bytes): '+url)
+            if netcdf==1 and not is_netcdf(part):
+                os.remove(part)
+                raise IOError('Not a NetCDF file: '+url)
+            sha256=file_sha256(part)
+            os.replace(part,fileloc)
+            if printer==1:
+                print('Downloaded:',fileloc)
+            return fileloc,size,sha256
+        except (requests.RequestException,IOError) as e:
+            status=getattr(getattr(e,'response',None),'status_code',None)
+            if status is not None and 400<=status<500 and status not in RETRY_STATUS:
+                if printer==1:
+                    print('Download failed:',fileloc,'error:',e)
+                raise
+            error=e
+            if printer==1:
+                print('Download failed:',fileloc,'attempt:',attempt+1,'error:',e)
+    raise IOError('Download failed after '+str(max_retries+1)+' attempts: '+url+' ('+str(error)+')')
+
+def download_files(urls,path='seawifs_data',workers=4,session=None,checksum=0,netcdf=1,printer=1,**kwargs):
+    """
+    Given:
+        urls - Files to download
+        path - Download directory (created if needed)
+        workers - Number of concurrent downloads, sharing one pooled session
+        checksum - Verify existing files with their manifest sha256 (otherwise the size and NetCDF header)
+        **kwargs - Passed to download_file (max_retries, backoff, max_backoff, timeout, chunk_size)
+
+    Calculate:
+        Skip files which exist and pass verify_file against the manifest, download the rest concurrently
+        and record their size and sha256 in the manifest.
+
+    Returns:
+        File locations in the order of urls, raises an IOError listing the failed urls after every download has finished.
+    """
+    if not os.path.isdir(path):
+        if printer==1:
+            print('Creating directory: ',path)
+        os.makedirs(path)
+    session=make_session(workers) if session is None else session
+    manifest=load_manifest(path)
+
+    def fetch(url):
+        name=url.split('/')[-1]
+        fileloc=os.path.join(path,name)
+        if verify_file(fileloc,manifest.get(name),checksum=checksum,netcdf=netcdf):
+            if printer==1:
+                print('Exists: ',fileloc)
+            return fileloc
+        fileloc,size,sha256=download_file(url,path,session=session,netcdf=netcdf,printer=printer,**kwargs)
+        with _manifest_lock:
+            manifest[name]={'size':size,'sha256':sha256}
+            save_manifest(path,manifest)
+        return fileloc
+
+    file_locations,failures=[],[]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures=[pool.submit(fetch,url) for url in urls]
+        for url,future in zip(urls,futures):
+            try:
+                file_locations.append(future.result())
+            except IOError:
+                failures.append(url)
+                file_locations.append(None)
+    if len(failures)>0:
+        raise IOError('Failed to download: '+', '.join(failures))
+    return file_locations
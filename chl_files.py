@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File helpers shared by the downloader, matchup loader and product cache, without their dependencies (ie: requests).
+
+Includes:
+    file_sha256
+        sha256 hex digest of a file, read in chunks.
+    load_manifest / save_manifest
+        The json manifest of {file name: {size, sha256}} of a chl_download directory.
+
+Usage:
+    sha256=file_sha256('tropical_pacific_matchups/seawifs_matchups.csv')
+    entry=load_manifest('seawifs_data').get('S2000001.L3m_DAY_RRS_Rrs_443_9km.nc')
+
+@author: npittman
+"""
+
+import os
+import json
+import hashlib
+
+MANIFEST_NAME='manifest.json'
+
+def file_sha256(fileloc,chunk_size=1<<20):
+    """sha256 hex digest of a file, read in chunks"""
+    sha=hashlib.sha256()
+    with open(fileloc,'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size),b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def load_manifest(path):
+    """Load the manifest of a download directory, {} if there is none"""
+    manifest_file=os.path.join(path,MANIFEST_NAME)
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+def save_manifest(path,manifest):
+    """Atomically write the manifest of a download directory"""
+    manifest_file=os.path.join(path,MANIFEST_NAME)
+    with open(manifest_file+'.tmp','w') as f:
+        json.dump(manifest,f,indent=1,sort_keys=True)
+    os.replace(manifest_file+'.tmp',manifest_file)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fit the OCx polynomial and CI to OCx blending window against the matchup databases.
+
+Includes:
+    matchup_predictors
+        log10(max band ratio), CI and in situ chl of a matchup DataFrame (computed once from the Rrs columns).
+    evaluate_candidates
+        Blended chl of thousands of (ocx_poly, ci_poly, l, h) candidates at once (candidates x matchups),
+        scored with the check_bias log statistics.
+    candidate_grid
+        Cartesian product of OCx polynomials, CI polynomials and blending cutoffs (l < h).
+    grid_search
+        Score a candidate grid on the training matchups, and report the validation scores alongside.
+    fit_ocx_poly
+        Least squares refit of the OCx polynomial in log space on the training matchups.
+
+Training / validation sets are the validation_set column of the matchup databases (0 = training, 1 = validation).
+
+Usage:
+    matchups=load_matchups('seawifs')
+    ocx_poly=fit_ocx_poly(matchups,'seawifs')
+    grid_search(matchups,'seawifs',ocx_polys=[ocx_poly,[0.3272,-2.9940,2.7218,-1.2259,-0.5683]],ls=np.arange(0,0.3,0.01),hs=np.arange(0.1,0.6,0.01))
+
+@author: npittman
+"""
+
+import numpy as np                   #Version '1.16.1'
+import pandas as pd                  #Version '0.23.3'
+
+from chl_tpca_algorithms import MATCHUP_BANDS, SENSOR_WAVELENGTHS, blended_chl
+
+METRICS=['mae','median_ae','median_log_bias','rmse_log']
+
+def matchup_predictors(matchups,sensor='seawifs',in_situ='in_situ_chl'):
+    """
+    Given a matchup DataFrame and sensor, returns (lmbr, CI, in_situ) arrays as used by the sensor functions.
+    Matchups with a NaN Rrs or in situ value are dropped.
+    """
+    bands=[matchups[band].values.astype(np.float64) for band in MATCHUP_BANDS[sensor]]
+    blues,green,red=bands[:-2],bands[-2],bands[-1]
+    mbr=blues[0]/green
+    for blue in blues[1:]:
+        mbr=np.maximum(mbr,blue/green)
+    b,g,r=SENSOR_WAVELENGTHS[sensor]
+    CI=green-(blues[0]+(g-b)/(r-b)*(red-blues[0]))
+    lmbr=np.log10(mbr)
+    chl=matchups[in_situ].values.astype(np.float64)
+    valid=~np.isnan(lmbr)&~np.isnan(CI)&~np.isnan(chl)
+    return lmbr[valid],CI[valid],chl[valid]
+
+def _median_rows(a):
+    """np.median(a,axis=1) with a single partition"""
+    n=a.shape[1]
+    k=n//2
+    part=np.partition(a,k,axis=1)
+    return part[:,k] if n%2==1 else (part[:,:k].max(axis=1)+part[:,k])/2
+
+def _log_scores(log_diff):
+    """check_bias style log statistics of a (candidates x matchups) log10 difference, log_diff is overwritten"""
+    n=log_diff.shape[1]
+    median=_median_rows(log_diff)
+    rmse=np.sqrt(np.einsum('ij,ij->i',log_diff,log_diff)/n)
+    np.abs(log_diff,out=log_diff)
+    return {'mae':10**log_diff.mean(axis=1),
+            'median_ae':10**_median_rows(log_diff),
+            'median_log_bias':10**median,
+            'rmse_log':rmse}
+
+def evaluate_candidates(lmbr,CI,in_situ,ocx_polys,ci_polys,l,h,batch_size=512):
+    """
+    Given:
+        lmbr, CI, in_situ - Matchup predictors (N), see matchup_predictors
+        ocx_polys - OCx polynomials (C x 5, or one polynomial for every candidate)
+        ci_polys - CI polynomials (C x 2, or one)
+        l, h - Blending cutoffs (C, or one)
+        batch_size - Candidates evaluated at once, memory is ~batch_size x N x 8 bytes x 4
+
+    Calculate:
+        Chl OCx (Horner's rule), Chl CI and the blend of blended_chl for every candidate and matchup,
+        and the check_bias log statistics against in situ.
+
+    Returns:
+        DataFrame of METRICS with one row per candidate.
+    """
+    ocx_polys=np.atleast_2d(np.asarray(ocx_polys,dtype=np.float64))
+    ci_polys=np.atleast_2d(np.asarray(ci_polys,dtype=np.float64))
+    l=np.atleast_1d(np.asarray(l,dtype=np.float64))
+    h=np.atleast_1d(np.asarray(h,dtype=np.float64))
+    n_candidates=max(len(ocx_polys),len(ci_polys),len(l),len(h))
+    ocx_polys=np.broadcast_to(ocx_polys,(n_candidates,ocx_polys.shape[1]))
+    ci_polys=np.broadcast_to(ci_polys,(n_candidates,2))
+    l=np.broadcast_to(l,(n_candidates,))
+    h=np.broadcast_to(h,(n_candidates,))
+    log_in_situ=np.log10(in_situ)
+
+    scores={metric:np.empty(n_candidates) for metric in METRICS}
+    for start in range(0,n_candidates,batch_size):
+        batch=slice(start,min(start+batch_size,n_candidates))
+        poly=ocx_polys[batch]
+        chl_ocx=poly[:,-1:]*lmbr
+        for i in range(poly.shape[1]-2,0,-1):
+            chl_ocx+=poly[:,i:i+1]
+            chl_ocx*=lmbr
+        chl_ocx+=poly[:,:1]
+        np.power(10.0,chl_ocx,out=chl_ocx)
+        chl_ci=ci_polys[batch,1:2]*CI
+        chl_ci+=ci_polys[batch,:1]
+        np.power(10.0,chl_ci,out=chl_ci)
+
+        chl=blended_chl(chl_ci,chl_ocx,l=l[batch,None],h=h[batch,None])
+        log_diff=np.log10(chl)
+        log_diff-=log_in_situ
+        for metric,values in _log_scores(log_diff).items():
+            scores[metric][batch]=values
+    return pd.DataFrame(scores)
+
+def candidate_grid(ocx_polys,ci_polys,ls,hs):
+    """Cartesian product of candidates, dropping l >= h. Returns (ocx_polys C x 5, ci_polys C x 2, l, h)"""
+    ocx_polys=np.atleast_2d(np.asarray(ocx_polys,dtype=np.float64))
+    ci_polys=np.atleast_2d(np.asarray(ci_polys,dtype=np.float64))
+    i,j,k,m=np.meshgrid(np.arange(len(ocx_polys)),np.arange(len(ci_polys)),np.arange(len(ls)),np.arange(len(hs)),indexing='ij')
+    l=np.asarray(ls,dtype=np.float64)[k.ravel()]
+    h=np.asarray(hs,dtype=np.float64)[m.ravel()]
+    keep=l<h
+    return ocx_polys[i.ravel()[keep]],ci_polys[j.ravel()[keep]],l[keep],h[keep]
+
+def _split(matchups,split):
+    """Training (validation_set == 0), validation (== 1) or all matchups"""
+    if split=='train':
+        return matchups[matchups.validation_set==0]
+    elif split=='validation':
+        return matchups[matchups.validation_set==1]
+    elif split=='all':
+        return matchups
+    raise ValueError('Unknown split: '+str(split))
+
+def grid_search(matchups,sensor='seawifs',ocx_polys=[[0.3255,-2.7677,2.4409,-1.1288,-0.4990]],ci_polys=[[-0.4909,191.6590]],ls=np.arange(0,0.3,0.025),hs=np.arange(0.05,0.75,0.025),metric='mae',batch_size=512):
+    """
+    Given a matchup DataFrame, sensor and candidate values, score every candidate on the training matchups
+    and the validation matchups. Returns a DataFrame of candidates (ocx_poly, ci_poly, l, h), train_<metric> and
+    validation_<metric> columns, sorted by the training metric (the best candidate first).
+    """
+    ocx,ci,l,h=candidate_grid(ocx_polys,ci_polys,ls,hs)
+    results=pd.DataFrame({'ocx_poly':[list(poly) for poly in ocx],'ci_poly':[list(poly) for poly in ci],'l':l,'h':h})
+    for split in ['train','validation']:
+        scores=evaluate_candidates(*matchup_predictors(_split(matchups,split),sensor),ocx,ci,l,h,batch_size=batch_size)
+        for column in METRICS:
+            results[split+'_'+column]=scores[column].values
+    if metric=='median_log_bias': #Best is closest to 1 (no bias)
+        order=np.argsort(np.abs(np.log10(results['train_median_log_bias'].values)),kind='mergesort')
+    else:
+        order=np.argsort(results['train_'+metric].values,kind='mergesort')
+    return results.iloc[order].reset_index(drop=True)
+
+def fit_ocx_poly(matchups,sensor='seawifs',degree=4,split='train',chl_min=None):
+    """
+    Least squares fit of log10(in situ chl) against log10(max band ratio) on the split of the matchups.
+    chl_min only fits matchups with in situ chl >= chl_min (ie: where the blend uses Chl OCx).
+    Returns the polynomial in the sensor function order (ocx_poly[0] + ocx_poly[1]*lmbr + ...).
+    """
+    lmbr,_,chl=matchup_predictors(_split(matchups,split),sensor)
+    if chl_min is not None:
+        lmbr,chl=lmbr[chl>=chl_min],chl[chl>=chl_min]
+    return [float(c) for c in np.polyfit(lmbr,np.log10(chl),degree)[::-1]]
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Extract satellite matchups for in situ observations from daily L3M band files, calculating chl for every pixel.
+
+Includes:
+    grid_indices
+        Nearest grid rows / columns of observations (lon in 0-360 or -180 to 180).
+    extract_matchups
+        Build a matchup database with the same schema as tropical_pacific_matchups/*.csv.
+
+Table 3 of Pittman et al., 2019 was produced by calculating chl for each of the 45 pixels in the matchup window
+(day_radius=2, pixel_radius=1) and then averaging the 45 chlorophyll concentrations, whereas the provided matchup
+databases hold the window averaged Rrs. extract_matchups reproduces the per pixel method:
+    - Observations are grouped by satellite day, so each day's band files are opened and read once
+      (one row block spanning that day's observations) and shared by every observation whose window includes the day.
+    - Windows are gathered with precomputed grid indices (longitude wraps across the grid edge, windows are truncated at the poles).
+    - TPCA_chl (and NASA_chlor_a when the chlor_a files exist) is the mean of the valid per pixel values,
+      the Rrs columns are the mean of the valid pixels, and CI, MBR, max_blue_rrs, chl_ci and chl_ocx
+      are derived from the mean Rrs as in the provided databases (DATABASE_OCX_POLY, DATABASE_CI_POLY).
+    - The bands follow MATCHUP_BANDS[sensor], so a MODIS database has 27 columns: the empty NaN placeholder column
+      of the provided MODIS csv (28 columns) is not rebuilt.
+
+Usage:
+    observations=load_matchups('seawifs')[['obs_date','obs_lat','obs_lon','obs_source','chl_type','in_situ_chl','MEI','validation_set']]
+    matchups=extract_matchups(observations,'seawifs_data','seawifs')
+
+@author: npittman
+"""
+
+import os
+import warnings
+import numpy as np                   #Version '1.16.1'
+import pandas as pd                  #Version '0.23.3'
+import netCDF4                       #Version '1.5.1.2'
+
+from chl_tpca_algorithms import SENSOR_FUNCTIONS, SENSOR_BANDS, MATCHUP_BANDS, SENSOR_WAVELENGTHS, calculate_chl_ci, calculate_chl_ocx
+from chl_tiling import l3m_filename, open_bands, read_bands
+
+DATABASE_OCX_POLY=[0.3272,-2.9940,2.7218,-1.2259,-0.5683] #chl_ocx column of the provided databases
+DATABASE_CI_POLY=[-0.4287,230.47] #chl_ci column of the provided databases (NASA OCI CI coefficients, not the TPCA [-0.4909,191.6590])
+
+MATCHUP_COLUMNS=['obs_date','obs_lat','obs_lon','obs_source','chl_type','in_situ_chl','NASA_chlor_a','TPCA_chl','chl_ci','chl_ocx','CI','MBR','max_blue_rrs',
+                 '<bands>','MEI','day_radius','pixel_radius','sat_start_date','sat_end_date','sat_start_lat','sat_end_lat','sat_start_lon','sat_end_lon','validation_set']
+
+def _nearest(coord,values):
+    """Index of the nearest coord (ascending or descending) to each value"""
+    descending=coord[0]>coord[-1]
+    ascending=coord[::-1] if descending else coord
+    index=np.clip(np.searchsorted(ascending,values),1,len(coord)-1)
+    index=np.where(np.abs(values-ascending[index-1])<=np.abs(ascending[index]-values),index-1,index)
+    return len(coord)-1-index if descending else index
+
+def grid_indices(lat,lon,obs_lat,obs_lon):
+    """Nearest (rows, cols) of the observations in a lat / lon grid, observation and grid longitudes can be 0-360 or -180 to 180"""
+    lon=np.asarray(lon)
+    obs_lon=np.asarray(obs_lon)%360
+    if lon.min()<0: #Grid is -180 to 180
+        obs_lon=np.where(obs_lon>=180,obs_lon-360,obs_lon)
+    rows=_nearest(np.asarray(lat),np.asarray(obs_lat))
+    cols=_nearest(lon,obs_lon)
+
+    def distance(a,b):
+        d=np.abs(a-b)%360
+        return np.minimum(d,360-d)
+    for edge in [0,len(lon)-1]: #The nearest column can be across the grid edge
+        cols=np.where(distance(lon[edge],obs_lon)<distance(lon[cols],obs_lon),edge,cols)
+    return rows,cols
+
+def _read_grid(fileloc):
+    """lat and lon of an L3M file"""
+    with netCDF4.Dataset(fileloc) as ds:
+        return ds.variables['lat'][:].data,ds.variables['lon'][:].data
+
+def extract_matchups(observations,data_dir,sensor='seawifs',day_radius=2,pixel_radius=1,resolution='9km',chlor_a=1,printer=0,**sensor_kwargs):
+    """
+    Given:
+        observations - DataFrame with obs_date, obs_lat, obs_lon (and optionally obs_source, chl_type, in_situ_chl, MEI, validation_set)
+        data_dir - Directory of daily L3M files named as chl_tiling.l3m_filename
+        sensor - seawifs, modis or meris
+        day_radius, pixel_radius - Matchup window, the provided databases use 2 and 1 (5 days x 9 pixels)
+        chlor_a - Also average the NASA chlor_a files (NaN when they do not exist)
+        **sensor_kwargs - Passed to the sensor function (ocx_poly, ci_poly, l, h)
+
+    Returns:
+        DataFrame with the columns of the provided matchup databases (MATCHUP_COLUMNS, bands as MATCHUP_BANDS[sensor]).
+        Days without band files are skipped, matchups without a valid pixel are NaN.
+    """
+    obs=observations.reset_index(drop=True)
+    dates=pd.to_datetime(obs.obs_date).values.astype('datetime64[D]')
+    days=np.unique(dates[:,None]+np.arange(-day_radius,day_radius+1))
+    func=SENSOR_FUNCTIONS[sensor]
+    n_obs,n_bands=len(obs),len(SENSOR_BANDS[sensor])
+    n_days,n_pixels=2*day_radius+1,(2*pixel_radius+1)**2
+
+    band_files={day:[os.path.join(data_dir,l3m_filename(sensor,day,band,resolution)) for band in SENSOR_BANDS[sensor]] for day in days}
+    first=[files[0] for files in band_files.values() if os.path.exists(files[0])]
+    if len(first)==0:
+        raise IOError('No '+sensor+' band files found in '+data_dir)
+    lat,lon=_read_grid(first[0])
+
+    #Precomputed window indices (observations x pixels)
+    rows,cols=grid_indices(lat,lon,obs.obs_lat.values,obs.obs_lon.values)
+    offset=np.arange(-pixel_radius,pixel_radius+1)
+    window_rows=rows[:,None,None]+offset[:,None]
+    window_cols=(cols[:,None,None]+offset[None,:])%len(lon)
+    window_rows=np.broadcast_to(window_rows,(n_obs,len(offset),len(offset))).reshape(n_obs,n_pixels)
+    window_cols=np.broadcast_to(window_cols,(n_obs,len(offset),len(offset))).reshape(n_obs,n_pixels)
+    outside=np.broadcast_to(((window_rows<0)|(window_rows>=len(lat)))[:,None,:],(n_obs,n_days,n_pixels)) #Beyond a pole
+    window_rows=np.clip(window_rows,0,len(lat)-1) #Indexable, the pixels outside are then set to NaN
+
+    rrs=np.full((n_bands,n_obs,n_days,n_pixels),np.nan)
+    chl=np.full((n_obs,n_days,n_pixels),np.nan)
+    nasa=np.full((n_obs,n_days,n_pixels),np.nan)
+    for day in days:
+        if not all(os.path.exists(fileloc) for fileloc in band_files[day]):
+            continue
+        day_obs=np.nonzero(np.abs(dates-day)<=np.timedelta64(day_radius,'D'))[0]
+        day_index=(day-dates[day_obs]).astype(int)+day_radius
+        r=window_rows[day_obs]
+        block=slice(r.min(),r.max()+1) #One row block for all of today's observations
+        datasets,variables=open_bands(band_files[day],sensor)
+        try:
+            bands=[band[r-block.start,window_cols[day_obs]] for band in read_bands(variables,block)]
+        finally:
+            for ds in datasets:
+                ds.close()
+        for i,band in enumerate(bands):
+            rrs[i,day_obs,day_index]=band
+        chl[day_obs,day_index]=func(*bands,**sensor_kwargs)
+
+        chlor_a_file=os.path.join(data_dir,l3m_filename(sensor,day,'chlor_a',resolution))
+        if chlor_a==1 and os.path.exists(chlor_a_file):
+            datasets,variables=open_bands(chlor_a_file,sensor,band_variables=['chlor_a'])
+            try:
+                nasa[day_obs,day_index]=read_bands(variables,block)[0][r-block.start,window_cols[day_obs]]
+            finally:
+                for ds in datasets:
+                    ds.close()
+        if printer==1:
+            print('Extracted:',day,len(day_obs),'observations')
+    rrs[:,outside]=np.nan #Truncate the windows at the poles, rather than counting the edge row again
+    chl[outside]=np.nan
+    nasa[outside]=np.nan
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore',RuntimeWarning) #Mean of empty slice, where no pixel is valid
+        mean_rrs=[np.nanmean(band.reshape(n_obs,-1),axis=1) for band in rrs]
+        tpca=np.nanmean(chl.reshape(n_obs,-1),axis=1)
+        nasa_chl=np.nanmean(nasa.reshape(n_obs,-1),axis=1)
+    blues,green,red=mean_rrs[:-2],mean_rrs[-2],mean_rrs[-1]
+    mbr=np.max([blue/green for blue in blues],axis=0)
+    b,g,rw=SENSOR_WAVELENGTHS[sensor]
+    CI=green-(blues[0]+(g-b)/(rw-b)*(red-blues[0]))
+
+    def column(name):
+        return obs[name].values if name in obs else np.full(n_obs,np.nan)
+    window_lat=lat[window_rows]
+    window_lon=lon[window_cols]%360
+    data={'obs_date':pd.to_datetime(obs.obs_date).dt.strftime('%Y-%m-%d').values,
+          'obs_lat':obs.obs_lat.values,
+          'obs_lon':obs.obs_lon.values%360,
+          'obs_source':column('obs_source'),
+          'chl_type':column('chl_type'),
+          'in_situ_chl':column('in_situ_chl'),
+          'NASA_chlor_a':nasa_chl,
+          'TPCA_chl':tpca,
+          'chl_ci':calculate_chl_ci(DATABASE_CI_POLY,CI),
+          'chl_ocx':calculate_chl_ocx(DATABASE_OCX_POLY,np.log10(mbr)),
+          'CI':CI,
+          'MBR':mbr,
+          'max_blue_rrs':np.max(blues,axis=0)}
+    for name,band in zip(MATCHUP_BANDS[sensor],mean_rrs):
+        data[name]=band
+    data.update({'MEI':column('MEI'),
+                 'day_radius':np.full(n_obs,day_radius),
+                 'pixel_radius':np.full(n_obs,pixel_radius),
+                 'sat_start_date':pd.to_datetime(dates-day_radius).strftime('%Y-%m-%d'),
+                 'sat_end_date':pd.to_datetime(dates+day_radius).strftime('%Y-%m-%d'),
+                 'sat_start_lat':window_lat.min(axis=1),
+                 'sat_end_lat':window_lat.max(axis=1),
+                 'sat_start_lon':window_lon[:,0],
+                 'sat_end_lon':window_lon[:,-1],
+                 'validation_set':column('validation_set')})
+    columns=[]
+    for name in MATCHUP_COLUMNS:
+        columns+=MATCHUP_BANDS[sensor] if name=='<bands>' else [name]
+    return pd.DataFrame(data)[columns]
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load the matchup databases (tropical_pacific_matchups/*.csv) from a typed, memory mapped columnar cache.
+
+Includes:
+    matchup_file
+        The csv of a sensor's matchup database.
+    build_cache
+        Parse a sensor's csv once into one .npy file per column type plus a json schema, in a directory named by the csv sha256.
+    load_columns
+        Memory mapped (read only, zero copy) column arrays of a sensor's matchup database, building the cache when needed.
+    load_matchups
+        The matchup database as a DataFrame, equal to pd.read_csv but with typed columns and the normalised band schema.
+    clear_cache
+        Remove cached matchup databases.
+
+Column types:
+    obs_date, sat_start_date, sat_end_date - datetime64[D]
+    obs_source, chl_type - Categorical codes (int8, or the smallest signed integer holding the largest number of categories), the categories are kept in the schema
+    day_radius, pixel_radius, validation_set - int8
+    Rrs, chl and every other number - float64, so values are identical to pd.read_csv
+
+The band schema is normalised to MATCHUP_BANDS[sensor]: the empty NaN column of the MODIS database
+(a placeholder between rrs488 and rrs547) is dropped.
+
+The cache directory of each sensor is named by CACHE_VERSION and the sha256 of its csv, so an edited csv (or a cache of an older layout) is never read.
+The cache is written into a temporary directory and renamed into place, so concurrent processes never read a partial cache.
+Worker processes which call load_columns share the same pages of the memory mapped files (no copies or pickling).
+
+Usage:
+    matchups=load_matchups('seawifs')
+    columns,schema=load_columns('modis') #ie: columns['rrs443'], columns['in_situ_chl']
+
+@author: npittman
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np                   #Version '1.16.1'
+import pandas as pd                  #Version '0.23.3'
+
+from chl_files import file_sha256
+from chl_tpca_algorithms import MATCHUP_BANDS
+
+MATCHUP_DIR='tropical_pacific_matchups'
+DATE_COLUMNS=['obs_date','sat_start_date','sat_end_date']
+CATEGORY_COLUMNS=['obs_source','chl_type']
+INTEGER_COLUMNS=['day_radius','pixel_radius','validation_set']
+PLACEHOLDER_COLUMNS=['NaN'] #Empty band placeholders in the csv headers
+SCHEMA_NAME='schema.json'
+CACHE_VERSION=2 #2: category codes wider than int8 when needed
+BLOCK_DTYPES={'float':np.float64,'date':'datetime64[D]','category':np.int8,'integer':np.int8}
+
+def matchup_file(sensor,matchup_dir=MATCHUP_DIR):
+    """tropical_pacific_matchups/<sensor>_matchups.csv"""
+    return os.path.join(matchup_dir,sensor+'_matchups.csv')
+
+def _cache_path(sensor,sha256,cache_dir):
+    return os.path.join(cache_dir,sensor+'-v'+str(CACHE_VERSION)+'-'+sha256[:16])
+
+def build_cache(sensor,matchup_dir=MATCHUP_DIR,cache_dir=None,sha256=None):
+    """
+    Given:
+        sensor - seawifs, modis or meris
+        matchup_dir - Directory of the matchup csvs
+        cache_dir - Cache directory, default matchup_dir/.cache
+        sha256 - sha256 of the csv (calculated when None)
+
+    Calculate:
+        Parse the csv with pd.read_csv, drop the empty placeholder columns, convert the column types
+        and save the columns of each type as one (columns x rows) .npy file, with a json schema (column order, types, categories, csv sha256).
+        Older caches of the sensor are removed.
+
+    Returns:
+        The cache directory.
+    """
+    csv=matchup_file(sensor,matchup_dir)
+    cache_dir=os.path.join(matchup_dir,'.cache') if cache_dir is None else cache_dir
+    sha256=file_sha256(csv) if sha256 is None else sha256
+    path=_cache_path(sensor,sha256,cache_dir)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir,exist_ok=True)
+
+    matchups=pd.read_csv(csv)
+    for name in PLACEHOLDER_COLUMNS:
+        if name in matchups and matchups[name].isna().all():
+            matchups=matchups.drop(columns=name)
+    missing=[band for band in MATCHUP_BANDS[sensor] if band not in matchups]
+    if len(missing)>0:
+        raise ValueError(csv+' is missing the band columns: '+', '.join(missing))
+
+    tmp=tempfile.mkdtemp(dir=cache_dir,prefix='.'+sensor+'-')
+    schema={'sensor':sensor,'source':os.path.basename(csv),'sha256':sha256,'n_rows':len(matchups),'columns':[]}
+    blocks={kind:[] for kind in BLOCK_DTYPES}
+    for name in matchups.columns:
+        column={'name':name,'kind':'float'}
+        if name in DATE_COLUMNS:
+            values=pd.to_datetime(matchups[name]).values.astype('datetime64[D]')
+            column['kind']='date'
+        elif name in CATEGORY_COLUMNS:
+            categorical=pd.Categorical(matchups[name])
+            values=categorical.codes
+            column['kind']='category'
+            column['categories']=[str(c) for c in categorical.categories]
+        elif name in INTEGER_COLUMNS:
+            values=matchups[name].values
+            column['kind']='integer'
+        else:
+            values=matchups[name].values
+        column['index']=len(blocks[column['kind']])
+        blocks[column['kind']].append(values)
+        schema['columns'].append(column)
+    dtypes=dict(BLOCK_DTYPES)
+    n_categories=max([len(column['categories']) for column in schema['columns'] if column['kind']=='category'],default=1)
+    dtypes['category']=np.promote_types(np.int8,np.min_scalar_type(-n_categories)) #Signed, codes are -1 (NaN) to n_categories-1
+    for kind,values in blocks.items(): #One (columns x rows) array per type, each column is a contiguous row
+        np.save(os.path.join(tmp,kind+'.npy'),np.array(values,dtype=dtypes[kind]).reshape(len(values),len(matchups)))
+    with open(os.path.join(tmp,SCHEMA_NAME),'w') as f:
+        json.dump(schema,f,indent=1)
+
+    try:
+        os.rename(tmp,path)
+    except OSError: #Another process finished the same cache first
+        shutil.rmtree(tmp,ignore_errors=True)
+    for name in os.listdir(cache_dir): #Caches of older csvs
+        if name.startswith(sensor+'-') and os.path.join(cache_dir,name)!=path:
+            shutil.rmtree(os.path.join(cache_dir,name),ignore_errors=True)
+    return path
+
+def load_columns(sensor,matchup_dir=MATCHUP_DIR,cache_dir=None):
+    """
+    Memory mapped, read only columns of a sensor's matchup database, building the cache when the csv has changed.
+    Returns (columns, schema) where columns is a dict of arrays in the csv column order
+    (category columns are their integer codes, see schema['columns'] for the categories).
+    """
+    cache_dir=os.path.join(matchup_dir,'.cache') if cache_dir is None else cache_dir
+    sha256=file_sha256(matchup_file(sensor,matchup_dir))
+    path=_cache_path(sensor,sha256,cache_dir)
+    if not os.path.exists(os.path.join(path,SCHEMA_NAME)):
+        path=build_cache(sensor,matchup_dir,cache_dir,sha256=sha256)
+    with open(os.path.join(path,SCHEMA_NAME)) as f:
+        schema=json.load(f)
+    blocks={kind:np.load(os.path.join(path,kind+'.npy'),mmap_mode='r') for kind in BLOCK_DTYPES}
+    columns={column['name']:blocks[column['kind']][column['index']] for column in schema['columns']}
+    return columns,schema
+
+def load_matchups(sensor,matchup_dir=MATCHUP_DIR,cache_dir=None):
+    """
+    The matchup database of a sensor as a DataFrame (from the cache, see load_columns).
+    Dates are datetime64, obs_source and chl_type are pandas Categoricals and the bands are MATCHUP_BANDS[sensor].
+    """
+    columns,schema=load_columns(sensor,matchup_dir,cache_dir)
+    data={}
+    for column in schema['columns']:
+        values=columns[column['name']]
+        if column['kind']=='category':
+            data[column['name']]=pd.Categorical.from_codes(values,column['categories'])
+        else:
+            data[column['name']]=values
+    return pd.DataFrame(data,copy=False)
+
+def clear_cache(matchup_dir=MATCHUP_DIR,cache_dir=None):
+    """Remove the matchup cache directory"""
+    cache_dir=os.path.join(matchup_dir,'.cache') if cache_dir is None else cache_dir
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CF compliant, chunked and compressed NetCDF output of TPCA products, appended along time as days finish.
+
+Includes:
+    product_attributes
+        CF global attributes of a TPCA product, recording the sensor, coefficients, blending window, mode and dtype.
+    create_product
+        Create a product file: unlimited time, lat, lon and a chunked, zlib (shuffle) compressed chl_tpca variable,
+        stored as float32 / float64 or packed as scaled int16 (pack=(min, max)).
+    append_product
+        Write a day (or a row / column block of a day) of chl into a product, appending a new time step for a new day.
+    write_day
+        Write a single day product atomically (.tmp renamed when complete), so worker processes write disjoint days concurrently without a lock.
+    append_days
+        Append finished daily files (write_day or chl_pipeline outputs) to a product in date order, a tile at a time.
+    open_products
+        Lazily open daily products as one dataset along time.
+
+Concurrency: a NetCDF (HDF5) file has a single writer, so workers each write their own day (write_day, or chl_pipeline's
+daily files) in parallel, including the compression, and one process appends finished days to the time series (append_days).
+Days are kept in date order: a day after the last day is appended, a day already in the product is skipped,
+and an earlier day (ie: one missing from a previous chl_pipeline run and completed later) is inserted,
+moving every later day one time step, so back-filling costs a rewrite of the days after it.
+
+Packing (pack=(min, max)) stores chl as int16 with CF scale_factor / add_offset (precision (max - min) / 65534),
+values outside the range are clipped to it. Readers (xarray, netCDF4) unpack to float automatically.
+
+Usage:
+    write_day('tpca/S2000001_TPCA_9km.nc','2000-01-01',chl,lat,lon,'seawifs',l=0,h=0.5)
+    append_days('seawifs_tpca_9km.nc',dates,day_files,'seawifs',pack=(0,5))
+    chl=open_products(glob.glob('tpca/*.nc')).chl_tpca
+
+    python chl_pipeline.py seawifs 2000-01-01 2000-12-31 seawifs_data seawifs_tpca --store seawifs_tpca_2000.nc --pack 0 5
+
+@author: npittman
+"""
+
+import os
+import time
+import numpy as np                   #Version '1.16.1'
+import netCDF4                       #Version '1.5.1.2'
+
+from chl_tpca_algorithms import SENSOR_FUNCTIONS, sensor_coefficients
+from chl_tiling import iter_tiles
+
+CHL_VARIABLE='chl_tpca'
+PACK_ROWS=256                        #Rows packed to int16 at a time
+TIME_UNITS='days since 1970-01-01 00:00:00'
+REFERENCES='Pittman, N., Strutton, P., Matear, R., Johnson, R. (2019). An assessment and improvement of satellite ocean color algorithms for the tropical Pacific Ocean. Journal of Geophysical Research: Oceans (2019JC015498)'
+
+def product_attributes(sensor='seawifs',**sensor_kwargs):
+    """CF global attributes of a TPCA product from the sensor and sensor function arguments (ocx_poly, ci_poly, l, h, mode, dtype)"""
+    coefficients=sensor_coefficients(sensor,**sensor_kwargs)
+    return {'Conventions':'CF-1.8',
+            'title':'Tropical Pacific Chlorophyll Algorithm (TPCA) chlorophyll concentration',
+            'source':sensor+' L3M Rrs, chl_tpca_algorithms.'+SENSOR_FUNCTIONS[sensor].__name__,
+            'references':REFERENCES,
+            'history':time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime())+' created with chl_output',
+            'tpca_sensor':sensor,
+            'tpca_ocx_poly':np.asarray(coefficients['ocx_poly'],dtype=np.float64),
+            'tpca_ci_poly':np.asarray(coefficients['ci_poly'],dtype=np.float64),
+            'tpca_l':float(coefficients['l']),
+            'tpca_h':float(coefficients['h']),
+            'tpca_mode':str(sensor_kwargs.get('mode','exact')),
+            'tpca_dtype':str(np.dtype(sensor_kwargs['dtype'])) if sensor_kwargs.get('dtype') is not None else 'float64'}
+
+def create_product(fileloc,lat,lon,sensor='seawifs',chunks=(256,256),complevel=4,pack=None,storage_dtype=np.float32,**sensor_kwargs):
+    """
+    Given:
+        fileloc - NetCDF file to create (overwritten)
+        lat, lon - Grid coordinates (degrees north / east)
+        sensor, **sensor_kwargs - Recorded in the attributes (see product_attributes)
+        chunks - (lat, lon) chunk size, each time step is chunked separately
+        complevel - zlib compression level with the shuffle filter, 0 or None is uncompressed
+        pack - (min, max) chl range to store as scaled int16, None stores storage_dtype
+        storage_dtype - Stored float type when not packed (float32 holds chl to a relative precision of 6e-8)
+
+    Returns:
+        fileloc
+    """
+    lat=np.asarray(lat)
+    lon=np.asarray(lon)
+    chunks=(1,min(chunks[0],lat.size),min(chunks[1],lon.size))
+    compression={'zlib':True,'complevel':complevel,'shuffle':True} if complevel else {'zlib':False}
+    with netCDF4.Dataset(fileloc,'w') as ds:
+        ds.createDimension('time',None)
+        ds.createDimension('lat',lat.size)
+        ds.createDimension('lon',lon.size)
+        var=ds.createVariable('time','f8',('time',))
+        var.setncatts({'standard_name':'time','units':TIME_UNITS,'calendar':'standard','axis':'T'})
+        var=ds.createVariable('lat','f4',('lat',))
+        var.setncatts({'standard_name':'latitude','units':'degrees_north','axis':'Y'})
+        var[:]=lat
+        var=ds.createVariable('lon','f4',('lon',))
+        var.setncatts({'standard_name':'longitude','units':'degrees_east','axis':'X'})
+        var[:]=lon
+
+        attrs={'standard_name':'mass_concentration_of_chlorophyll_a_in_sea_water',
+               'long_name':'Tropical Pacific Chlorophyll Algorithm chlorophyll concentration ('+sensor+')',
+               'units':'mg m-3'}
+        if pack is None:
+            chl=ds.createVariable(CHL_VARIABLE,np.dtype(storage_dtype),('time','lat','lon'),chunksizes=chunks,fill_value=np.nan,**compression)
+        else:
+            lo,hi=pack
+            scale=(hi-lo)/65534
+            chl=ds.createVariable(CHL_VARIABLE,'i2',('time','lat','lon'),chunksizes=chunks,fill_value=np.int16(-32768),**compression)
+            attrs.update({'scale_factor':np.float32(scale),'add_offset':np.float32(lo+32767*scale),
+                          'valid_min':np.int16(-32767),'valid_max':np.int16(32767)})
+        chl.setncatts(attrs)
+        ds.setncatts(product_attributes(sensor,**sensor_kwargs))
+    return fileloc
+
+def _time_value(date):
+    return float((np.datetime64(date,'D')-np.datetime64('1970-01-01','D')).astype(np.int64))
+
+def _shift_days(ds,var,index):
+    """Move the time steps from index on one step later (the last first, a block of rows at a time, without unpacking)"""
+    var.set_auto_maskandscale(False)
+    try:
+        for i in range(var.shape[0]-1,index-1,-1):
+            for start in range(0,var.shape[1],PACK_ROWS):
+                rows=slice(start,min(start+PACK_ROWS,var.shape[1]))
+                var[i+1,rows,:]=var[i,rows,:]
+            ds.variables['time'][i+1]=ds.variables['time'][i]
+    finally:
+        var.set_auto_maskandscale(True)
+
+def _append(ds,date,chl,rows=slice(None),cols=slice(None)):
+    """append_product into an open product Dataset"""
+    value=_time_value(date)
+    times=np.asarray(np.ma.filled(ds.variables['time'][:],np.nan))
+    existing=np.flatnonzero(times==value)
+    var=ds.variables[CHL_VARIABLE]
+    if existing.size>0:
+        index=int(existing[0])
+    else:
+        index=int(np.searchsorted(times,value))
+        if index<times.size:
+            _shift_days(ds,var,index)
+        ds.variables['time'][index]=value
+    if var.dtype!=np.int16:
+        var[index,rows,cols]=chl
+        return index
+    #Packed: clip to the range and write blocks of rows, bounding the netCDF4 packing temporaries
+    lo=var.add_offset-32767*var.scale_factor
+    hi=var.add_offset+32767*var.scale_factor
+    chl=np.asarray(chl)
+    rows=range(var.shape[1])[rows]
+    for start in range(0,len(rows),PACK_ROWS):
+        block=np.array(chl[start:start+PACK_ROWS],dtype=np.float64)
+        invalid=np.isnan(block)
+        block[invalid]=lo
+        np.clip(block,lo,hi,out=block)
+        var[index,slice(rows[start],rows[start]+block.shape[0]),cols]=np.ma.array(block,mask=invalid,copy=False)
+    return index
+
+def append_product(fileloc,date,chl,rows=slice(None),cols=slice(None)):
+    """
+    Write chl (the whole grid, or the [rows, cols] block) of a day into a product. A new day is appended as the next time step,
+    or inserted in date order when it is before the last day (the later days are moved one step, see module notes),
+    a day already in the product is written in place. Returns the time index of the day.
+    """
+    with netCDF4.Dataset(fileloc,'a') as ds:
+        return _append(ds,date,chl,rows,cols)
+
+def product_dates(fileloc):
+    """The days (datetime64[D]) of a product"""
+    with netCDF4.Dataset(fileloc) as ds:
+        times=np.asarray(np.ma.filled(ds.variables['time'][:],np.nan))
+    return np.datetime64('1970-01-01','D')+times.astype(np.int64)
+
+def write_day(fileloc,date,chl,lat,lon,sensor='seawifs',chunks=(256,256),complevel=4,pack=None,storage_dtype=np.float32,**sensor_kwargs):
+    """
+    Write one day of chl as a single time step product, via a .tmp file renamed once complete,
+    so concurrent workers writing different days never share a file and readers never see a partial day. Returns fileloc.
+    """
+    create_product(fileloc+'.tmp',lat,lon,sensor,chunks=chunks,complevel=complevel,pack=pack,storage_dtype=storage_dtype,**sensor_kwargs)
+    try:
+        append_product(fileloc+'.tmp',date,chl)
+        os.replace(fileloc+'.tmp',fileloc)
+    finally:
+        if os.path.exists(fileloc+'.tmp'):
+            os.remove(fileloc+'.tmp')
+    return fileloc
+
+def append_days(store,dates,day_files,sensor='seawifs',variable=CHL_VARIABLE,tile_rows=512,printer=0,**options):
+    """
+    Given:
+        store - Product file, created from the grid of the first day file (with options) when it does not exist
+        dates, day_files - Finished days and their files (2D chl, or a write_day product), added in date order
+        sensor - Recorded in a new store's attributes
+        variable - chl variable of the day files
+        tile_rows - Rows read and written at a time
+        **options - create_product options for a new store (chunks, complevel, pack, storage_dtype, sensor function arguments)
+
+    Returns:
+        The days appended (days already in the store are skipped).
+    """
+    order=np.argsort(np.array(dates,dtype='datetime64[D]'),kind='mergesort')
+    appended=[]
+    for i in order:
+        date=np.datetime64(dates[i],'D')
+        with netCDF4.Dataset(day_files[i]) as ds:
+            var=ds.variables[variable]
+            if not os.path.exists(store):
+                create_product(store,ds.variables['lat'][:],ds.variables['lon'][:],sensor,**options)
+            if date in product_dates(store):
+                continue
+            with netCDF4.Dataset(store,'a') as dst:
+                for rows,cols in iter_tiles(var.shape[-2:],tile_rows):
+                    tile=var[0,rows,cols] if var.ndim==3 else var[rows,cols]
+                    _append(dst,date,np.ma.filled(tile.astype(np.float64),np.nan),rows,cols)
+        appended.append(date)
+        if printer==1:
+            print('Appended:',date,'to',store)
+    return appended
+
+def open_products(files):
+    """Lazily open daily products (ie: write_day files) as one xarray Dataset along time, in date order"""
+    import xarray as xr              #Version '0.11.3'
+    datasets=[xr.open_dataset(fileloc,chunks={}) for fileloc in files]
+    datasets.sort(key=lambda ds: ds.time.values[0])
+    return xr.concat(datasets,dim='time')
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reprocess a date range of daily L3M Rrs files (ie: a whole SeaWiFS or MODIS-Aqua mission) into daily TPCA files.
+
+Includes:
+    day_range
+        Daily dates between a start and end date (inclusive).
+    day_files
+        The L3M band files and TPCA output file for a sensor on one day.
+    process_day
+        Process one day with chl_tiling.process_tiled, writing to a temporary file which is renamed when complete.
+        With a cache_dir, days whose band files and arguments are unchanged are copied from the chl_cache product cache.
+        With profile=1, the chl_profiling stage records of the day are returned with the result.
+    run_pipeline
+        Schedule the days across a process pool, skip days which are already complete,
+        and report throughput (days/min) and per day failures without stopping the run.
+        With profile=1 the stage records of every day are aggregated (chl_profiling.summary_table) and optionally logged as json lines.
+        With a store, each finished day is added (in date order) to a chunked, compressed CF time series (chl_output.append_days),
+        days missing from a run are inserted when a later run completes them.
+
+Usage:
+    python chl_pipeline.py seawifs 1997-09-04 2010-12-11 seawifs_data seawifs_tpca --processes 8
+    python chl_pipeline.py seawifs 2000-01-01 2000-01-31 seawifs_data seawifs_tpca --profile seawifs_profile.jsonl --profile-memory
+    python chl_pipeline.py seawifs 2000-01-01 2000-12-31 seawifs_data seawifs_tpca --store seawifs_tpca_2000.nc --pack 0 5
+
+@author: npittman
+"""
+
+import os
+import time
+import argparse
+import shutil
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np                   #Version '1.16.1'
+
+from chl_tpca_algorithms import SENSOR_BANDS
+from chl_tiling import l3m_filename, process_tiled
+from chl_cache import ProductCache, product_key
+from chl_profiling import Profiler, NULL_PROFILER, summary_table, write_log
+from chl_output import append_days
+
+def day_range(start_date,end_date):
+    """Returns a list of datetime64[D] days from start_date to end_date (inclusive)"""
+    return list(np.arange(np.datetime64(start_date,'D'),np.datetime64(end_date,'D')+1))
+
+def day_files(sensor,date,input_dir,output_dir,resolution='9km'):
+    """Returns (band files in the sensor function argument order, output file) for a sensor on date"""
+    band_files=[os.path.join(input_dir,l3m_filename(sensor,date,band,resolution)) for band in SENSOR_BANDS[sensor]]
+    output_file=os.path.join(output_dir,l3m_filename(sensor,date,'chl_tpca',resolution))
+    return band_files,output_file
+
+def process_day(sensor,date,input_dir,output_dir,resolution='9km',tile_rows=512,mode='exact',sensor_kwargs={},cache_dir=None,cache_bytes=None,profile=0,profile_memory=0):
+    """
+    Process one day into output_dir. Returns a dict with the day, status ('done','cached','skipped','missing' or 'failed'), time and error.
+    The output is written to a .tmp file and renamed once complete, so an existing output file is always a complete day.
+    With a cache_dir, the day is copied from the product cache when it holds the same band files (name, size, modification time)
+    and arguments, otherwise the processed day is added to the cache (evicting down to cache_bytes). The day's ProductCache.stats() are in the result (cache).
+    With profile=1 the result holds the day's chl_profiling records (profile), with profile_memory=1 including the peak memory of each stage.
+    """
+    start=time.perf_counter()
+    band_files,output_file=day_files(sensor,date,input_dir,output_dir,resolution)
+    result={'date':str(date),'output_file':output_file,'status':'done','time':0.0,'error':None}
+    if os.path.exists(output_file):
+        result['status']='skipped'
+        return result
+    missing=[fileloc for fileloc in band_files if not os.path.exists(fileloc)]
+    if len(missing)>0:
+        result['status']='missing'
+        result['error']='Missing band files: '+', '.join(os.path.basename(fileloc) for fileloc in missing)
+        return result
+
+    tmp_file=output_file+'.tmp'
+    profiler=Profiler(day=date,memory=profile_memory) if profile==1 else NULL_PROFILER
+    cache,cached=None,None
+    try:
+        if cache_dir is not None:
+            cache=ProductCache(cache_dir,max_bytes=cache_bytes)
+            key=product_key(band_files,sensor,None,mode=mode,**sensor_kwargs)
+            with profiler.stage('cache_get') as record:
+                cached=cache.get_file(key)
+                try:
+                    if cached is not None:
+                        shutil.copyfile(cached,tmp_file)
+                        result['status']='cached'
+                        record['bytes_read']+=os.path.getsize(tmp_file)
+                except FileNotFoundError: #Evicted by another process
+                    cached=None
+        if cached is None:
+            process_tiled(band_files,tmp_file,sensor,tile_rows=tile_rows,mode=mode,profiler=profiler,**sensor_kwargs)
+            if cache is not None:
+                with profiler.stage('cache_put') as record:
+                    cache.put_file(key,tmp_file)
+                    record['bytes_written']+=os.path.getsize(tmp_file)
+        os.replace(tmp_file,output_file)
+    except Exception:
+        result['status']='failed'
+        result['error']=traceback.format_exc()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    finally:
+        profiler.close()
+    if cache is not None:
+        result['cache']=cache.stats()
+    result['time']=time.perf_counter()-start
+    if profile==1:
+        result['profile']=profiler.records
+    return result
+
+def run_pipeline(sensor,start_date,end_date,input_dir,output_dir,processes=None,resolution='9km',tile_rows=512,mode='exact',cache_dir=None,cache_bytes=None,profile=0,profile_memory=0,profile_log=None,store=None,store_options={},printer=1,**sensor_kwargs):
+    """
+    Given:
+        sensor - seawifs, modis or meris
+        start_date, end_date - Date range to process (inclusive)
+        input_dir - Directory of daily L3M band files (named as chl_tiling.l3m_filename)
+        output_dir - Directory for the daily TPCA files
+        processes - Size of the process pool, None uses every CPU and 1 runs in this process
+        resolution - L3M resolution in the file names (9km or 4km)
+        tile_rows, mode - Passed to chl_tiling.process_tiled
+        cache_dir, cache_bytes - Optional chl_cache product cache directory and size limit (see process_day)
+        profile, profile_memory - Record the chl_profiling stages of every day (and their peak memory, which slows processing)
+        profile_log - Append the stage records of every day to this json lines file (implies profile=1)
+        store, store_options - Append every finished day to this chl_output product, created with store_options (chunks, complevel, pack, storage_dtype)
+        **sensor_kwargs - Passed to chl_tiling.process_tiled and the sensor function (dtype, ocx_poly, ci_poly, l, h)
+
+    Returns:
+        A summary dict with the per day results, counts of each status, failures, elapsed time and throughput (processed days/min).
+        With profiling, profile is the stage records of every day and profile_summary their summary_table by stage.
+        With a store, store_failures lists the days which could not be appended.
+        With a cache_dir, cache is the hits, misses, hit rate, puts and evictions summed over the days, and the entries and bytes of the cache after the run.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    days=day_range(start_date,end_date)
+    profile=1 if profile_log is not None else profile
+    args=[(sensor,day,input_dir,output_dir,resolution,tile_rows,mode,sensor_kwargs,cache_dir,cache_bytes,profile,profile_memory) for day in days]
+
+    start=time.perf_counter()
+    results=[]
+    store_failures=[]
+    def finished(result): #Results arrive in date order
+        if printer==1:
+            print(result['date'],result['status'])
+        if store is not None and result['status'] in ('done','cached','skipped'):
+            try:
+                append_days(store,[result['date']],[result['output_file']],sensor,mode=mode,**dict(store_options,**sensor_kwargs))
+            except Exception:
+                store_failures.append({'date':result['date'],'error':traceback.format_exc()})
+    if processes==1:
+        for arg in args:
+            results.append(process_day(*arg))
+            finished(results[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures=[pool.submit(process_day,*arg) for arg in args]
+            for day,future in zip(days,futures):
+                try:
+                    results.append(future.result())
+                except Exception: #ie: a worker was killed
+                    results.append({'date':str(day),'output_file':None,'status':'failed','time':0.0,'error':traceback.format_exc()})
+                finished(results[-1])
+    elapsed=time.perf_counter()-start
+
+    counts={status:0 for status in ['done','cached','skipped','missing','failed']}
+    for result in results:
+        counts[result['status']]+=1
+    summary={'sensor':sensor,'results':results,'counts':counts,
+             'failures':[result for result in results if result['status']=='failed'],
+             'elapsed':elapsed,
+             'days_per_minute':counts['done']/(elapsed/60) if elapsed>0 else np.nan}
+    if store is not None:
+        summary['store_failures']=store_failures
+    if cache_dir is not None:
+        stats=[result['cache'] for result in results if 'cache' in result]
+        cache_stats={name:sum(day[name] for day in stats) for name in ['hits','misses','puts','evictions']}
+        lookups=cache_stats['hits']+cache_stats['misses']
+        cache_stats['hit_rate']=cache_stats['hits']/lookups if lookups>0 else np.nan
+        entries=ProductCache(cache_dir).entries()
+        cache_stats.update({'entries':len(entries),'bytes':sum(size for _,size,_ in entries)})
+        summary['cache']=cache_stats
+    if profile==1:
+        summary['profile']=[record for result in results for record in result.get('profile',[])]
+        summary['profile_summary']=summary_table(summary['profile'])
+        if profile_log is not None:
+            write_log(summary['profile'],profile_log)
+    if printer==1:
+        print('Processed:',counts['done'],'Cached:',counts['cached'],'Skipped:',counts['skipped'],'Missing:',counts['missing'],'Failed:',counts['failed'])
+        print('Throughput:',np.round(summary['days_per_minute'],2),'days/min')
+        if cache_dir is not None:
+            print('Cache:',summary['cache'])
+        for failure in summary['failures']+store_failures:
+            print('Failed:',failure['date'],failure['error'])
+        if profile==1:
+            print(summary['profile_summary'].to_string())
+    return summary
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Reprocess daily L3M Rrs files into TPCA chlorophyll')
+    parser.add_argument('sensor',choices=sorted(SENSOR_BANDS))
+    parser.add_argument('start_date',help='YYYY-MM-DD')
+    parser.add_argument('end_date',help='YYYY-MM-DD (inclusive)')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--processes',type=int,default=None)
+    parser.add_argument('--resolution',default='9km')
+    parser.add_argument('--tile-rows',type=int,default=512)
+    parser.add_argument('--mode',default='exact')
+    parser.add_argument('--dtype',choices=['float32','float64'],default=None)
+    parser.add_argument('--cache-dir',default=None)
+    parser.add_argument('--cache-bytes',type=float,default=None)
+    parser.add_argument('--profile',default=None,help='Append per day, per stage profile records to this json lines file')
+    parser.add_argument('--profile-memory',action='store_true',help='Also trace the peak memory of each stage')
+    parser.add_argument('--store',default=None,help='Append every day to this CF NetCDF time series')
+    parser.add_argument('--pack',nargs=2,type=float,default=None,metavar=('MIN','MAX'),help='Store chl as scaled int16 over MIN to MAX')
+    parser.add_argument('--complevel',type=int,default=4,help='zlib level of the store, 0 is uncompressed')
+    a=parser.parse_args()
+    run_pipeline(a.sensor,a.start_date,a.end_date,a.input_dir,a.output_dir,processes=a.processes,resolution=a.resolution,tile_rows=a.tile_rows,mode=a.mode,
+                 cache_dir=a.cache_dir,cache_bytes=a.cache_bytes,profile_log=a.profile,profile_memory=int(a.profile_memory),
+                 store=a.store,store_options={'pack':a.pack,'complevel':a.complevel},dtype=a.dtype)
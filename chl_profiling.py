@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt in per stage profiling of the TPCA processing path (reads, region cut, band ratio / OCx, CI, blend, writes).
+
+Includes:
+    Profiler
+        Record wall time, bytes read / written, peak traced memory (memory=1) and pixel counts (valid, NaN, inside the blending window)
+        of each stage of a day, accumulated over the tiles of the day. close() (or a with block) stops the memory tracing it started.
+    NULL_PROFILER
+        The disabled profiler used by default, its stages are a shared no-op context manager.
+    profiled_sensor_chl
+        A sensor function call split into the band_ratio_ocx, ci and blend stages (the chl_tpca_algorithms helpers the exact
+        sensor function calls), or the sensor function as one tpca_<mode> stage for the other modes, counting the pixels of the result.
+    summary_table
+        Aggregate profile records (ie: every day of a chl_pipeline run) into a DataFrame by stage, day or both.
+    write_log / read_log
+        Append profile records to, and read them from, a json lines log.
+
+Stages:
+    read - netCDF hyperslab reads (bytes are the stored, ie: int16, bytes of the hyperslabs)
+    cut - Lazily opening the files and chl_regions.cut_region (the dateline handling, before any data is read)
+    band_ratio_ocx - Max band ratio, log10 and Chl OCx
+    ci - CI and Chl CI
+    blend - blended_chl (pixel counts: valid and NaN chl, and Chl CI inside the l to h blending window)
+    tpca_<mode> - The fused, masked or lut sensor function (in_window is only counted with Profiler(window=1),
+                  which recalculates Chl CI outside the timed stage, a full size temporary)
+    write - Output writes
+    cache_get / cache_put - chl_cache product cache lookups and writes
+
+Disabled profiling (profiler=None) costs one attribute lookup and an empty with block per stage.
+Peak memory uses tracemalloc, which slows numpy allocations, so it is only traced with memory=1 and stopped by close().
+The peak of a stage uses tracemalloc.reset_peak (Python >= 3.9), on older Pythons (ie: 3.7) the traces are cleared at the start
+of each stage instead, so stage peaks are still correct but tracemalloc snapshots taken elsewhere lose the earlier traces.
+
+Usage:
+    with Profiler(day='2000-01-01',memory=1) as profiler:
+        process_tiled(band_files,'S2000001_TPCA_9km.nc','seawifs',profiler=profiler)
+    print(summary_table(profiler.records))
+
+    python chl_pipeline.py seawifs 2000-01-01 2000-12-31 seawifs_data seawifs_tpca --profile seawifs_2000_profile.jsonl
+
+@author: npittman
+"""
+
+import json
+import time
+import tracemalloc
+import numpy as np                   #Version '1.16.1'
+import pandas as pd                  #Version '0.23.3'
+
+from chl_tpca_algorithms import SENSOR_FUNCTIONS, SENSOR_WAVELENGTHS, calculate_mbr, calculate_ci, calculate_chl_ocx, calculate_chl_ci, blended_chl, cast_bands, cast_coefficients, sensor_coefficients
+
+_RESET_PEAK=hasattr(tracemalloc,'reset_peak') #Python >= 3.9
+COUNTERS=['calls','time','bytes_read','bytes_written','peak_bytes','pixels','valid','nan','in_window']
+
+class _NullStage:
+    """No-op stage of a disabled profiler"""
+    record={c:0 for c in COUNTERS} #Discarded counts
+    def __enter__(self):
+        return self.record
+    def __exit__(self,*exc):
+        return False
+
+_NULL_STAGE=_NullStage()
+
+class _Stage:
+    def __init__(self,profiler,record):
+        self.profiler=profiler
+        self.record=record
+
+    def __enter__(self):
+        if self.profiler.memory==1:
+            if _RESET_PEAK:
+                tracemalloc.reset_peak()
+                self.start_memory=tracemalloc.get_traced_memory()[0]
+            else: #Blocks allocated before the stage are no longer traced, so the peak is of the stage
+                tracemalloc.clear_traces()
+                self.start_memory=0
+        self.start=time.perf_counter()
+        return self.record
+
+    def __exit__(self,*exc):
+        self.record['time']+=time.perf_counter()-self.start
+        self.record['calls']+=1
+        if self.profiler.memory==1:
+            self.record['peak_bytes']=max(self.record['peak_bytes'],tracemalloc.get_traced_memory()[1]-self.start_memory)
+        return False
+
+class Profiler:
+    """
+    Given:
+        day - Label of the records (ie: the processed date)
+        memory - Trace the peak memory allocated in each stage (tracemalloc is started if needed, and stopped by close())
+        enabled - 0 gives a disabled profiler (see NULL_PROFILER)
+        window - Also count the pixels inside the blending window for the non exact modes (see profiled_sensor_chl)
+
+    Usage:
+        with Profiler(day,memory=1) as profiler:
+            with profiler.stage('read') as record:
+                bands=read_bands(variables,rows,cols)
+                record['bytes_read']+=sum(band.nbytes for band in bands)
+
+    Stages are not nested. Each stage record is a dict of COUNTERS accumulated over every call of the stage,
+    except peak_bytes which is the largest peak of a call.
+    """
+    def __init__(self,day=None,memory=0,enabled=1,window=0):
+        self.day=None if day is None else str(day)
+        self.memory=memory
+        self.enabled=enabled
+        self.window=window
+        self._records={}
+        self._tracing=enabled==1 and memory==1 and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+
+    def close(self):
+        """Stop the memory tracing started by this profiler, the records are kept"""
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing=False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+        return False
+
+    def stage(self,name):
+        """Context manager timing one call of a stage, yielding the stage record to add bytes and pixel counts to"""
+        if self.enabled!=1:
+            return _NULL_STAGE
+        if name not in self._records:
+            self._records[name]=dict({'day':self.day,'stage':name},**{c:0 for c in COUNTERS})
+        return _Stage(self,self._records[name])
+
+    def count(self,name,chl,chl_ci=None,l=None,h=None):
+        """Add the pixel counts of chl (and of chl_ci inside the l to h blending window) to a stage, without timing the counting"""
+        if self.enabled!=1:
+            return
+        chl=np.asarray(chl)
+        valid=int(np.count_nonzero(np.isfinite(chl)))
+        in_window=0
+        if chl_ci is not None:
+            chl_ci=np.asarray(chl_ci)
+            in_window=int(np.count_nonzero((chl_ci>=l)&(chl_ci<=h)))
+        self.add(name,pixels=chl.size,valid=valid,nan=chl.size-valid,in_window=in_window)
+
+    def add(self,name,**counts):
+        """Add counts (ie: bytes_written) to a stage without timing it"""
+        if self.enabled!=1:
+            return
+        if name not in self._records:
+            self._records[name]=dict({'day':self.day,'stage':name},**{c:0 for c in COUNTERS})
+        for counter,value in counts.items():
+            self._records[name][counter]+=value
+
+    @property
+    def records(self):
+        """List of stage records (dicts of day, stage and COUNTERS) in the order the stages were first used"""
+        return [dict(record) for record in self._records.values()]
+
+NULL_PROFILER=Profiler(enabled=0)
+
+def profiled_sensor_chl(profiler,sensor,*bands,mode='exact',dtype=None,out=None,workspace=None,**kwargs):
+    """
+    Given:
+        profiler - Profiler (or None / NULL_PROFILER, calling the sensor function directly)
+        sensor - seawifs, modis or meris
+        *bands - RRS bands in the sensor function argument order
+        mode, dtype, out, workspace, **kwargs - As the sensor functions (ocx_poly, ci_poly, l, h)
+
+    Calculate:
+        mode='exact' times the chl_tpca_algorithms calls of the exact sensor function as the stages
+        band_ratio_ocx (calculate_mbr, log10, calculate_chl_ocx), ci (calculate_ci, calculate_chl_ci) and blend (blended_chl).
+        Other modes run the sensor function as one tpca_<mode> stage.
+        Pixel counts (valid, NaN and, for exact or Profiler(window=1), in the blending window) are added to the blend (or tpca_<mode>) stage.
+
+    Returns:
+        TPCA chl, identical to SENSOR_FUNCTIONS[sensor](*bands,mode=mode,dtype=dtype,**kwargs)
+    """
+    func=SENSOR_FUNCTIONS[sensor]
+    if profiler is None or profiler.enabled!=1:
+        return func(*bands,mode=mode,dtype=dtype,out=out,workspace=workspace,**kwargs)
+    coefficients=sensor_coefficients(sensor,**kwargs)
+    ocx_poly,ci_poly,l,h=[coefficients[name] for name in ['ocx_poly','ci_poly','l','h']]
+    wavelengths=SENSOR_WAVELENGTHS[sensor]
+
+    if mode!='exact':
+        name='tpca_'+str(mode)
+        with profiler.stage(name):
+            chl=func(*bands,mode=mode,dtype=dtype,out=out,workspace=workspace,**kwargs)
+        if profiler.window==1: #Not timed, for the in_window count
+            profiler.count(name,chl,calculate_chl_ci(ci_poly,calculate_ci(bands[:-2],bands[-2],bands[-1],wavelengths)),l,h)
+        else:
+            profiler.count(name,chl)
+        return chl
+
+    if dtype is not None:
+        bands=cast_bands(dtype,*bands)
+        ocx_poly,ci_poly,l,h=cast_coefficients(dtype,ocx_poly,ci_poly,l,h)
+    blues,green,red=bands[:-2],bands[-2],bands[-1]
+    with profiler.stage('band_ratio_ocx'):
+        chl_ocx=calculate_chl_ocx(ocx_poly,np.log10(calculate_mbr(blues,green)))
+    with profiler.stage('ci'):
+        chl_ci=calculate_chl_ci(ci_poly,calculate_ci(blues,green,red,wavelengths))
+    with profiler.stage('blend'):
+        chl=blended_chl(chl_ci,chl_ocx,h=h,l=l)
+    profiler.count('blend',chl,chl_ci,l,h)
+    if out is not None:
+        out[...]=chl
+        return out
+    return chl
+
+def summary_table(records,by='stage',printer=0):
+    """
+    Given profile records (Profiler.records, or read_log of a run), returns a DataFrame of the summed counters grouped by
+    'stage', 'day' or ['day','stage'] (peak_bytes is the maximum), with each group's fraction of the total time
+    and its throughput (pixels / s, for stages which count pixels).
+    """
+    table=pd.DataFrame(list(records),columns=['day','stage']+COUNTERS)
+    aggregate={c:('max' if c=='peak_bytes' else 'sum') for c in COUNTERS}
+    table=table.groupby(by,sort=False).agg(aggregate)
+    table['time_fraction']=table['time']/table['time'].sum()
+    with np.errstate(divide='ignore',invalid='ignore'):
+        table['pixels_per_second']=np.where(table['pixels']>0,table['pixels']/table['time'],np.nan)
+    if printer==1:
+        print(table.to_string())
+    return table
+
+def write_log(records,fileloc):
+    """Append profile records to a json lines log, one record per line"""
+    with open(fileloc,'a') as f:
+        for record in records:
+            f.write(json.dumps(record)+'\n')
+
+def read_log(fileloc):
+    """Every record of a json lines profile log"""
+    with open(fileloc) as f:
+        return [json.loads(line) for line in f if line.strip()]
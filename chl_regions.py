@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Region extraction from global L3M datasets by hyperslab, without rolling the global grid across the dateline.
+
+Includes:
+    REGIONS
+        Named lat / lon boxes, longitudes in 0-360 so boxes can cross the dateline.
+    region_lon_slices
+        Turn a 0-360 longitude box into the contiguous native longitude slices (two when the box crosses the native edge).
+    cut_region
+        Cut a named region (or lat / lon box) out of a global dataset, selecting and concatenating only the region slices.
+    open_region
+        Lazily open L3M files and cut a region, so only the region hyperslabs are read from disk.
+
+The output is identical to the original cut_tropical_pacific (lon % 360, roll, then sel), but only the region is indexed,
+so a lazily opened (or dask backed) dataset only reads ~10% of the global grid for the tropical Pacific.
+
+Usage:
+    rrs=open_region(file_locations[0:5],'tropical_pacific')
+    nino34=cut_region(xr.open_dataset(fileloc),'nino34')
+
+@author: npittman
+"""
+
+import numpy as np                   #Version '1.16.1'
+import xarray as xr                  #Version '0.11.3'
+
+REGIONS={'tropical_pacific':(-20,20,120,290), #(lat_min, lat_max, lon_min, lon_max)
+         'equatorial_pacific':(-5,5,120,290),
+         'nino34':(-5,5,190,240),
+         'nino3':(-5,5,210,270),
+         'nino4':(-5,5,160,210),
+         'warm_pool':(-10,10,120,180)}
+
+def region_lon_slices(lon,lon_min,lon_max):
+    """
+    Given:
+        lon - Native longitude coordinate (ie: -180 to 180)
+        lon_min, lon_max - Box in 0-360 longitude (inclusive), lon_min > lon_max wraps across 0°
+
+    Returns:
+        A list of index slices into lon, ordered so that the concatenated longitudes run from lon_min to lon_max.
+    """
+    lon360=np.asarray(lon)%360
+    if lon_min<=lon_max:
+        inside=(lon360>=lon_min)&(lon360<=lon_max)
+    else:
+        inside=(lon360>=lon_min)|(lon360<=lon_max)
+    index=np.nonzero(inside)[0]
+    if index.size==0:
+        return []
+    index=index[np.argsort((lon360[index]-lon_min)%360,kind='mergesort')]
+    breaks=np.nonzero(np.diff(index)!=1)[0]+1
+    return [slice(run[0],run[-1]+1) for run in np.split(index,breaks)]
+
+def cut_region(dataset,region='tropical_pacific'):
+    """
+    Given:
+        dataset - Global xarray Dataset or DataArray with lat and lon
+        region - A name in REGIONS or a (lat_min, lat_max, lon_min, lon_max) box, lon in 0-360
+
+    Returns:
+        The region with lon in 0-360, lat in the native order. Equal to the roll based cut_tropical_pacific.
+    """
+    lat_min,lat_max,lon_min,lon_max=REGIONS[region] if isinstance(region,str) else region
+    lat=dataset.lat.values
+    lat_slice=slice(lat_max,lat_min) if lat[0]>lat[-1] else slice(lat_min,lat_max)
+
+    slabs=[dataset.isel(lon=lon_slice).sel(lat=lat_slice) for lon_slice in region_lon_slices(dataset.lon.values,lon_min,lon_max)]
+    if len(slabs)==0:
+        raise ValueError('No longitudes in region: '+str(region))
+    elif len(slabs)==1:
+        cut=slabs[0]
+    elif isinstance(dataset,xr.DataArray):
+        cut=xr.concat(slabs,dim='lon')
+    else:
+        cut=xr.concat(slabs,dim='lon',data_vars='minimal',coords='minimal') #Variables without lon (ie: palette) are not duplicated
+    return cut.assign_coords(lon=(cut.lon % 360))
+
+def open_region(file_locations,region='tropical_pacific',chunks={},dtype=None):
+    """
+    Lazily open one (or a list of) L3M files and cut a region.
+    With chunks (default: the file chunks) the slabs are concatenated lazily with dask, and only the region is read on compute.
+    chunks=None uses lazily indexed numpy arrays instead, where loading the result reads only the region hyperslabs.
+    dtype casts the floating point variables (ie: np.float32 for Rrs stored as float64, or to keep float32 through the cutout).
+    """
+    if isinstance(file_locations,str):
+        dataset=xr.open_dataset(file_locations,chunks=chunks)
+    else:
+        dataset=xr.merge([xr.open_dataset(fileloc,chunks=chunks) for fileloc in file_locations])
+    cut=cut_region(dataset,region)
+    if dtype is not None:
+        for name in [name for name in cut.data_vars if np.issubdtype(cut[name].dtype,np.floating)]:
+            cut[name]=cut[name].astype(dtype)
+    return cut
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression harness: recompute the stored columns of the matchup databases and compare them with the published values.
+
+Includes:
+    REGRESSION_COLUMNS
+        The recomputed columns: TPCA_chl, chl_ci, chl_ocx, CI, MBR and max_blue_rrs.
+    TOLERANCES
+        (rtol, atol) of each column against the published values, set by the rounding of the csvs (4 decimal chl, 5 decimal Rrs).
+    KNOWN_DIFFERENCES
+        (sensor, column) pairs which are reported but not gated, with the reason.
+    recompute_columns
+        Every regression column of a matchup database from its Rrs columns, with one vectorized call per column (sensor function arguments, ie: mode, dtype).
+    compare_columns
+        Per column max / percentile errors and the mismatched rows of recomputed against stored columns.
+    edge_cases
+        Synthetic rows with zero / negative green Rrs, zero blue Rrs and a NaN band, added to the reference comparison.
+    regression_report
+        Compare all three sensors against the published columns, and (for a mode or dtype) TPCA_chl against the exact float64 recomputation.
+
+The columns of the provided databases are derived from the window averaged Rrs:
+    TPCA_chl - The sensor function (TPCA coefficients and blending window)
+    chl_ocx - 10**OCx polynomial of log10(MBR), with the NASA OC4 / OC3M polynomial for every sensor (DATABASE_OCX_POLY)
+    chl_ci - 10**(-0.4287+230.47*CI), the NASA OCI CI coefficients for every sensor (DATABASE_CI_POLY)
+    CI, MBR, max_blue_rrs - The color index, max band ratio and largest blue Rrs
+
+Only TPCA_chl is calculated by the sensor function under test (mode), the other columns always use the numpy operations
+of recompute_columns, so the reference comparison of a mode or dtype gates TPCA_chl alone (over the matchups and edge_cases).
+
+Usage:
+    python chl_regression.py                              #Exact float64 sensor functions against the published columns
+    python chl_regression.py --mode lut --dtype float32   #Also gate lut / float32 TPCA_chl against the exact recomputation (rtol 1e-5)
+
+@author: npittman
+"""
+
+import sys
+import time
+import argparse
+import warnings
+import numpy as np                   #Version '1.16.1'
+import pandas as pd                  #Version '0.23.3'
+
+from chl_tpca_algorithms import SENSOR_FUNCTIONS, MATCHUP_BANDS, SENSOR_WAVELENGTHS, calculate_chl_ci, calculate_chl_ocx, cast_bands, cast_coefficients
+from chl_matchup_extraction import DATABASE_OCX_POLY, DATABASE_CI_POLY
+from chl_matchups import load_matchups
+
+REGRESSION_COLUMNS=['TPCA_chl','chl_ci','chl_ocx','CI','MBR','max_blue_rrs']
+TOLERANCES={'TPCA_chl':(0.01,1e-4),
+            'chl_ci':(0.01,1e-4),
+            'chl_ocx':(0.025,1e-4),  #log10 of the rounded MBR amplifies the Rrs rounding
+            'CI':(0.01,2e-5),        #CI is ~0, so its rounding is absolute
+            'MBR':(0.01,1e-5),
+            'max_blue_rrs':(0,1e-9)}
+KNOWN_DIFFERENCES={('meris','TPCA_chl'):'The published MERIS TPCA_chl column is a copy of NASA_chlor_a (per pixel L3 chlor_a averaged over the window)'}
+
+def recompute_columns(matchups,sensor='seawifs',dtype=None,**sensor_kwargs):
+    """
+    Given:
+        matchups - Matchup DataFrame (ie: chl_matchups.load_matchups(sensor))
+        sensor - seawifs, modis or meris
+        dtype - Calculation dtype of every column (None is float64)
+        **sensor_kwargs - Passed to the sensor function for TPCA_chl (ocx_poly, ci_poly, l, h, mode)
+
+    Returns:
+        DataFrame of REGRESSION_COLUMNS recomputed from the Rrs columns.
+    """
+    dtype=np.float64 if dtype is None else dtype
+    bands=cast_bands(dtype,*[matchups[band].values for band in MATCHUP_BANDS[sensor]])
+    blues,green,red=bands[:-2],bands[-2],bands[-1]
+    ocx_poly,ci_poly,_,_=cast_coefficients(dtype,DATABASE_OCX_POLY,DATABASE_CI_POLY,0,0)
+    b,g,r=SENSOR_WAVELENGTHS[sensor]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        mbr=np.max(np.divide(blues,green),axis=0)
+        CI=green-(blues[0]+(g-b)/(r-b)*(red-blues[0]))
+        return pd.DataFrame({'TPCA_chl':SENSOR_FUNCTIONS[sensor](*bands,dtype=dtype,**sensor_kwargs),
+                             'chl_ci':calculate_chl_ci(ci_poly,CI),
+                             'chl_ocx':calculate_chl_ocx(ocx_poly,np.log10(mbr)),
+                             'CI':CI,
+                             'MBR':mbr,
+                             'max_blue_rrs':np.max(blues,axis=0)},index=matchups.index)
+
+def compare_columns(stored,recomputed,tolerances=TOLERANCES,percentiles=(50,99)):
+    """
+    Given stored and recomputed DataFrames (same rows) and {column: (rtol, atol)}, returns (summary, mismatches):
+        summary - DataFrame indexed by column: n, max_abs, max_rel and the relative error percentiles, mismatches (rows outside the tolerance)
+        mismatches - DataFrame of the rows outside |recomputed - stored| <= atol + rtol*|stored| (NaN in only one is a mismatch)
+    """
+    rows,mismatches=[],[]
+    for column,(rtol,atol) in tolerances.items():
+        if column not in recomputed:
+            continue
+        a=np.asarray(recomputed[column],dtype=np.float64)
+        e=np.asarray(stored[column],dtype=np.float64)
+        with np.errstate(divide='ignore',invalid='ignore'),warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning) #All NaN columns
+            error=np.abs(a-e)
+            rel=error/np.abs(e)
+            bad=(error>atol+rtol*np.abs(e))|(np.isnan(a)!=np.isnan(e))
+            row={'column':column,'n':int(np.count_nonzero(~np.isnan(e))),'max_abs':np.nanmax(error),'max_rel':np.nanmax(rel[np.isfinite(rel)]) if np.isfinite(rel).any() else np.nan}
+            for p in percentiles:
+                row['p'+str(p)+'_rel']=np.nanpercentile(rel[np.isfinite(rel)],p) if np.isfinite(rel).any() else np.nan
+        row['mismatches']=int(np.count_nonzero(bad))
+        rows.append(row)
+        index=np.flatnonzero(bad)
+        mismatches.append(pd.DataFrame({'row':stored.index.values[index],'column':column,'expected':e[index],'recomputed':a[index],'rel_error':rel[index]}))
+    mismatches=pd.concat(mismatches,ignore_index=True) if len(mismatches)>0 else pd.DataFrame(columns=['row','column','expected','recomputed','rel_error'])
+    return pd.DataFrame(rows).set_index('column'),mismatches
+
+def edge_cases(matchups,sensor='seawifs'):
+    """
+    Copies of the first matchup with green Rrs of 0 and -1e-4 (an infinite / NaN max band ratio), every blue band 0
+    (a -inf log10 band ratio) and a NaN red band, indexed edge_green_zero, edge_green_negative, edge_blue_zero, edge_red_nan.
+    """
+    bands=MATCHUP_BANDS[sensor]
+    row=matchups.iloc[[0]*4].copy()
+    row.index=['edge_green_zero','edge_green_negative','edge_blue_zero','edge_red_nan']
+    row.loc['edge_green_zero',bands[-2]]=0
+    row.loc['edge_green_negative',bands[-2]]=-1e-4
+    row.loc['edge_blue_zero',bands[:-2]]=0
+    row.loc['edge_red_nan',bands[-1]]=np.nan
+    return row
+
+def regression_report(sensors=('seawifs','modis','meris'),rtol=1e-5,dtype=None,printer=1,**sensor_kwargs):
+    """
+    Given:
+        sensors - Matchup databases to check
+        rtol - Relative tolerance of the reference comparison
+        dtype, **sensor_kwargs - The implementation under test (ie: mode='lut', dtype=np.float32), default the exact float64 sensor functions
+
+    Calculate:
+        The recomputed columns against the published columns (TOLERANCES, except KNOWN_DIFFERENCES),
+        and when a dtype or sensor_kwargs are given, TPCA_chl of the matchups and edge_cases against the exact float64
+        sensor function within rtol (atol 1e-12, a NaN in only one is a mismatch).
+
+    Returns:
+        A dict of published / reference summaries indexed by (sensor, column), their mismatched rows (with a sensor column),
+        passed (no gated mismatches) and the elapsed time.
+    """
+    start=time.perf_counter()
+    summaries={'published':[],'reference':[]}
+    mismatches={'published':[],'reference':[]}
+    passed=True
+    for sensor in sensors:
+        matchups=load_matchups(sensor)
+        recomputed=recompute_columns(matchups,sensor,dtype=dtype,**sensor_kwargs)
+        comparisons=[('published',matchups,recomputed,TOLERANCES)]
+        if dtype is not None or len(sensor_kwargs)>0:
+            cases=pd.concat([matchups,edge_cases(matchups,sensor)])
+            with np.errstate(divide='ignore',invalid='ignore'):
+                tested=recompute_columns(cases,sensor,dtype=dtype,**sensor_kwargs)[['TPCA_chl']]
+                reference=recompute_columns(cases,sensor)[['TPCA_chl']]
+            comparisons.append(('reference',reference,tested,{'TPCA_chl':(rtol,1e-12)}))
+        for name,expected,recomputed,tolerances in comparisons:
+            summary,rows=compare_columns(expected,recomputed,tolerances)
+            summary['known_difference']=[(sensor,column) in KNOWN_DIFFERENCES and name=='published' for column in summary.index]
+            gated=summary[~summary['known_difference']]
+            passed=passed and int(gated['mismatches'].sum())==0
+            summaries[name].append(pd.concat({sensor:summary},names=['sensor']))
+            rows.insert(0,'sensor',sensor)
+            mismatches[name].append(rows)
+
+    report={'passed':passed,'elapsed':time.perf_counter()-start}
+    for name in ['published','reference']:
+        report[name]=pd.concat(summaries[name]) if len(summaries[name])>0 else None
+        report[name+'_mismatches']=pd.concat(mismatches[name],ignore_index=True) if len(mismatches[name])>0 else None
+    if printer==1:
+        for name in ['published','reference']:
+            if report[name] is not None:
+                print('Against the '+name+' columns:')
+                print(report[name].to_string())
+        for (sensor,column),reason in KNOWN_DIFFERENCES.items():
+            if sensor in sensors:
+                print('Known difference (not gated):',sensor,column,'-',reason)
+        print('PASSED' if passed else 'FAILED',np.round(report['elapsed'],3),'s')
+    return report
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Recompute the matchup database columns and compare them with the published values')
+    parser.add_argument('--sensors',nargs='+',default=['seawifs','modis','meris'],choices=sorted(SENSOR_FUNCTIONS))
+    parser.add_argument('--mode',default=None,help='Sensor function mode under test (fused, masked or lut)')
+    parser.add_argument('--dtype',choices=['float32','float64'],default=None)
+    parser.add_argument('--rtol',type=float,default=1e-5,help='Relative tolerance against the exact float64 recomputation')
+    parser.add_argument('--mismatches',default=None,help='Write the mismatched rows to this csv')
+    a=parser.parse_args()
+    kwargs={} if a.mode is None else {'mode':a.mode}
+    report=regression_report(a.sensors,rtol=a.rtol,dtype=a.dtype,**kwargs)
+    if a.mismatches is not None:
+        pd.concat([report[name+'_mismatches'].assign(comparison=name) for name in ['published','reference'] if report[name+'_mismatches'] is not None]).to_csv(a.mismatches,index=False)
+    sys.exit(0 if report['passed'] else 1)
@@ -6,12 +6,19 @@ Includes:
         A linear trend plotter which returns linear statistics.
     check_bias
         Bias diagnostics including: % Wins, mean and median log bias+absolute error.
+    bias_statistics
+        Vectorized, headless bias diagnostics for any number of models, returned as tables.
+    win_percent
+        % Wins matrix from the bias_statistics win counts.
+    plot_bias
+        Plot each model against the in situ observations (separate from the statistics).
 Small function to plot linear trends of data (Specifically low chlorophyll concentrations)
 
 @author: npittman
 """
 
 import numpy as np                   #Version '1.16.1'
+import pandas as pd                  #Version '0.23.3'
 import matplotlib.pyplot as plt      #Version '3.0.0'
 from scipy.stats import linregress   #Version '1.1.0'
 
@@ -80,80 +87,146 @@ def plot_linear_trend(x,y,title,xlab,ylab,diagonal_line=1,printer=1,plot=1,logsp
 
 
 
+def _model_matrix(models,names=None):
+    """Stack models (dict of name: array, list of arrays or a 2D array with one model per row) into (names, 2D float array)"""
+    if isinstance(models,dict):
+        names=list(models.keys()) if names is None else names
+        models=list(models.values())
+    matrix=np.vstack([np.ravel(np.asarray(model,dtype=np.float64)) for model in models])
+    if names is None:
+        names=['Model '+chr(ord('A')+i) if i<26 else 'Model '+str(i) for i in range(matrix.shape[0])]
+    return list(names),matrix
+
+def _nan_mean_median_rows(a):
+    """(np.nanmean(a,axis=1), np.nanmedian(a,axis=1)) from a single partition per row (NaN sort to the end), rows are grouped by their number of valid values"""
+    counts=a.shape[1]-np.count_nonzero(np.isnan(a),axis=1)
+    mean=np.full(a.shape[0],np.nan)
+    median=np.full(a.shape[0],np.nan)
+    for count in np.unique(counts[counts>0]):
+        rows=np.nonzero(counts==count)[0]
+        k=count//2
+        part=a[rows] if len(rows)<a.shape[0] else a.copy()
+        part.partition(k,axis=1)
+        mean[rows]=part[:,:count].sum(axis=1)/count
+        median[rows]=part[:,k] if count%2==1 else (part[:,:k].max(axis=1)+part[:,k])/2
+    return mean,median
+
+def bias_statistics(in_situ,models,names=None):
+    """
+    Given:
+        in_situ - Observed chlorophyll (N)
+        models - Any number of model estimates; a dict of name: array, a list of arrays or a 2D array (models x N)
+        names - Optional model names (default Model A, Model B, ...)
+
+    Calculate (in one vectorized pass):
+        wins[i,j] - Number of observations where model i has a smaller absolute % error than model j
+        draws[i,j] - Number of observations with equal absolute % errors (including NaN errors, as check_bias)
+        Per model: % best (smallest error of all models), mean / median log bias, mean / median log absolute error,
+        and the slope, intercept, r and R2 of the linear regression of model against in situ.
+        Observations where either in situ or the model is NaN are excluded from the log and linear statistics.
+
+    Returns:
+        summary (DataFrame, one row per model), wins (DataFrame), draws (DataFrame)
+    """
+    names,y=_model_matrix(models,names)
+    x=np.ravel(np.asarray(in_situ,dtype=np.float64))
+    n_models,n_obs=y.shape
+    mask=np.empty(y.shape,dtype=bool) #Reused boolean buffer
+
+    #Wins and draws on the absolute % error
+    error=np.subtract(y,x)
+    np.divide(error,x,out=error)
+    np.abs(error,out=error)
+    np.multiply(error,100,out=error)
+    wins=np.zeros((n_models,n_models),dtype=np.int64)
+    for i in range(n_models):
+        np.less(error[i],error,out=mask)
+        wins[i]=np.count_nonzero(mask,axis=1)
+    draws=n_obs-wins-wins.T #Equal or NaN
+
+    #% of observations where each model is (uniquely) the best
+    np.isnan(error,out=mask)
+    np.copyto(error,np.inf,where=mask)
+    best=np.argmin(error,axis=0)
+    np.equal(error,error[best,np.arange(n_obs)],out=mask)
+    unique=np.count_nonzero(mask,axis=0)==1
+    best_percent=np.bincount(best[unique],minlength=n_models)/n_obs*100
+    del error
+
+    #Log bias and absolute error
+    with np.errstate(divide='ignore',invalid='ignore'):
+        log_diff=np.log10(y)
+        log_diff-=np.log10(x)
+    mean_log_bias,median_log_bias=_nan_mean_median_rows(log_diff)
+    np.abs(log_diff,out=log_diff)
+    mae,median_ae=_nan_mean_median_rows(log_diff)
+    del log_diff
+
+    #Linear regression of each model against in situ, from sums shifted by the mean in situ for stability
+    x_nan=np.isnan(x)
+    np.isnan(y,out=mask)
+    np.logical_or(mask,x_nan,out=mask)
+    shift=np.nanmean(x)
+    xc=np.where(x_nan,0.0,x-shift)
+    yc=np.subtract(y,shift)
+    np.copyto(yc,0.0,where=mask)
+    n=n_obs-np.count_nonzero(mask,axis=1)
+    if np.all(n==n_obs-np.count_nonzero(x_nan)): #Only in situ NaNs, every model uses the same observations
+        sx=np.full(n_models,xc.sum())
+        sxx=np.full(n_models,np.dot(xc,xc))
+    else:
+        np.logical_not(mask,out=mask)
+        sx=np.dot(mask,xc)
+        sxx=np.dot(mask,xc*xc)
+    sy=yc.sum(axis=1)
+    syy=np.einsum('ij,ij->i',yc,yc)
+    sxy=np.dot(yc,xc)
+    sxx=sxx-sx*sx/n
+    syy=syy-sy*sy/n
+    sxy=sxy-sx*sy/n
+    slope=sxy/sxx
+    r_value=sxy/np.sqrt(sxx*syy)
+    intercept=(sy/n+shift)-slope*(sx/n+shift)
+
+    summary=pd.DataFrame({'n':n,
+                          'best_percent':best_percent,
+                          'mean_log_bias':10**mean_log_bias,
+                          'median_log_bias':10**median_log_bias,
+                          'mae':10**mae,
+                          'median_ae':10**median_ae,
+                          'slope':slope,
+                          'intercept':intercept,
+                          'r_value':r_value,
+                          'r2':r_value**2},index=pd.Index(names,name='model'))
+    return summary,pd.DataFrame(wins,index=names,columns=names),pd.DataFrame(draws,index=names,columns=names)
+
+def win_percent(wins):
+    """% of decided (not drawn) observations where the row model beat the column model, as reported by check_bias"""
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return wins/(wins+wins.T)*100
+
+def plot_bias(in_situ,models,names=None,title='Algorithms vs Observed',printer=1):
+    """Plot the first model against in situ, with the remaining models as open circles (plot_linear_trend)"""
+    names,y=_model_matrix(models,names)
+    x=np.ravel(np.asarray(in_situ,dtype=np.float64))
+    zx=np.tile(x,y.shape[0]-1)
+    zy=np.ravel(y[1:])
+    plot_linear_trend(x,y[0],title,'In situ $mg/m^3$',names[0]+' Chlor a',zx=zx,zy=zy,trendline=1 if y.shape[0]>1 else 0,printer=printer)
+
 def check_bias(in_situ,model_a,model_b,plot=1):
-    a_bias=((model_a-in_situ)/in_situ)*100
-    a_abs_error=abs(a_bias)
-    
-    b_bias=((model_b-in_situ)/in_situ)*100
-    b_abs_error=abs(b_bias)
-    
-    a_wins,b_wins,draw=0,0,0
-    try:
-        for i in range(len(in_situ)):
-            if a_abs_error.iloc[i]<b_abs_error.iloc[i]:
-                a_wins+=1
-            elif a_abs_error.iloc[i]>b_abs_error.iloc[i]:
-                b_wins+=1
-            else:
-                draw+=1
-    except:
-        for i in range(len(in_situ)):
-            if a_abs_error[i]<b_abs_error[i]:
-                a_wins+=1
-            elif a_abs_error[i]>b_abs_error[i]:
-                b_wins+=1
-            else:
-                draw+=1
-    total=a_wins+b_wins        
-    #print(a_wins,b_wins,draw) 
-    try:
-        a_win_percent=(a_wins/total)*100
-    except:
-        print('nothing?')
-        
-    try:
-        b_win_percent=(b_wins/total)*100
-    except:
-        print('nothing?')
-        
-    new_bias=10**(np.nanmean(np.log10(model_a)-np.log10(in_situ)))
-    nasa_bias=10**(np.nanmean(np.log10(model_b)-np.log10(in_situ)))
-    
-    new_med_bias=10**(np.nanmedian(np.log10(model_a)-np.log10(in_situ)))
-    nasa_med_bias=10**(np.nanmedian(np.log10(model_b)-np.log10(in_situ)))
-    
-    
-    new_mae=10**(np.nanmean(abs(np.log10(model_a)-np.log10(in_situ))))
-    nasa_mae=10**(np.nanmean(abs(np.log10(model_b)-np.log10(in_situ))))
-        
-    new_med_ae=10**(np.nanmedian(abs(np.log10(model_a)-np.log10(in_situ))))
-    nasa_med_ae=10**(np.nanmedian(abs(np.log10(model_b)-np.log10(in_situ))))
-    
-    slope_a,int_a,r2_a,_,_=plot_linear_trend(in_situ,model_a,'New Algorithm vs Observed','In situ $mg/m^3$','New Algorithm Chlor a',plot=0)
-    slope_b,int_b,r2_b,_,_=plot_linear_trend(in_situ,model_b,'NASA Algorithm vs Observed','In situ $mg/m^3$','NASA Chlor a',plot=0)
-    
-    plot_linear_trend(in_situ,model_a,'Both Algorithms vs Observed','In situ $mg/m^3$','New Algorithm Chlor a',plot=plot,zx=in_situ,zy=model_b)
-    
+    """Compare two models (ie: TPCA and NASA) against in situ, printing and plotting when plot=1. Returns the bias_statistics summary"""
+    summary,wins,draws=bias_statistics(in_situ,[model_a,model_b],names=['Model A','Model B'])
+    percent=win_percent(wins)
     if plot==1:
-        print('Model A')   
-        print('Model A was better:',np.round(a_win_percent,3),'% of observations')
-        #print('Model A Mean Log Bias: ',np.round(new_bias,3))
-        print('Model A Median Log Bias: ',np.round(new_med_bias,3))
-        #print('Model A Mean AE: ',np.round(new_mae,3))
-        print('Model A Median AE: ',np.round(new_med_ae,3))
-        print('Model A Slope: ',np.round(slope_a,3))
-        print('Model A Intercept: ',np.round(int_a,3))
-        print('Model A R2: ', np.round(r2_a,3))
-
-        print('')
-        print('Model B')
-        print('Model B was better:',np.round(b_win_percent,3),'% of observations')
-        #print('Model B Mean Log Bias: ',np.round(nasa_bias,3))
-        print('Model B Median Log Bias: ',np.round(nasa_med_bias,3))
-        #print('Model B Mean AE: ',np.round(nasa_mae,3))
-        print('Model B Median AE: ',np.round(nasa_med_ae,3))
-        print('Model B Slope: ',np.round(slope_b,3))
-        print('Model B Intercept: ',np.round(int_b,3))
-        print('Model B R2: ', np.round(r2_b,3))
-    
-    
\ No newline at end of file
+        plot_bias(in_situ,[model_a,model_b],names=['New Algorithm','NASA Algorithm'],title='Both Algorithms vs Observed')
+        for name,other in [('Model A','Model B'),('Model B','Model A')]:
+            stats=summary.loc[name]
+            print(name)
+            print(name+' was better:',np.round(percent.loc[name,other],3),'% of observations')
+            print(name+' Median Log Bias: ',np.round(stats.median_log_bias,3))
+            print(name+' Median AE: ',np.round(stats.median_ae,3))
+            print(name+' Slope: ',np.round(stats.slope,3))
+            print(name+' Intercept: ',np.round(stats.intercept,3))
+            print(name+' R2: ', np.round(stats.r_value,3))
+            print('')
+    return summary
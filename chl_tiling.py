@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Out of core (tiled) processing of global L3M Rrs files into TPCA chlorophyll.
+
+Includes:
+    l3m_filename
+        The NASA L3M file name of a sensor band on a date (ie: S2000001.L3m_DAY_RRS_Rrs_443_9km.nc).
+    iter_tiles
+        Generate (row slice, column slice) tiles covering a 2D grid.
+    open_bands
+        Open the L3M band files of a sensor, returning the netCDF4 datasets and band variables.
+    read_bands
+        Read a hyperslab of every band as float arrays, with fill values as NaN.
+    process_tiled
+        Read the bands a tile at a time, calculate TPCA chl per tile and write each tile straight into an output NetCDF.
+
+Peak memory is set by the tile size (tile_rows x tile_cols x number of bands) rather than the size of the grid,
+so 4km MODIS global days can be processed on small nodes. Each pixel is calculated with the same operations as the
+whole array, so the tiled output is identical to processing the whole grid at once.
+
+Usage:
+    process_tiled(['S2000001.L3m_DAY_RRS_Rrs_443_9km.nc',...,'S2000001.L3m_DAY_RRS_Rrs_670_9km.nc'],'S2000001_TPCA_9km.nc',sensor='seawifs',tile_rows=512)
+
+@author: npittman
+"""
+
+import numpy as np                   #Version '1.16.1'
+import netCDF4                       #Version '1.5.1.2'
+
+from chl_tpca_algorithms import SENSOR_BANDS, tpca_workspace
+from chl_profiling import NULL_PROFILER, profiled_sensor_chl
+
+SENSOR_PREFIX={'seawifs':'S','modis':'A','meris':'M'}
+
+def l3m_filename(sensor,date,band,resolution='9km',period='DAY'):
+    """The L3M file name for a sensor band (ie: Rrs_443, chlor_a or chl_tpca) on a date (datetime.date or datetime64)"""
+    date=np.datetime64(date,'D').astype(object)
+    product='CHL' if band.startswith('chl') else 'RRS'
+    return SENSOR_PREFIX[sensor]+date.strftime('%Y%j')+'.L3m_'+period+'_'+product+'_'+band+'_'+resolution+'.nc'
+
+def iter_tiles(shape,tile_rows=256,tile_cols=None):
+    """Yields (row slice, column slice) covering a 2D shape, tile_cols=None uses full rows (row blocks)"""
+    n_rows,n_cols=shape
+    if tile_cols is None:
+        tile_cols=n_cols
+    for row in range(0,n_rows,tile_rows):
+        for col in range(0,n_cols,tile_cols):
+            yield slice(row,min(row+tile_rows,n_rows)),slice(col,min(col+tile_cols,n_cols))
+
+def open_bands(band_files,sensor='seawifs',band_variables=None):
+    """
+    Given:
+        band_files - A list of L3M files in the sensor function argument order (one band per file),
+                     or a single file containing every band.
+        sensor - seawifs, modis or meris
+        band_variables - Optional variable names, default SENSOR_BANDS[sensor]
+
+    Returns:
+        (datasets, variables), close the datasets when finished.
+    """
+    if band_variables is None:
+        band_variables=SENSOR_BANDS[sensor]
+    if isinstance(band_files,str):
+        band_files=[band_files]*len(band_variables)
+    if len(band_files)!=len(band_variables):
+        raise ValueError('Expected '+str(len(band_variables))+' band files for '+sensor+', got '+str(len(band_files)))
+
+    datasets={}
+    for fileloc in band_files:
+        if fileloc not in datasets:
+            datasets[fileloc]=netCDF4.Dataset(fileloc,'r')
+    variables=[datasets[fileloc].variables[var] for fileloc,var in zip(band_files,band_variables)]
+    return list(datasets.values()),variables
+
+def read_bands(variables,rows=slice(None),cols=slice(None),dtype=None):
+    """Read a hyperslab of each band variable (scale_factor / add_offset applied) as dtype (default: float as stored, otherwise float64), with fill values replaced by NaN"""
+    bands=[]
+    for var in variables:
+        data=var[rows,cols]
+        if dtype is not None:
+            data=data.astype(dtype,copy=False)
+        elif not np.issubdtype(data.dtype,np.floating):
+            data=data.astype(np.float64)
+        bands.append(np.ma.filled(data,np.nan))
+    return bands
+
+def process_tiled(band_files,output_file,sensor='seawifs',tile_rows=256,tile_cols=None,band_variables=None,output_variable='chl_tpca',mode='exact',zlib=False,dtype=None,profiler=None,**kwargs):
+    """
+    Given:
+        band_files - L3M band files (see open_bands)
+        output_file - NetCDF file to create
+        sensor - seawifs, modis or meris
+        tile_rows, tile_cols - Tile size, tile_cols=None processes blocks of full rows
+        mode - Sensor function mode, 'fused' reuses one workspace for every tile
+        zlib - Compress the output variable
+        dtype - Read, calculate and write in dtype (ie: np.float32), None reads the stored float type and writes float64
+        profiler - Optional chl_profiling.Profiler, recording the read, sensor function (see profiled_sensor_chl) and write stages of every tile
+        **kwargs - Passed to the sensor function (ocx_poly, ci_poly, l, h)
+
+    Calculate:
+        Read each tile of every band, calculate TPCA chl for the tile and write it straight into output_file.
+        lat / lon coordinates are copied from the first band file when they exist.
+
+    Returns:
+        output_file
+    """
+    profiler=NULL_PROFILER if profiler is None else profiler
+    datasets,variables=open_bands(band_files,sensor,band_variables)
+    try:
+        source=datasets[0]
+        dims=variables[0].dimensions
+        shape=variables[0].shape
+        out_tile_cols=shape[1] if tile_cols is None else min(tile_cols,shape[1])
+        out_tile_rows=min(tile_rows,shape[0])
+
+        with netCDF4.Dataset(output_file,'w') as dst:
+            for dim,size in zip(dims,shape):
+                dst.createDimension(dim,size)
+                if dim in source.variables:
+                    coord=dst.createVariable(dim,source.variables[dim].dtype,(dim,))
+                    coord.setncatts({k:source.variables[dim].getncattr(k) for k in source.variables[dim].ncattrs() if k!='_FillValue'})
+                    coord[:]=source.variables[dim][:]
+            chl=dst.createVariable(output_variable,'f8' if dtype is None else np.dtype(dtype),dims,zlib=zlib,fill_value=np.nan,chunksizes=(out_tile_rows,out_tile_cols))
+            chl.long_name='Tropical Pacific Chlorophyll Algorithm chlorophyll concentration ('+sensor+')'
+            chl.units='mg m^-3'
+
+            workspace,buffer=None,None
+            for rows,cols in iter_tiles(shape,tile_rows,tile_cols):
+                with profiler.stage('read') as record:
+                    bands=read_bands(variables,rows,cols,dtype=dtype)
+                    record['bytes_read']+=sum(var.dtype.itemsize*band.size for var,band in zip(variables,bands))
+                if mode=='fused':
+                    if workspace is None: #One workspace for every tile, edge tiles use a view
+                        work_dtype=np.result_type(*bands,1.0) if dtype is None else np.dtype(dtype)
+                        workspace=tpca_workspace((out_tile_rows,out_tile_cols),dtype=work_dtype)
+                        buffer=np.empty((out_tile_rows,out_tile_cols),dtype=work_dtype)
+                    view=tuple(slice(0,n) for n in bands[0].shape)
+                    tile=profiled_sensor_chl(profiler,sensor,*bands,mode=mode,out=buffer[view],workspace=[w[view] for w in workspace],dtype=dtype,**kwargs)
+                else:
+                    tile=profiled_sensor_chl(profiler,sensor,*bands,mode=mode,dtype=dtype,**kwargs)
+                with profiler.stage('write') as record:
+                    chl[rows,cols]=tile
+                    record['bytes_written']+=chl.dtype.itemsize*tile.size
+    finally:
+        for ds in datasets:
+            ds.close()
+    return output_file
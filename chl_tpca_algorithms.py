@@ -15,6 +15,19 @@ General functions include:
     blended_chl
     calculate_chl_ocx
     calculate_chl_ci
+    calculate_mbr
+    calculate_ci
+    calculate_fused_chl
+    calculate_masked_chl
+    calculate_lut_chl
+    calculate_chl_mode
+    cast_bands
+    cast_coefficients
+    tpca_workspace
+    lut_table
+    interpolate_lut
+    lut_error
+    sensor_coefficients
     
 Sensor specific functions include:
     calculate_seawifs_chl
@@ -45,9 +58,20 @@ References:
     Journal of Geophysical Research: Oceans 103, 24937–24953.
 """
 
+import inspect
+import functools
 import numpy as np       #Version: '1.16.1'
 #import dask.array as np #Version: '1.0.0'
 
+SENSOR_WAVELENGTHS={'seawifs':(443,555,670),
+                    'modis':(443,547,667),
+                    'meris':(443,560,665)} #CI (blue, green, red) wavelengths for each sensor
+
+LUT_SIZE=2**18             #Lookup table points (2 MB per table)
+LUT_MBR_RANGE=(0.2,20)     #Max band ratio range of the Chl OCx tables, pixels outside are calculated exactly
+LUT_CI_RANGE=(-0.02,0.02)  #CI range of the Chl CI tables, pixels outside are calculated exactly
+LUT_ERROR_BOUND={'ocx':1.3e-6,'ci':8e-10} #Maximum relative error of the default tables (lut_error, TPCA and NASA OCx / CI polynomials)
+
 def blended_chl(chl_ci,chl_ocx,l=0.15,h=0.2):  #Default blending window of 0.15 to 0.2
     """A general Chl algorithm blending function between Chl_CI to Chl_OCx"""
     upper=h #0.2
@@ -69,7 +93,240 @@ def calculate_chl_ci(ci_poly,CI):
     chl_ci=10**(ci_poly[0]+ci_poly[1]*CI)
     return chl_ci
 
-def calculate_seawifs_chl(r443,r490,r510,r555,r670,ocx_poly=[0.3255,-2.7677,2.4409,-1.1288,-0.4990],ci_poly=[-0.4909, 191.6590],l=0,h=0.5):
+def calculate_mbr(blue_bands,green):
+    """Max band ratio of the blue bands over green (O'Reilly et al., 1998)"""
+    mbr=blue_bands[0]/green
+    for blue in blue_bands[1:]:
+        mbr=np.maximum(mbr,blue/green)
+    return mbr
+
+def calculate_ci(blue_bands,green,red,wavelengths):
+    """Color index, the green band line height above the blue (first blue band) to red baseline (Hu et al., 2012)"""
+    b,g,r=wavelengths
+    return green-(blue_bands[0]+(g-b)/(r-b)*(red-blue_bands[0]))
+
+def tpca_workspace(shape,dtype=np.float64):
+    """Preallocate the scratch buffers used by calculate_fused_chl, reuse these between calls on the same grid (ie: one per day)"""
+    return (np.empty(shape,dtype=dtype),
+            np.empty(shape,dtype=dtype),
+            np.empty(shape,dtype=dtype),
+            np.empty(shape,dtype=bool))
+
+def calculate_fused_chl(blue_bands,green,red,wavelengths,ocx_poly,ci_poly,l,h,out=None,workspace=None):
+    """
+    Given:
+        blue_bands - Sequence of blue RRS arrays used in the max band ratio, the first must be the 443nm band (used by CI)
+        green - Green RRS array
+        red - Red RRS array
+        wavelengths - (blue, green, red) wavelengths used by CI, ie: SENSOR_WAVELENGTHS['seawifs']
+        OCx Polynomial
+        CI Polynomial
+        l - Low blending cutoff
+        h - High blending cutoff
+        out - Optional preallocated output array
+        workspace - Optional scratch buffers from tpca_workspace
+
+    Calculate:
+        A fused, low allocation implementation of Chl OCx, Chl CI and blended_chl.
+        Every intermediate is written in place into out or the 3 workspace arrays (+1 boolean mask), so no full size temporaries are created.
+        The OCx polynomial is evaluated with Horner's rule, so chl_ocx agrees with calculate_chl_ocx to within a relative error of ~1e-14 (float64) or ~1e-6 (float32).
+        An infinite log10 max band ratio (green or every blue band of 0) is NaN, as in calculate_chl_ocx.
+        The band ratio, CI, Chl CI and blending steps perform the same floating point operations as the sensor functions and are identical.
+
+    Usage:
+        work=tpca_workspace(rrs443.shape)
+        chl=np.empty(rrs443.shape)
+        calculate_fused_chl((rrs443,rrs490,rrs510),rrs555,rrs670,SENSOR_WAVELENGTHS['seawifs'],[0.3255,-2.7677,2.4409,-1.1288,-0.4990],[-0.4909, 191.6590],0,0.5,out=chl,workspace=work)
+    """
+    blue_bands=[np.asarray(b) for b in blue_bands]
+    green=np.asarray(green)
+    red=np.asarray(red)
+    dtype=np.result_type(green,red,*blue_bands,1.0)
+    if out is None:
+        out=np.empty(green.shape,dtype=dtype)
+    if workspace is None:
+        workspace=tpca_workspace(green.shape,dtype=dtype)
+    w0,w1,w2,mask=workspace
+
+    #Calculate max band ratio and log10 (w0)
+    np.divide(blue_bands[0],green,out=w0)
+    for blue in blue_bands[1:]:
+        np.divide(blue,green,out=w1)
+        np.maximum(w0,w1,out=w0)
+    np.log10(w0,out=w0)
+    np.isfinite(w0,out=mask) #Expanded powers of +-inf give inf-inf (NaN), Horner's rule would not
+    np.logical_not(mask,out=mask)
+    np.copyto(w0,np.nan,where=mask)
+
+    #Calculate Chl OCx with Horner's rule (w1)
+    np.multiply(w0,ocx_poly[-1],out=w1)
+    for c in ocx_poly[-2:0:-1]:
+        np.add(w1,c,out=w1)
+        np.multiply(w1,w0,out=w1)
+    np.add(w1,ocx_poly[0],out=w1)
+    np.power(10.0,w1,out=w1)
+
+    #Calculate CI and Chl CI (w2)
+    b,g,r=wavelengths
+    np.subtract(red,blue_bands[0],out=w2)
+    np.multiply(w2,(g-b)/(r-b),out=w2)
+    np.add(blue_bands[0],w2,out=w2)
+    np.subtract(green,w2,out=w2)
+    np.multiply(w2,ci_poly[1],out=w2)
+    np.add(w2,ci_poly[0],out=w2)
+    np.power(10.0,w2,out=w2)
+
+    #Blending between Chl_CI to Chl_OCx, out=beta*chl_ci+alpha*chl_ocx
+    np.subtract(h,w2,out=out)
+    np.divide(out,h-l,out=out)
+    np.multiply(out,w2,out=out)
+    np.subtract(w2,l,out=w0)
+    np.divide(w0,h-l,out=w0)
+    np.multiply(w0,w1,out=w0)
+    np.add(out,w0,out=out)
+    np.less(w2,l,out=mask)
+    np.copyto(out,w2,where=mask)
+    np.greater(w2,h,out=mask)
+    np.copyto(out,w1,where=mask)
+    return out
+
+def calculate_masked_chl(blue_bands,green,red,wavelengths,ocx_poly,ci_poly,l,h):
+    """
+    Given:
+        The same arguments as calculate_fused_chl (without buffers)
+
+    Calculate:
+        Chl CI for every pixel first, then only evaluate the band ratios, log10 and OCx polynomial where Chl CI >= l,
+        and only evaluate the linear blend where l <= Chl CI <= h. Pixels with Chl CI < l, or a NaN CI (land / cloud), are Chl CI.
+        Each pixel goes through the same floating point operations as blended_chl, so the result is identical to the sensor functions.
+        Most useful with the NASA window (l=0.15), where oligotrophic pixels never need Chl OCx. With l=0 (TPCA SeaWiFS / MODIS) every valid pixel still needs Chl OCx.
+    """
+    blue_bands=[np.asarray(b) for b in blue_bands]
+    green=np.asarray(green)
+    red=np.asarray(red)
+
+    #Calculate Chl CI (Hu et al., 2012) for every pixel
+    chl=np.asarray(calculate_chl_ci(ci_poly,calculate_ci(blue_bands,green,red,wavelengths)))
+
+    #Calculate Chl OCX (O'Reilly et al., 1998) where it is used by the blend
+    ocx_pixels=chl>=l
+    chl_ci=chl[ocx_pixels]
+    mbr=calculate_mbr([blue[ocx_pixels] for blue in blue_bands],green[ocx_pixels])
+    chl_ocx=calculate_chl_ocx(ocx_poly,np.log10(mbr))
+
+    #Blending between Chl_CI to Chl_OCx, only inside the window
+    window=chl_ci<=h
+    chl_ocx[window]=blended_chl(chl_ci[window],chl_ocx[window],l=l,h=h)
+    chl[ocx_pixels]=chl_ocx
+    return chl
+
+@functools.lru_cache(maxsize=16)
+def lut_table(kind,poly,lo,hi,n=LUT_SIZE):
+    """
+    Cached lookup table of Chl OCx against the max band ratio (kind='ocx') or Chl CI against CI (kind='ci'),
+    on n evenly spaced points from lo to hi. poly must be a tuple (the cache key).
+    Returns (lo, 1/spacing, values, slopes) with one value and slope per interval.
+    """
+    x=np.linspace(lo,hi,n)
+    if kind=='ocx':
+        y=calculate_chl_ocx(poly,np.log10(x))
+    elif kind=='ci':
+        y=calculate_chl_ci(poly,x)
+    else:
+        raise ValueError('Unknown lookup table: '+str(kind))
+    return lo,(n-1)/(hi-lo),y[:-1],np.diff(y)
+
+def interpolate_lut(table,x,exact):
+    """Linear interpolation of a lut_table at x, values outside the table are calculated with exact(x), NaN stays NaN"""
+    x0,scale,values,slopes=table
+    t=np.subtract(x,x0,dtype=np.float64)
+    t*=scale
+    i=np.fmin(np.fmax(t,0),len(values)-1).astype(np.intp) #fmax / fmin turn NaN into index 0
+    t-=i
+    y=np.take(slopes,i)
+    y*=t
+    y+=np.take(values,i)
+    outside=(t<0)|(t>1)
+    if outside.any():
+        y[outside]=exact(x[outside])
+    return y
+
+def calculate_lut_chl(blue_bands,green,red,wavelengths,ocx_poly,ci_poly,l,h,mbr_range=LUT_MBR_RANGE,ci_range=LUT_CI_RANGE,n=LUT_SIZE):
+    """
+    Given:
+        The same arguments as calculate_fused_chl (without buffers)
+        mbr_range, ci_range, n - Lookup table ranges and size
+
+    Calculate:
+        Chl OCx is interpolated from a table against the max band ratio (no log10, polynomial or 10**)
+        and Chl CI from a table against CI (no 10**), then blended with blended_chl.
+        Tables are built once for each coefficient tuple and cached (lut_table).
+        With the default tables the maximum relative error against calculate_chl_ocx is below 1.3e-6 (TPCA and NASA polynomials)
+        and 8e-10 against calculate_chl_ci (Hu et al., 2012 and NASA OCI CI coefficients) (LUT_ERROR_BOUND, see lut_error). Pixels outside the tables are calculated exactly.
+    """
+    blue_bands=[np.asarray(b) for b in blue_bands]
+    green=np.asarray(green)
+    red=np.asarray(red)
+    ocx_poly=tuple(float(c) for c in ocx_poly)
+    ci_poly=tuple(float(c) for c in ci_poly)
+
+    #Interpolate Chl OCX (O'Reilly et al., 1998) against the max band ratio
+    mbr=calculate_mbr(blue_bands,green)
+    chl_ocx=interpolate_lut(lut_table('ocx',ocx_poly,*mbr_range,n=n),mbr,lambda x: calculate_chl_ocx(ocx_poly,np.log10(x)))
+
+    #Interpolate Chl CI (Hu et al., 2012) against CI
+    CI=calculate_ci(blue_bands,green,red,wavelengths)
+    chl_ci=interpolate_lut(lut_table('ci',ci_poly,*ci_range,n=n),CI,lambda x: calculate_chl_ci(ci_poly,x))
+
+    dtype=np.result_type(green,red,*blue_bands,1.0) #Tables are float64, blend in the band dtype
+    return blended_chl(chl_ci.astype(dtype,copy=False),chl_ocx.astype(dtype,copy=False),l=l,h=h)
+
+def lut_error(ocx_poly,ci_poly=[-0.4909, 191.6590],mbr_range=LUT_MBR_RANGE,ci_range=LUT_CI_RANGE,n=LUT_SIZE,points=4):
+    """
+    Maximum relative error of the lookup tables against calculate_chl_ocx and calculate_chl_ci,
+    evaluated at points evenly spaced positions inside every table interval (covering the whole table range).
+    Returns {'ocx': error, 'ci': error}
+    """
+    errors={}
+    for kind,poly,(lo,hi) in [('ocx',ocx_poly,mbr_range),('ci',ci_poly,ci_range)]:
+        poly=tuple(float(c) for c in poly)
+        table=lut_table(kind,poly,lo,hi,n=n)
+        error=0
+        for f in (np.arange(points)+0.5)/points:
+            x=np.linspace(lo,hi,n)[:-1]+f*(hi-lo)/(n-1)
+            exact=calculate_chl_ocx(poly,np.log10(x)) if kind=='ocx' else calculate_chl_ci(poly,x)
+            error=max(error,np.max(np.abs(interpolate_lut(table,x,None)-exact)/exact))
+        errors[kind]=error
+    return errors
+
+def calculate_chl_mode(mode,blue_bands,green,red,wavelengths,ocx_poly,ci_poly,l,h,out=None,workspace=None):
+    """
+    Dispatch the sensor functions to an alternate implementation:
+        'fused' - calculate_fused_chl, low allocation with optional out / workspace buffers.
+        'masked' - calculate_masked_chl, lazy evaluation of Chl OCx and the blend.
+        'lut' - calculate_lut_chl, Chl OCx and Chl CI interpolated from cached lookup tables.
+    """
+    if mode=='fused':
+        return calculate_fused_chl(blue_bands,green,red,wavelengths,ocx_poly,ci_poly,l,h,out=out,workspace=workspace)
+    elif mode in ('masked','lut'):
+        calculate=calculate_masked_chl if mode=='masked' else calculate_lut_chl
+        chl=calculate(blue_bands,green,red,wavelengths,ocx_poly,ci_poly,l,h)
+        if out is not None:
+            out[...]=chl
+            return out
+        return chl
+    raise ValueError('Unknown mode: '+str(mode))
+
+def cast_bands(dtype,*bands):
+    """Cast RRS bands to dtype without copying bands already in dtype, numpy, dask, pandas and xarray bands keep their type"""
+    return [band.astype(dtype,copy=False) if hasattr(band,'astype') else np.asarray(band,dtype=dtype) for band in bands]
+
+def cast_coefficients(dtype,ocx_poly,ci_poly,l,h):
+    """Cast the coefficients once to dtype scalars, so float32 bands are not upcast to float64 (ie: by float64 numpy coefficients)"""
+    scalar=np.dtype(dtype).type
+    return [scalar(c) for c in ocx_poly],[scalar(c) for c in ci_poly],scalar(l),scalar(h)
+
+def calculate_seawifs_chl(r443,r490,r510,r555,r670,ocx_poly=[0.3255,-2.7677,2.4409,-1.1288,-0.4990],ci_poly=[-0.4909, 191.6590],l=0,h=0.5,mode='exact',out=None,workspace=None,dtype=None):
     """
     Given:
         SeaWiFS RRS values for 443,490,510,555,670
@@ -77,7 +334,9 @@ def calculate_seawifs_chl(r443,r490,r510,r555,r670,ocx_poly=[0.3255,-2.7677,2.44
         CI Polynomial
         l - Low blending cutoff
         h - High blending cutoff 
-        
+        mode - 'exact' (default), 'fused', 'masked' or 'lut' (see calculate_chl_mode)
+        out, workspace - Optional preallocated buffers for the fused mode (see tpca_workspace)
+        dtype - Calculation dtype, ie: np.float32 keeps float32 bands float32 end to end (None uses the numpy type promotion of the inputs)
         
     Calculate:
         Calculate Chl OCx
@@ -96,16 +355,20 @@ def calculate_seawifs_chl(r443,r490,r510,r555,r670,ocx_poly=[0.3255,-2.7677,2.44
         NASA SeaWiFS: [0.3272,-2.9940, 2.7218,-1.2259,-0.5683], l=0.15,h=0.2 (OCx)
         Hu2012: [-0.4909, 191.6590] #Same for both algorithms (CI)
     """
+    if dtype is not None:
+        r443,r490,r510,r555,r670=cast_bands(dtype,r443,r490,r510,r555,r670)
+        ocx_poly,ci_poly,l,h=cast_coefficients(dtype,ocx_poly,ci_poly,l,h)
+    if mode!='exact':
+        return calculate_chl_mode(mode,(r443,r490,r510),r555,r670,SENSOR_WAVELENGTHS['seawifs'],ocx_poly,ci_poly,l,h,out=out,workspace=workspace)
     
     #Calculate Chl OCX (O'Reilly et al., 1998)
-    mbr=np.maximum(r443/r555,r490/r555)
-    mbr=np.maximum(mbr,r510/r555) #Calculate max band ratio
+    mbr=calculate_mbr((r443,r490,r510),r555) #Calculate max band ratio
 
     lmbr=np.log10(mbr)
     chl_ocx=calculate_chl_ocx(ocx_poly,lmbr)
         
     #Calculate Chl CI (Hu et al., 2012)
-    CI=r555-(r443+(555-443)/(670-443)*(r670-r443))
+    CI=calculate_ci((r443,r490,r510),r555,r670,SENSOR_WAVELENGTHS['seawifs'])
     chl_ci=calculate_chl_ci(ci_poly,CI)
     
     #Blending between Chl_CI to Chl_OCx
@@ -113,7 +376,7 @@ def calculate_seawifs_chl(r443,r490,r510,r555,r670,ocx_poly=[0.3255,-2.7677,2.44
     return blended
 
 
-def calculate_modis_chl(r443,r488,r547,r667,ocx_poly=[0.3272,-2.9940,2.7218,-1.2259,-0.5683],ci_poly=[-0.4909, 191.6590],l=0,h=0.2):
+def calculate_modis_chl(r443,r488,r547,r667,ocx_poly=[0.3272,-2.9940,2.7218,-1.2259,-0.5683],ci_poly=[-0.4909, 191.6590],l=0,h=0.2,mode='exact',out=None,workspace=None,dtype=None):
     """
     Given:
         MODIS-Aqua RRS values for 443,488,547,667
@@ -121,7 +384,9 @@ def calculate_modis_chl(r443,r488,r547,r667,ocx_poly=[0.3272,-2.9940,2.7218,-1.2
         CI Polynomial
         l - Low blending cutoff
         h - High blending cutoff 
-
+        mode - 'exact' (default), 'fused', 'masked' or 'lut' (see calculate_chl_mode)
+        out, workspace - Optional preallocated buffers for the fused mode (see tpca_workspace)
+        dtype - Calculation dtype, ie: np.float32 keeps float32 bands float32 end to end (None uses the numpy type promotion of the inputs)
         
     Calculate:
         Calculate Chl OCx
@@ -140,20 +405,25 @@ def calculate_modis_chl(r443,r488,r547,r667,ocx_poly=[0.3272,-2.9940,2.7218,-1.2
         NASA MODIS-Aqua: [0.2424,-2.7423,1.8017,0.0015,-1.2280], l=0.15,h=0.2 (OCx)
         Hu2012: [-0.4909, 191.6590] #Same for both algorithms (CI)
     """
+    if dtype is not None:
+        r443,r488,r547,r667=cast_bands(dtype,r443,r488,r547,r667)
+        ocx_poly,ci_poly,l,h=cast_coefficients(dtype,ocx_poly,ci_poly,l,h)
+    if mode!='exact':
+        return calculate_chl_mode(mode,(r443,r488),r547,r667,SENSOR_WAVELENGTHS['modis'],ocx_poly,ci_poly,l,h,out=out,workspace=workspace)
         
     #Calculate Chl OCX (O'Reilly et al., 1998)
-    mbr=np.maximum(r443/r547,r488/r547) #Calculate max band ratio
+    mbr=calculate_mbr((r443,r488),r547) #Calculate max band ratio
     lmbr=np.log10(mbr)
     chl_ocx=calculate_chl_ocx(ocx_poly,lmbr)
     #Calculate Chl CI (Hu et al., 2012)
-    CI=r547-(r443+(547-443)/(667-443)*(r667-r443))
+    CI=calculate_ci((r443,r488),r547,r667,SENSOR_WAVELENGTHS['modis'])
     chl_ci=calculate_chl_ci(ci_poly,CI)
     
     blended=blended_chl(chl_ci,chl_ocx,h=h,l=l) #Blending cutoff
     return blended
 
 
-def calculate_meris_chl(r443,r490,r510,r560,r665,ocx_poly=[0.3255,-2.7677, 2.4409,-1.1288,-0.4990],ci_poly=[-0.4909, 191.6590],l=0.15,h=0.2):
+def calculate_meris_chl(r443,r490,r510,r560,r665,ocx_poly=[0.3255,-2.7677, 2.4409,-1.1288,-0.4990],ci_poly=[-0.4909, 191.6590],l=0.15,h=0.2,mode='exact',out=None,workspace=None,dtype=None):
     """
     Given:
         MERIS RRS values for 443,490,510,560,665
@@ -161,6 +431,9 @@ def calculate_meris_chl(r443,r490,r510,r560,r665,ocx_poly=[0.3255,-2.7677, 2.440
         CI Polynomial
         l - Low blending cutoff
         h - High blending cutoff 
+        mode - 'exact' (default), 'fused', 'masked' or 'lut' (see calculate_chl_mode)
+        out, workspace - Optional preallocated buffers for the fused mode (see tpca_workspace)
+        dtype - Calculation dtype, ie: np.float32 keeps float32 bands float32 end to end (None uses the numpy type promotion of the inputs)
         
     Calculate:
         Calculate Chl OCx
@@ -176,21 +449,43 @@ def calculate_meris_chl(r443,r490,r510,r560,r665,ocx_poly=[0.3255,-2.7677, 2.440
         NASA MERIS: [0.3255,-2.7677, 2.4409,-1.1288,-0.4990], l=0.15,h=0.2 (OCx)
         Hu2012: [-0.4909, 191.6590] #Same for both algorithms (CI)
     """
+    if dtype is not None:
+        r443,r490,r510,r560,r665=cast_bands(dtype,r443,r490,r510,r560,r665)
+        ocx_poly,ci_poly,l,h=cast_coefficients(dtype,ocx_poly,ci_poly,l,h)
+    if mode!='exact':
+        return calculate_chl_mode(mode,(r443,r490,r510),r560,r665,SENSOR_WAVELENGTHS['meris'],ocx_poly,ci_poly,l,h,out=out,workspace=workspace)
     
     #Calculate Chl OCX (O'Reilly et al., 1998)
-    mbr=np.maximum(r443/r560,r490/r560)
-    mbr=np.maximum(mbr,r510/r560) #Calculate max band ratio
+    mbr=calculate_mbr((r443,r490,r510),r560) #Calculate max band ratio
     lmbr=np.log10(mbr)
     chl_ocx=calculate_chl_ocx(ocx_poly,lmbr)
     
     #Calculate Chl CI (Hu et al., 2012)
-    CI=r560-(r443+(560-443)/(665-443)*(r665-r443))
+    CI=calculate_ci((r443,r490,r510),r560,r665,SENSOR_WAVELENGTHS['meris'])
     chl_ci=calculate_chl_ci(ci_poly,CI)
     
     blended=blended_chl(chl_ci,chl_ocx,h=h,l=l) #Blending cutoff
     return blended
 
 
+SENSOR_FUNCTIONS={'seawifs':calculate_seawifs_chl,
+                  'modis':calculate_modis_chl,
+                  'meris':calculate_meris_chl}
+
+SENSOR_BANDS={'seawifs':['Rrs_443','Rrs_490','Rrs_510','Rrs_555','Rrs_670'],
+              'modis':['Rrs_443','Rrs_488','Rrs_547','Rrs_667'],
+              'meris':['Rrs_443','Rrs_490','Rrs_510','Rrs_560','Rrs_665']} #L3M variable names, in the sensor function argument order
+
+MATCHUP_BANDS={'seawifs':['rrs443','rrs490','rrs510','rrs555','rrs670'],
+               'modis':['rrs443','rrs488','rrs547','rrs667'],
+               'meris':['rrs443','rrs490','rrs510','rrs560','rrs665']} #tropical_pacific_matchups/*.csv columns, in the sensor function argument order
+
+def sensor_coefficients(sensor='seawifs',**sensor_kwargs):
+    """The {ocx_poly, ci_poly, l, h} of a sensor function call: the given arguments, otherwise the sensor function defaults"""
+    parameters=inspect.signature(SENSOR_FUNCTIONS[sensor]).parameters
+    return {name:sensor_kwargs.get(name,parameters[name].default) for name in ['ocx_poly','ci_poly','l','h']}
+
+
 if __name__ == '__main__':
     pass
     
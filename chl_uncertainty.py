@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo propagation of Rrs uncertainty to per pixel TPCA chl uncertainty.
+
+Includes:
+    SENSOR_RRS_UNCERTAINTY
+        Default 1 sigma Rrs uncertainty (sr^-1) of each band, in the sensor function argument order.
+    noise_covariance
+        Band covariance matrix from per band sigmas and a band correlation (a coefficient or a matrix).
+    perturb_bands
+        Draw an ensemble of perturbed bands (members x pixels) with correlated Gaussian noise.
+    monte_carlo_chl
+        Run the sensor function over an ensemble of perturbed bands in memory bounded chunks of pixels,
+        returning per pixel mean, standard deviation, log10 standard deviation, percentiles and valid member count of chl.
+
+Chl CI is 10**(ci_poly[0]+191.659*CI), so a CI error of 0.0005 sr^-1 is a factor of ~1.25 in Chl CI,
+and the low chlorophyll (CI blended) pixels of the tropical Pacific carry most of the uncertainty.
+
+Memory is set by chunk_size, the number of ensemble values (members x pixels) calculated at once:
+each chunk holds the perturbed bands and the sensor function temporaries, ~(number of bands + 10) x chunk_size x 8 bytes,
+so the ensemble of a global grid is never held in memory. Pixels with a NaN band (land / cloud) are skipped.
+Each chunk draws its noise from its own seed (drawn from seed), so results are reproducible for a seed and chunk_size.
+Perturbed Rrs can make the band ratios negative (log10 gives NaN), such members are left out of the statistics of the pixel (see count).
+
+Usage:
+    rrs=open_region(file_locations[0:5],'tropical_pacific').load()
+    uncertainty=monte_carlo_chl([rrs[band].values for band in SENSOR_BANDS['seawifs']],'seawifs',n_members=200,correlation=0.5)
+    uncertainty['std'], uncertainty['percentiles'][0] #2.5th percentile
+
+@author: npittman
+"""
+
+import warnings
+import numpy as np                   #Version '1.16.1'
+
+from chl_tpca_algorithms import SENSOR_FUNCTIONS, SENSOR_BANDS
+
+SENSOR_RRS_UNCERTAINTY={'seawifs':[0.0009,0.0007,0.0005,0.0004,0.0002],
+                        'modis':[0.0009,0.0007,0.0004,0.0002],
+                        'meris':[0.0009,0.0007,0.0005,0.0004,0.0002]} #Approximate, replace with the uncertainties of the product used
+
+def noise_covariance(sensor='seawifs',sigma=None,correlation=0):
+    """
+    Given:
+        sensor - seawifs, modis or meris
+        sigma - Per band 1 sigma Rrs uncertainty (sr^-1), a scalar for every band, default SENSOR_RRS_UNCERTAINTY[sensor]
+        correlation - Correlation coefficient between every pair of bands, or a (bands x bands) correlation matrix
+
+    Returns:
+        The (bands x bands) noise covariance matrix.
+    """
+    n_bands=len(SENSOR_BANDS[sensor])
+    sigma=SENSOR_RRS_UNCERTAINTY[sensor] if sigma is None else sigma
+    sigma=np.broadcast_to(np.asarray(sigma,dtype=np.float64),(n_bands,))
+    if np.ndim(correlation)==0:
+        correlation=np.full((n_bands,n_bands),float(correlation))
+        np.fill_diagonal(correlation,1)
+    correlation=np.asarray(correlation,dtype=np.float64)
+    if correlation.shape!=(n_bands,n_bands):
+        raise ValueError('Expected a '+str(n_bands)+' x '+str(n_bands)+' correlation matrix for '+sensor)
+    return sigma[:,None]*correlation*sigma[None,:]
+
+def perturb_bands(bands,covariance,n_members,rng):
+    """
+    Given:
+        bands - List of 1D band arrays (pixels)
+        covariance - (bands x bands) noise covariance, see noise_covariance
+        n_members - Ensemble size
+        rng - np.random.RandomState
+
+    Returns:
+        A list of (members x pixels) perturbed band arrays.
+    """
+    w,v=np.linalg.eigh(covariance) #Covariance square root, also for singular covariances (sigma=0, correlation=1)
+    if w.min()<-1e-10*max(w.max(),0):
+        raise ValueError('The noise covariance is not positive semidefinite')
+    factor=v*np.sqrt(np.maximum(w,0))
+    noise=rng.standard_normal((len(bands),n_members,bands[0].size))
+    noise=np.tensordot(factor,noise,axes=1) #Correlated noise (bands x members x pixels)
+    noise+=np.asarray(bands)[:,None,:]
+    return list(noise)
+
+def _nan_percentiles(values,percentiles):
+    """np.nanpercentile(values,percentiles,axis=0) (linear interpolation) of a 2D array with one sort, values is sorted in place"""
+    values.sort(axis=0) #NaN sorts last
+    count=np.count_nonzero(~np.isnan(values),axis=0)
+    columns=np.arange(values.shape[1])
+    result=np.empty((len(percentiles),values.shape[1]))
+    for i,p in enumerate(percentiles):
+        position=p/100*np.maximum(count-1,0)
+        lower=np.floor(position).astype(np.intp)
+        upper=np.minimum(lower+1,np.maximum(count-1,0))
+        fraction=position-lower
+        result[i]=values[lower,columns]*(1-fraction)+values[upper,columns]*fraction
+    result[:,count==0]=np.nan
+    return result
+
+def monte_carlo_chl(bands,sensor='seawifs',n_members=100,sigma=None,correlation=0,percentiles=(2.5,50,97.5),chunk_size=2**20,seed=0,printer=0,**sensor_kwargs):
+    """
+    Given:
+        bands - Rrs bands in the sensor function argument order (numpy arrays of any shape)
+        sensor - seawifs, modis or meris
+        n_members - Ensemble size
+        sigma, correlation - Rrs noise, see noise_covariance
+        percentiles - Percentiles (%) of the ensemble chl at each pixel
+        chunk_size - Ensemble values (members x pixels) calculated at once, which sets the peak memory
+        seed - Seed for the chunk seeds
+        **sensor_kwargs - Passed to the sensor function (ocx_poly, ci_poly, l, h, mode, dtype)
+
+    Calculate:
+        For each chunk of valid pixels, draw n_members noisy copies of the bands, calculate chl of every member
+        with one sensor function call, and reduce the members to the per pixel statistics.
+
+    Returns:
+        A dict of arrays in the band shape: chl (of the unperturbed bands), mean, std, log10_std (spread of log10 chl),
+        count (members with a valid chl), and percentiles (len(percentiles) x band shape). NaN where a band is NaN.
+    """
+    func=SENSOR_FUNCTIONS[sensor]
+    bands=[np.asarray(band,dtype=np.float64) for band in bands]
+    shape=bands[0].shape
+    covariance=noise_covariance(sensor,sigma,correlation)
+    flat=[band.ravel() for band in bands]
+    valid=np.flatnonzero(np.all(np.isfinite(flat),axis=0))
+
+    result={}
+    for name in ['chl','mean','std','log10_std']:
+        result[name]=np.full(shape,np.nan)
+    result['count']=np.zeros(shape,dtype=np.int32)
+    result['percentiles']=np.full((len(percentiles),)+shape,np.nan)
+    outputs=[result[name].reshape(-1) for name in ['chl','mean','std','log10_std','count']]
+    percentile_output=result['percentiles'].reshape(len(percentiles),-1)
+
+    chunk_pixels=max(1,int(chunk_size)//n_members)
+    n_chunks=int(np.ceil(valid.size/chunk_pixels))
+    seeds=np.random.RandomState(seed).randint(0,2**31-1,size=max(n_chunks,1))
+    for i in range(n_chunks):
+        pixels=valid[i*chunk_pixels:(i+1)*chunk_pixels]
+        chunk=[band[pixels] for band in flat]
+        members=perturb_bands(chunk,covariance,n_members,np.random.RandomState(seeds[i]))
+        with np.errstate(divide='ignore',invalid='ignore'),warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning) #Pixels without a valid member
+            unperturbed=func(*chunk,**sensor_kwargs)
+            chl=np.asarray(func(*members,**sensor_kwargs),dtype=np.float64)
+            del members
+            chl[~np.isfinite(chl)|(chl<=0)]=np.nan
+            log_chl=np.log10(chl)
+            stats=[unperturbed,np.nanmean(chl,axis=0),np.nanstd(chl,axis=0,ddof=1),np.nanstd(log_chl,axis=0,ddof=1),np.count_nonzero(~np.isnan(chl),axis=0)]
+            for output,values in zip(outputs,stats):
+                output[pixels]=values
+            percentile_output[:,pixels]=_nan_percentiles(chl,percentiles)
+        if printer==1:
+            print('Chunk',i+1,'of',n_chunks,pixels.size,'pixels')
+    return result
@@ -17,11 +17,10 @@ This produces slightly different values than seen in the paper.
 """
 
 from chl_tpca_algorithms import calculate_seawifs_chl
-import pandas as pd
+from chl_matchups import load_matchups
 from chl_statistics import plot_linear_trend, check_bias
 
-seawifs_matchups_path='tropical_pacific_matchups/seawifs_matchups.csv'
-seawifs_matchups=pd.read_csv(seawifs_matchups_path)
+seawifs_matchups=load_matchups('seawifs') #tropical_pacific_matchups/seawifs_matchups.csv, from the columnar cache
 
 seawifs_matchups=seawifs_matchups[seawifs_matchups.validation_set==False]
 print('Columns in the matchup files:',seawifs_matchups.columns.values) #So we can see what is in the data file. 
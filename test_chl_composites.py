@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming composites of chl_composites against the stacked days.
+
+Includes:
+    WelfordTest
+        Days streamed a tile at a time give the count, mean and variance of np.sum(isfinite) / np.nanmean / np.nanvar(ddof=1)
+        of the stacked days (and of log10 with geometric=1).
+    CompositeFilesTest
+        composite_files of shuffled daily files gives the same statistics for every 8day, 8day_climatology and monthly_climatology key,
+        and writes each climatology key as soon as its last day has been added.
+
+Usage:
+    python test_chl_composites.py
+    python -m pytest test_chl_composites.py
+
+@author: npittman
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+import numpy as np                   #Version '1.16.1'
+import netCDF4                       #Version '1.5.1.2'
+
+import chl_composites
+from chl_composites import WelfordAccumulator, composite_files, read_composite, period_bounds
+from chl_tiling import iter_tiles
+
+SHAPE=(6,7)
+
+def random_day(rng,nan_fraction=0.3):
+    """Log-normal chl with NaN pixels"""
+    chl=10**rng.normal(-0.5,0.5,SHAPE)
+    chl[rng.uniform(size=SHAPE)<nan_fraction]=np.nan
+    return chl
+
+def stacked_statistics(days,geometric=0):
+    """count, mean and variance (ddof=1) of the stacked days, NaN where WelfordAccumulator gives NaN"""
+    stack=np.array(days)
+    if geometric==1:
+        stack=np.log10(stack)
+    count=np.sum(np.isfinite(stack),axis=0)
+    with np.errstate(invalid='ignore',divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore',RuntimeWarning)
+        mean=np.nanmean(stack,axis=0)
+        variance=np.where(count>1,np.nanvar(stack,axis=0,ddof=1),np.nan)
+    if geometric==1:
+        mean=10**mean
+    return count,mean,variance
+
+class WelfordTest(unittest.TestCase):
+    def assertStatistics(self,result,days,geometric=0):
+        count,mean,variance=stacked_statistics(days,geometric)
+        np.testing.assert_array_equal(result['count'],count)
+        np.testing.assert_allclose(result['mean'],mean,rtol=1e-12)
+        np.testing.assert_allclose(result['variance'],variance,rtol=1e-10)
+
+    def test_tiles(self):
+        """Days added a tile at a time, with pixels that are never (or only once) valid"""
+        rng=np.random.RandomState(1)
+        days=[random_day(rng) for _ in range(20)]
+        for day in days:
+            day[0,0]=np.nan #Never valid
+            day[0,1]=np.nan
+        days[3][0,1]=0.5 #Valid once, no variance
+        accumulator=WelfordAccumulator(SHAPE)
+        for day in days:
+            for rows,cols in iter_tiles(SHAPE,tile_rows=4,tile_cols=3):
+                accumulator.update(day[rows,cols],rows,cols)
+        result=accumulator.result()
+        self.assertStatistics(result,days)
+        self.assertEqual(result['count'][0,0],0)
+        self.assertTrue(np.isnan(result['mean'][0,0]))
+        self.assertEqual(result['count'][0,1],1)
+        self.assertTrue(np.isnan(result['variance'][0,1]))
+
+    def test_geometric(self):
+        """geometric=1 gives the geometric mean and the variance of log10(chl)"""
+        rng=np.random.RandomState(2)
+        days=[random_day(rng) for _ in range(15)]
+        accumulator=WelfordAccumulator(SHAPE,geometric=1)
+        for day in days:
+            accumulator.update(day)
+        self.assertStatistics(accumulator.result(),days,geometric=1)
+
+class CompositeFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.path=tempfile.mkdtemp()
+        rng=np.random.RandomState(3)
+        self.dates=[np.datetime64(str(year)+'-01-01')+day for year in [2001,2002] for day in range(12)]
+        self.dates+=[np.datetime64('2001-02-03'),np.datetime64('2002-02-03')]
+        self.days={}
+        self.files={}
+        for date in self.dates:
+            self.days[date]=random_day(rng)
+            self.files[date]=os.path.join(self.path,'daily',str(date)+'.nc')
+            self.write_day(self.files[date],self.days[date])
+        self.order=list(rng.permutation(len(self.dates))) #composite_files sorts the days itself
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_day(self,fileloc,chl):
+        os.makedirs(os.path.dirname(fileloc),exist_ok=True)
+        with netCDF4.Dataset(fileloc,'w') as ds:
+            ds.createDimension('lat',SHAPE[0])
+            ds.createDimension('lon',SHAPE[1])
+            ds.createVariable('lat','f4',('lat',))[:]=np.linspace(10,-10,SHAPE[0])
+            ds.createVariable('lon','f4',('lon',))[:]=np.linspace(-20,20,SHAPE[1])
+            ds.createVariable('chl_tpca','f8',('lat','lon'))[:]=chl
+
+    def test_periods(self):
+        """Every composite key matches the statistics of its stacked days"""
+        periods=['8day','8day_climatology','monthly_climatology']
+        dates=[self.dates[i] for i in self.order]
+        files=composite_files(dates,[self.files[date] for date in dates],os.path.join(self.path,'composites'),periods=periods,tile_rows=4)
+        expected={'8day':['2001-01-01','2001-01-09','2001-02-02','2002-01-01','2002-01-09','2002-02-02'],
+                  '8day_climatology':['001','009','033'],
+                  'monthly_climatology':['01','02']}
+        for period in periods:
+            composites={read_composite(fileloc)['attrs']['key']:read_composite(fileloc) for fileloc in files[period]}
+            self.assertEqual(sorted(composites),expected[period])
+            for key,composite in composites.items():
+                days=[self.days[date] for date in self.dates if period_bounds(date,period)[0]==key]
+                count,mean,variance=stacked_statistics(days)
+                np.testing.assert_array_equal(composite['count'],count)
+                np.testing.assert_allclose(composite['mean'],mean,rtol=1e-12)
+                np.testing.assert_allclose(composite['variance'],variance,rtol=1e-10)
+                self.assertEqual(composite['attrs']['n_days'],len(days))
+
+    def test_climatology_flush(self):
+        """A climatology key is written once its last day has been added, before any day of the next key"""
+        calls=[]
+        add_day=chl_composites._add_day
+        def recording_add_day(compositors,date,*args,**kwargs):
+            compositor=compositors[0]
+            calls.append((date,sorted(compositor.open),sorted(os.path.basename(f) for f in compositor.files)))
+            return add_day(compositors,date,*args,**kwargs)
+        with mock.patch('chl_composites._add_day',recording_add_day):
+            composite_files(self.dates,[self.files[date] for date in self.dates],os.path.join(self.path,'composites'),
+                            periods=['8day_climatology'],tile_rows=4)
+        keys=[period_bounds(date,'8day_climatology')[0] for date,_,_ in calls]
+        self.assertEqual(keys,sorted(keys)) #Fed key by key
+        for i,(date,open_keys,written) in enumerate(calls):
+            self.assertLessEqual(set(open_keys),{keys[i]}) #At most the key being added is open
+            finished=sorted(set(keys[:i])-{keys[i]})
+            self.assertEqual(written,['chl_tpca_8day_climatology_'+key+'.nc' for key in finished])
+
+
+if __name__ == '__main__':
+    unittest.main()
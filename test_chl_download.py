@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of chl_download against a local http.server stand in for the oceandata server (no network access needed).
+
+Includes:
+    StandInHandler
+        Serves in memory files with HTTP Range support, and can fail the first requests (503) or serve an HTML page.
+    DownloadTest
+        Range resume of a .part file, rejecting HTML / truncated / corrupted files, retries with capped exponential backoff,
+        and 4xx responses (other than 408 / 429) raised without retrying.
+
+Usage:
+    python test_chl_download.py
+    python -m pytest test_chl_download.py
+
+@author: npittman
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import chl_download
+from chl_download import download_file, download_files, load_manifest
+
+PAYLOAD=b'CDF\x01'+bytes(range(256))*400 #NetCDF3 signature and ~100 kB of data
+HTML=b'<html><body>Please log in</body></html>'
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Files are server.files {path: bytes}, server.failures {path: number of error responses (503, or server.status) before serving},
+    server.html {paths served as an HTML page}, server.truncate {paths whose body is cut short of the Content-Length}.
+    Every request is recorded as (path, Range header) in server.requests.
+    """
+    def do_GET(self):
+        server=self.server
+        with server.lock:
+            server.requests.append((self.path,self.headers.get('Range')))
+            failing=server.failures.get(self.path,0)>0
+            if failing:
+                server.failures[self.path]-=1
+        if failing:
+            self.send_error(server.status)
+            return
+        if self.path in server.html:
+            self._send(200,HTML,{'Content-Type':'text/html'})
+            return
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+        data=server.files[self.path]
+        start=0
+        if self.headers.get('Range') is not None:
+            start=int(self.headers['Range'].split('=')[1].split('-')[0])
+            if start>=len(data):
+                self.send_error(416)
+                return
+        body=data[start:]
+        headers={'Content-Type':'application/octet-stream','Content-Length':str(len(body))}
+        if self.path in server.truncate:
+            body=body[:len(body)//2]
+        if start>0:
+            headers['Content-Range']='bytes '+str(start)+'-'+str(len(data)-1)+'/'+str(len(data))
+        self._send(206 if start>0 else 200,body,headers)
+
+    def _send(self,status,body,headers):
+        self.send_response(status)
+        headers.setdefault('Content-Length',str(len(body)))
+        for key,value in headers.items():
+            self.send_header(key,value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,*args):
+        pass
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server=HTTPServer(('127.0.0.1',0),StandInHandler)
+        self.server.files={'/S2000001.L3m_DAY_RRS_Rrs_443_9km.nc':PAYLOAD,'/S2000002.L3m_DAY_RRS_Rrs_443_9km.nc':PAYLOAD[:50000]}
+        self.server.failures={}
+        self.server.status=503
+        self.server.html=set()
+        self.server.truncate=set()
+        self.server.requests=[]
+        self.server.lock=threading.Lock()
+        self.thread=threading.Thread(target=self.server.serve_forever,daemon=True)
+        self.thread.start()
+        self.base='http://127.0.0.1:'+str(self.server.server_address[1])
+        self.path=tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def url(self,day=1):
+        return self.base+'/S200000'+str(day)+'.L3m_DAY_RRS_Rrs_443_9km.nc'
+
+    def test_range_resume(self):
+        """An existing .part file is completed with a Range request for the remaining bytes"""
+        fileloc=os.path.join(self.path,'S2000001.L3m_DAY_RRS_Rrs_443_9km.nc')
+        with open(fileloc+'.part','wb') as f:
+            f.write(PAYLOAD[:30000])
+        fileloc,size,sha256=download_file(self.url(),self.path,printer=0)
+        self.assertEqual(self.server.requests,[('/S2000001.L3m_DAY_RRS_Rrs_443_9km.nc','bytes=30000-')])
+        with open(fileloc,'rb') as f:
+            self.assertEqual(f.read(),PAYLOAD)
+        self.assertEqual(size,len(PAYLOAD))
+        self.assertEqual(sha256,chl_download.file_sha256(fileloc))
+        self.assertFalse(os.path.exists(fileloc+'.part'))
+
+    def test_html_rejected(self):
+        """An HTML page (ie: a login redirect) is never renamed into place"""
+        self.server.html.add('/S2000001.L3m_DAY_RRS_Rrs_443_9km.nc')
+        with mock.patch('chl_download.time.sleep'):
+            with self.assertRaises(IOError):
+                download_file(self.url(),self.path,max_retries=2,printer=0)
+        self.assertEqual(os.listdir(self.path),[])
+        self.assertEqual(len(self.server.requests),3)
+
+    def test_truncated_rejected(self):
+        """A body shorter than its Content-Length fails the attempt, and is not renamed into place"""
+        self.server.truncate.add('/S2000001.L3m_DAY_RRS_Rrs_443_9km.nc')
+        with mock.patch('chl_download.time.sleep'):
+            with self.assertRaises(IOError):
+                download_file(self.url(),self.path,max_retries=1,printer=0)
+        self.assertFalse(os.path.exists(os.path.join(self.path,'S2000001.L3m_DAY_RRS_Rrs_443_9km.nc')))
+
+    def test_corrupted_redownloaded(self):
+        """A file with the manifest size but a different sha256 is downloaded again with checksum=1"""
+        urls=[self.url(1),self.url(2)]
+        download_files(urls,self.path,workers=2,printer=0)
+        manifest=load_manifest(self.path)
+        self.assertEqual(sorted(manifest),['S2000001.L3m_DAY_RRS_Rrs_443_9km.nc','S2000002.L3m_DAY_RRS_Rrs_443_9km.nc'])
+        fileloc=os.path.join(self.path,'S2000001.L3m_DAY_RRS_Rrs_443_9km.nc')
+        with open(fileloc,'r+b') as f: #Same size and header, corrupted data
+            f.seek(5000)
+            f.write(b'\x00'*100)
+        self.server.requests=[]
+        download_files(urls,self.path,workers=2,printer=0) #Size and header only, the corruption is not seen
+        self.assertEqual(self.server.requests,[])
+        download_files(urls,self.path,workers=2,checksum=1,printer=0)
+        self.assertEqual(self.server.requests,[('/S2000001.L3m_DAY_RRS_Rrs_443_9km.nc',None)])
+        with open(fileloc,'rb') as f:
+            self.assertEqual(f.read(),PAYLOAD)
+
+    def test_retry_backoff(self):
+        """Failed attempts are retried after min(backoff*2**n, max_backoff) seconds"""
+        self.server.failures['/S2000001.L3m_DAY_RRS_Rrs_443_9km.nc']=3
+        with mock.patch('chl_download.time.sleep') as sleep:
+            fileloc,size,_=download_file(self.url(),self.path,max_retries=5,backoff=1,max_backoff=3,printer=0)
+        self.assertEqual([call[0][0] for call in sleep.call_args_list],[1,2,3])
+        self.assertEqual(size,len(PAYLOAD))
+        self.assertEqual(len(self.server.requests),4)
+
+    def test_retries_exhausted(self):
+        """An IOError is raised once max_retries are exhausted, and download_files lists the failed url"""
+        self.server.failures['/S2000002.L3m_DAY_RRS_Rrs_443_9km.nc']=10
+        with mock.patch('chl_download.time.sleep') as sleep:
+            with self.assertRaises(IOError) as error:
+                download_files([self.url(1),self.url(2)],self.path,workers=2,max_retries=2,printer=0)
+        self.assertIn(self.url(2),str(error.exception))
+        self.assertNotIn(self.url(1),str(error.exception))
+        self.assertEqual(sleep.call_count,2)
+        self.assertTrue(os.path.exists(os.path.join(self.path,'S2000001.L3m_DAY_RRS_Rrs_443_9km.nc')))
+
+    def test_client_error_not_retried(self):
+        """A 404 is raised after one request, a 429 is retried"""
+        with mock.patch('chl_download.time.sleep') as sleep:
+            with self.assertRaises(IOError):
+                download_file(self.base+'/missing.nc',self.path,max_retries=5,printer=0)
+        self.assertEqual(len(self.server.requests),1)
+        self.assertEqual(sleep.call_count,0)
+        self.server.status=429
+        self.server.failures['/S2000001.L3m_DAY_RRS_Rrs_443_9km.nc']=2
+        with mock.patch('chl_download.time.sleep') as sleep:
+            fileloc,size,_=download_file(self.url(),self.path,max_retries=5,printer=0)
+        self.assertEqual(sleep.call_count,2)
+        self.assertEqual(size,len(PAYLOAD))
+
+    def test_download_files_client_error(self):
+        """download_files lists a url which is not found after a single request"""
+        with mock.patch('chl_download.time.sleep'):
+            with self.assertRaises(IOError) as error:
+                download_files([self.url(1),self.base+'/missing.nc'],self.path,workers=2,printer=0)
+        self.assertIn(self.base+'/missing.nc',str(error.exception))
+        self.assertEqual([request for request in self.server.requests if request[0]=='/missing.nc'],[('/missing.nc',None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the lookup table mode of chl_tpca_algorithms.
+
+Includes:
+    LutErrorTest
+        lut_error of every sensor's default coefficients and the NASA OCx / OCI polynomials stays under LUT_ERROR_BOUND,
+        and mode='lut' agrees with the exact sensor functions within the bound.
+
+Usage:
+    python test_chl_tpca_algorithms.py
+    python -m pytest test_chl_tpca_algorithms.py
+
+@author: npittman
+"""
+
+import unittest
+import numpy as np                   #Version '1.16.1'
+
+from chl_tpca_algorithms import SENSOR_FUNCTIONS, SENSOR_BANDS, LUT_ERROR_BOUND, lut_error, sensor_coefficients
+
+NASA_OCX_POLYS={'seawifs':[0.3272,-2.9940,2.7218,-1.2259,-0.5683],
+                'modis':[0.2424,-2.7423,1.8017,0.0015,-1.2280]}
+NASA_OCI_CI_POLY=[-0.4287,230.47]
+
+class LutErrorTest(unittest.TestCase):
+    def assertWithinBound(self,errors,label):
+        for kind in ['ocx','ci']:
+            self.assertLess(errors[kind],LUT_ERROR_BOUND[kind],label+' '+kind)
+
+    def test_sensor_defaults(self):
+        """The tables of the TPCA sensor function defaults"""
+        for sensor in SENSOR_FUNCTIONS:
+            coefficients=sensor_coefficients(sensor)
+            self.assertWithinBound(lut_error(coefficients['ocx_poly'],coefficients['ci_poly']),sensor)
+
+    def test_nasa_polynomials(self):
+        """The tables of the NASA OCx and OCI CI polynomials"""
+        for sensor,ocx_poly in NASA_OCX_POLYS.items():
+            self.assertWithinBound(lut_error(ocx_poly,NASA_OCI_CI_POLY),'NASA '+sensor)
+
+    def test_lut_mode(self):
+        """mode='lut' against the exact sensor functions, over band ratios and CI inside the tables"""
+        rng=np.random.RandomState(0)
+        for sensor,func in SENSOR_FUNCTIONS.items():
+            green=rng.uniform(0.001,0.006,100000)
+            blues=[green*rng.uniform(0.3,3,green.size) for _ in SENSOR_BANDS[sensor][:-2]]
+            bands=blues+[green,green*rng.uniform(0,0.3,green.size)]
+            exact=func(*bands)
+            lut=func(*bands,mode='lut')
+            self.assertLess(np.nanmax(np.abs(lut-exact)/exact),max(LUT_ERROR_BOUND.values()),sensor)
+
+
+if __name__ == '__main__':
+    unittest.main()